@@ -8,27 +8,31 @@ indicates the effects of changes to the scaling and offsets.
 """
 
 
-from pkg_resources import require
-require('numpy>=1.10.1')
-require('scipy>=0.10.1')
-require('matplotlib>=1.3.1')
-require('cothread>=2.13')
+from versions import require_versions
+require_versions('numpy>=1.10.1', 'scipy>=0.10.1', 'matplotlib>=1.3.1',
+                 'cothread>=2.13')
 
+import os
 import sys
 import cothread
-from cothread.catools import camonitor, FORMAT_CTRL
+from cothread.catools import FORMAT_CTRL
 from matplotlib.backends.backend_qt4agg import (
     NavigationToolbar2QT as NavigationToolbar)
 from PyQt4 import uic, QtGui, QtCore
 from PyQt4.QtGui import QMainWindow
-import os
-import traceback
 
 import plots
 import magnet_jogs
+from common_ui import CommonGui
 import straight
 import controls
 import writers
+from instrumentation import Stages, StartupReport
+
+
+# Steps of starting the GUI, from when the process started.
+STARTUP = StartupReport()
+STARTUP.mark('imports')
 
 
 # Alarm colours
@@ -41,7 +45,7 @@ ALARM_COLORS = [
         ]
 
 
-class AccelGui(QMainWindow):
+class AccelGui(QMainWindow, CommonGui):
 
     """
     GUI for the accelerator physicists.
@@ -53,6 +57,11 @@ class AccelGui(QMainWindow):
     """
 
     UI_FILENAME = 'acceleratorui.ui'
+    # PVs used by the simulation, jogs and table; the traces are not needed.
+    PV_GROUPS = [
+        controls.Arrays.OFFSETS, controls.Arrays.SCALES,
+        controls.Arrays.SET_SCALES, controls.Arrays.SETI,
+        controls.Arrays.IMIN, controls.Arrays.IMAX, controls.Arrays.ERRORS]
     HIGHLIGHT_COLOR = QtGui.QColor(235, 235, 235) # Light grey
 
     class Columns(object):
@@ -74,9 +83,18 @@ class AccelGui(QMainWindow):
         self.ui = uic.loadUi(filename)
         self.parent = QtGui.QMainWindow()
 
+        # Connect the PVs in the background and show the window while they
+        # connect, with placeholders in the table.
+        self.pv_monitor = controls.PvMonitors.get_instance()
+        self.pv_monitor.connect(self.PV_GROUPS, wait=False)
+        self.setup_table()
+        self.ui.statusBar().showMessage('Connecting to PVs...')
+        self.ui.show()
+        QtGui.QApplication.processEvents()
+        STARTUP.mark('window')
+
         # Get instances of required classes.
         self.straight = straight.Straight()
-        self.pv_monitor = controls.PvMonitors.get_instance()
         self.simcontrol = straight.SimModeController()
         self.realcontrol = straight.RealModeController()
         self.pv_writer = writers.PvWriter()
@@ -85,41 +103,39 @@ class AccelGui(QMainWindow):
         # Register listeners.
         self.realcontrol.register_straight(self.straight)
         self.pv_monitor.register_straight_listener(self.update_table)
+        self.pv_monitor.register_straight_listener(
+            lambda changes: self.update_jog_buttons(), batch=True)
 
         # Set up simulation, toolbar and table in the GUI.
         self.simulation = plots.Simulation(self.straight)
         self.toolbar = NavigationToolbar(self.simulation, self)
-        self.setup_table()
 
-        # Initial settings for GUI: connected to PVs and jog scale = 1.
+        # Queue jogs in front of each writer.
+        self.pv_queue = writers.JogQueue(
+            self.pv_writer, self.jog_error, self.update_shading)
+        self.sim_queue = writers.JogQueue(
+            self.sim_writer, self.jog_error, self.update_sim)
+
+        # Initial settings for GUI: connected to PVs.
         self.writer = self.pv_writer
-        self.jog_scale = 1.0
+        self.queue = self.pv_queue
 
         # Connect buttons to PVs.
-        self.ui.kplusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.STEP_K3, 1))
-        self.ui.kminusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.STEP_K3, -1))
-        self.ui.bumpleftplusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.BUMP_LEFT, 1))
-        self.ui.bumpleftminusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.BUMP_LEFT, -1))
-        self.ui.bumprightplusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.BUMP_RIGHT, 1))
-        self.ui.bumprightminusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.BUMP_RIGHT, -1))
-        self.ui.bpm1plusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.BPM1, 1))
-        self.ui.bpm1minusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.BPM1, -1))
-        self.ui.bpm2plusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.BPM2, 1))
-        self.ui.bpm2minusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.BPM2, -1))
-        self.ui.scaleplusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.SCALE, 1))
-        self.ui.scaleminusButton.clicked.connect(
-            lambda: self.jog_handler(magnet_jogs.Moves.SCALE, -1))
+        self.jog_buttons = [
+            (self.ui.kplusButton, magnet_jogs.Moves.STEP_K3, 1),
+            (self.ui.kminusButton, magnet_jogs.Moves.STEP_K3, -1),
+            (self.ui.bumpleftplusButton, magnet_jogs.Moves.BUMP_LEFT, 1),
+            (self.ui.bumpleftminusButton, magnet_jogs.Moves.BUMP_LEFT, -1),
+            (self.ui.bumprightplusButton, magnet_jogs.Moves.BUMP_RIGHT, 1),
+            (self.ui.bumprightminusButton, magnet_jogs.Moves.BUMP_RIGHT, -1),
+            (self.ui.bpm1plusButton, magnet_jogs.Moves.BPM1, 1),
+            (self.ui.bpm1minusButton, magnet_jogs.Moves.BPM1, -1),
+            (self.ui.bpm2plusButton, magnet_jogs.Moves.BPM2, 1),
+            (self.ui.bpm2minusButton, magnet_jogs.Moves.BPM2, -1),
+            (self.ui.scaleplusButton, magnet_jogs.Moves.SCALE, 1),
+            (self.ui.scaleminusButton, magnet_jogs.Moves.SCALE, -1),
+        ]
+        self.connect_jogs()
 
         self.ui.simButton.setChecked(False)
         self.ui.simButton.clicked.connect(self.toggle_simulation)
@@ -127,29 +143,44 @@ class AccelGui(QMainWindow):
         self.ui.resetButton.setEnabled(False)
         self.ui.quitButton.clicked.connect(sys.exit)
 
-        self.ui.jog_scale_slider.valueChanged.connect(self.set_jog_scaling)
-        self.ui.jog_scale_textbox.setText(str(self.jog_scale))
-
         # Monitor the states of magnets, BURT and cycling.
-        camonitor(controls.PvReferences.BURT_STATUS_PV, self.update_burt_led)
-        camonitor(controls.PvReferences.MAGNET_STATUS_PV,
-                  self.update_magnet_led, format=FORMAT_CTRL)
-        camonitor(controls.PvReferences.CYCLING_STATUS_PV,
-                  self.update_cycling_textbox, format=FORMAT_CTRL)
+        self.pv_monitor.backend.camonitor(
+                controls.PvReferences.BURT_STATUS_PV, self.update_burt_led)
+        self.pv_monitor.backend.camonitor(
+                controls.PvReferences.MAGNET_STATUS_PV,
+                self.update_magnet_led, format=FORMAT_CTRL)
+        self.pv_monitor.backend.camonitor(
+                controls.PvReferences.CYCLING_STATUS_PV,
+                self.update_cycling_textbox, format=FORMAT_CTRL)
 
         # Add simulation and toolbar to the GUI.
         self.ui.matplotlib_layout.addWidget(self.simulation)
         self.ui.matplotlib_layout.addWidget(self.toolbar)
 
+        self.start_status()
+
         # Add shading to indicate ranges over which photon beams sweep, and
         # dotted lines indicating limits of magnet tolerances.
         self.simulation.update_colourin()
         self.simulation.magnet_limits()
+        self.update_jog_buttons()
+
+        STARTUP.mark('constructed')
+        cothread.Spawn(self.report_startup)
 
-    def set_jog_scaling(self):
-        """Change the scaling applied to magnet corrections."""
-        self.jog_scale = self.ui.jog_scale_slider.value() * 0.1
-        self.ui.jog_scale_textbox.setText(str(self.jog_scale))
+    def report_startup(self):
+        """Time the connection of the PVs and publish the startup report."""
+        self.pv_monitor.connect(self.PV_GROUPS)
+        STARTUP.mark('connected')
+        STARTUP.publish()
+
+    def headroom(self):
+        """Return the headroom of each jog move, simulated or from PVs."""
+        knobs = self.pv_writer.magnet_coordinator
+        if self.ui.simButton.isChecked():
+            return knobs.calculate_headroom(
+                self.simcontrol.offsets, self.simcontrol.scales)
+        return knobs.headroom
 
     def toggle_simulation(self):
         """
@@ -164,21 +195,30 @@ class AccelGui(QMainWindow):
 
         if enabled:
             self.writer = self.sim_writer
+            self.queue = self.sim_queue
             self.realcontrol.deregister_straight(self.straight)
             self.simcontrol.register_straight(self.straight)
-            self.update_shading()
+            self.update_sim()
             self.simulation.figure.patch.set_alpha(0.5)
+            self.simulation.draw_idle()
         else:
             self.writer = self.pv_writer
+            self.queue = self.pv_queue
             self.simcontrol.deregister_straight(self.straight)
             self.realcontrol.register_straight(self.straight)
-            self.update_shading()
+            self.update_sim()
             self.simulation.figure.patch.set_alpha(0.0)
+            self.simulation.draw_idle()
 
     def update_shading(self):
         """Update the x-ray beam range shading."""
         self.simulation.update_colourin()
 
+    def update_sim(self):
+        """Update the shading and jog buttons after a simulated jog."""
+        self.update_shading()
+        self.update_jog_buttons()
+
     def update_cycling_textbox(self, var):
         """Update cycling status from enum attached to PV."""
         self.ui.cycling_textbox_2.setText(QtCore.QString('%s' % var.enums[var]))
@@ -224,7 +264,7 @@ class AccelGui(QMainWindow):
         # Initialise items in all table cells
         for row in range(table.rowCount()):
             for col in range(table.columnCount()):
-                item = QtGui.QTableWidgetItem(QtCore.QString('No Data'))
+                item = QtGui.QTableWidgetItem(QtCore.QString('Connecting'))
                 item.setTextAlignment(QtCore.Qt.AlignCenter)
                 item.setFlags(QtCore.Qt.ItemIsEnabled)
                 if col in [self.Columns.MAX, self.Columns.MIN]:
@@ -236,77 +276,65 @@ class AccelGui(QMainWindow):
         table.horizontalHeader().setResizeMode(QtGui.QHeaderView.Stretch)
 
     def update_table(self, key, index):
-        """When this is called the table values and cache are updated."""
+        """When this is called the table values are updated."""
         # TODO: connect table to simulation mode!!
         if key == controls.Arrays.IMAX:
             self.update_float(self.pv_monitor.get_max_currents()[index],
                               index, self.Columns.MAX)
+            self.update_limits(index)
 
         elif key == controls.Arrays.IMIN:
             self.update_float(self.pv_monitor.get_min_currents()[index],
                             index, self.Columns.MIN)
+            self.update_limits(index)
 
         elif key == controls.Arrays.OFFSETS:
             self.update_float(self.pv_monitor.get_offsets()[index],
                               index, self.Columns.OFFSET)
-            self.update_cache(self.pv_monitor.get_cache(), index)
+            self.update_limits(index)
 
         elif key == controls.Arrays.SETI:
             self.update_float(self.pv_monitor.get_actual_offsets()[index],
                               index, self.Columns.SETI)
 
         elif key == controls.Arrays.ERRORS:
-            self.update_alarm(self.pv_monitor.get_errors()[index],
-                              index, self.Columns.ERRORS)
+            self.update_alarm(
+                self.pv_monitor.get_errors()[index],
+                self.pv_monitor.get_severities(controls.Arrays.ERRORS)[index],
+                index, self.Columns.ERRORS)
 
         elif key == controls.Arrays.SCALES:
-            self.update_cache(self.pv_monitor.get_cache(), index)
+            self.update_limits(index)
+
+        self.timings.record_since(Stages.TABLE, self.timings.origin)
 
     def update_float(self, var, row, col):
         """Update a table widget populated with a float."""
         item = self.ui.table_widget.item(row, col)
         item.setText(QtCore.QString('%.3f' % var))
 
-    def update_alarm(self, var, row, col):
+    def update_alarm(self, text, severity, row, col):
         """Update an alarm sensitive table widget."""
         item = self.ui.table_widget.item(row, col)
-        item.setForeground(QtGui.QBrush(ALARM_COLORS[var.severity]))
+        item.setForeground(QtGui.QBrush(ALARM_COLORS[severity]))
         item.setBackground(QtGui.QBrush(ALARM_BACKGROUND))
-        item.setText(QtCore.QString(var))
-
-    def update_cache(self, cache, index):
-        """Update cached values of offsets and scales for the table."""
-        high = (cache['%02d' % index][controls.Arrays.OFFSETS] +
-                cache['%02d' % index][controls.Arrays.SCALES])
-        low = (cache['%02d' % index][controls.Arrays.OFFSETS] -
-               cache['%02d' % index][controls.Arrays.SCALES])
-        self.update_float(high, index, self.Columns.HIGH)
-        self.update_float(low, index, self.Columns.LOW)
-
-    def jog_handler(self, key, factor):
-        """
-        Handle button clicks.
+        item.setText(QtCore.QString(text))
 
-        When button clicked this class sends information to the writer and
-        provides exception handling in callbacks.
-        """
-        try:
-            self.writer.write(key, factor * self.jog_scale)
-            self.update_shading()
-
-        except magnet_jogs.OverCurrentException, e:
-            self.flash_table_cell(self.Columns.OFFSET, e.magnet_index)
-        except (cothread.catools.ca_nothing, cothread.cadef.CAException), e:
-            print 'Cothread Exception:', e
-            msgBox = QtGui.QMessageBox(self.parent)
-            msgBox.setText('Cothread Exception: %s' % e)
-            msgBox.exec_()
-        except StandardError, e:
-            print 'Unexpected Exception:', e
-            msgBox = QtGui.QMessageBox(self.parent)
-            msgBox.setText('Unexpected Exception: %s' % e)
-            msgBox.setInformativeText(traceback.format_exc(3))
-            msgBox.exec_()
+    def update_limits(self, index):
+        """Update the high and low currents of a magnet and its headroom."""
+        self.update_float(self.pv_monitor.get_highs()[index],
+                          index, self.Columns.HIGH)
+        self.update_float(self.pv_monitor.get_lows()[index],
+                          index, self.Columns.LOW)
+        tooltip = 'Headroom: %.3f' % self.pv_monitor.get_headroom()[index]
+        for col in [self.Columns.HIGH, self.Columns.LOW]:
+            self.ui.table_widget.item(index, col).setToolTip(tooltip)
+
+
+    def over_current(self, e):
+        """Flash the offsets of the magnets a jog would take too far."""
+        for index in e.magnet_indices:
+            self.flash_table_cell(self.Columns.OFFSET, index)
 
     def reset(self):
         """
@@ -316,7 +344,7 @@ class AccelGui(QMainWindow):
         """
         if self.ui.simButton.isChecked():
             self.writer.reset()
-            self.update_shading()
+            self.update_sim()
 
 
 def main():
@@ -0,0 +1,236 @@
+#!/usr/bin/env dls-python2.7
+"""Analysis of the trigger and x-ray intensity traces of the I10 chicane.
+
+Finds the edges of the square wave trigger signal and uses them to cut the
+two x-ray peaks out of the beam intensity trace, so that they can be
+overlaid and compared. Everything works on whole NumPy arrays; nothing here
+depends on Qt or channel access.
+"""
+
+
+import numpy as np
+
+
+# Minimum step between trigger samples that counts as an edge.
+TRIGGER_THRESHOLD = 0.5
+# Number of peak area measurements kept in an AreaHistory.
+HISTORY_LENGTH = 100000
+
+
+class RangeError(Exception):
+
+    """Raised when the trace data is partially cut off."""
+
+    pass
+
+
+class AreaHistory(object):
+
+    """
+    Fixed size history of timestamped peak areas and their ratio.
+
+    The history is preallocated and appending overwrites the oldest entry.
+    Each entry is written twice, size rows apart, so that the history is
+    always available, oldest first, as a contiguous view.
+    """
+
+    TIME = 0
+    FIRST = 1
+    SECOND = 2
+    RATIO = 3
+
+    def __init__(self, size=HISTORY_LENGTH):
+        self.size = size
+        self.data = np.empty((2 * size, 4))
+        self.index = 0
+        self.count = 0
+
+    def append(self, timestamp, first_area, second_area):
+        """
+        Add peak areas to the history.
+
+        Args:
+            timestamp (float): time of the measurement in seconds
+            first_area (float): area of the first peak
+            second_area (float): area of the second peak
+        """
+        ratio = first_area / second_area if second_area else float('nan')
+        entry = (timestamp, first_area, second_area, ratio)
+        self.data[self.index] = entry
+        self.data[self.index + self.size] = entry
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def get(self):
+        """
+        Return the history.
+
+        Returns:
+            numpy array: view with a row per entry, oldest first, and columns
+            TIME, FIRST, SECOND and RATIO
+        """
+        start = self.index + self.size - self.count
+        return self.data[start:start + self.count]
+
+
+def find_edges(trigger, threshold=TRIGGER_THRESHOLD):
+    """
+    Find the first rising and first falling edges of the trigger.
+
+    Args:
+        trigger (numpy array): square wave trigger signal
+        threshold (float): minimum step between samples counted as an edge
+    Returns:
+        rising (int): index of the sample before the first rising edge
+        falling (int): index of the sample before the first falling edge
+    Raises:
+        RangeError: if the trigger does not both rise and fall
+    """
+    diff = np.diff(np.asarray(trigger, dtype=float))
+    rising = diff > threshold
+    falling = diff < -threshold
+    if not rising.any() or not falling.any():
+        raise RangeError
+    return int(np.argmax(rising)), int(np.argmax(falling))
+
+
+def find_all_edges(trigger, threshold=TRIGGER_THRESHOLD):
+    """
+    Find every rising and falling edge of the trigger.
+
+    Args:
+        trigger (numpy array): square wave trigger signal
+        threshold (float): minimum step between samples counted as an edge
+    Returns:
+        rising (numpy array): indices of the samples before rising edges
+        falling (numpy array): indices of the samples before falling edges
+    """
+    diff = np.diff(np.asarray(trigger, dtype=float))
+    return _run_starts(diff > threshold), _run_starts(diff < -threshold)
+
+
+def _run_starts(mask):
+    """Return the indices at which each run of True values in mask starts."""
+    previous = np.concatenate(([False], mask[:-1]))
+    return np.flatnonzero(mask & ~previous)
+
+
+def window_peaks(trigger, trace, threshold=TRIGGER_THRESHOLD):
+    """
+    Cut the two x-ray peaks out of the trace.
+
+    A trigger period is twice the distance between the first two edges.
+    Each peak is the half period of the trace starting a quarter period
+    after an edge, with the peak following the earlier edge first so that
+    the colours of the overlaid peaks do not swap around.
+
+    Args:
+        trigger (numpy array): square wave trigger signal
+        trace (numpy array): x-ray beam intensity trace
+        threshold (float): minimum step between samples counted as an edge
+    Returns:
+        first_peak (numpy array): trace following the earlier edge
+        second_peak (numpy array): trace following the later edge
+    Raises:
+        RangeError: if the trace does not contain a full trigger period
+    """
+    trace = np.asarray(trace)
+    rising, falling = find_edges(trigger, threshold)
+    period = abs(falling - rising) * 2
+    if len(trace) < period:
+        raise RangeError
+
+    first_peak, second_peak = [
+        _window(trace, edge + period // 4, period)
+        for edge in sorted((rising, falling))]
+    return first_peak, second_peak
+
+
+def _window(trace, start, period):
+    """
+    Take half a trigger period of the trace from start.
+
+    The window is a view of the trace unless it would run past the end of
+    the trace, in which case it wraps around within the first period.
+    """
+    start %= period
+    length = period // 2
+    if start + length <= len(trace):
+        return trace[start:start + length]
+    return np.take(trace[:period], np.arange(start, start + length),
+                   mode='wrap')
+
+
+def stack_peaks(trigger, trace, threshold=TRIGGER_THRESHOLD):
+    """
+    Cut the two x-ray peaks out of every trigger period of the trace.
+
+    Windows are placed as in window_peaks, but after every edge of the
+    trigger, plus one period before the first edge, keeping those that lie
+    entirely within the trace.
+
+    Args:
+        trigger (numpy array): square wave trigger signal
+        trace (numpy array): x-ray beam intensity trace
+        threshold (float): minimum step between samples counted as an edge
+    Returns:
+        first_peaks (numpy array): one row per period, as first_peak
+        second_peaks (numpy array): one row per period, as second_peak
+    Raises:
+        RangeError: if the trace does not contain both peaks
+    """
+    trace = np.asarray(trace)
+    rising, falling = find_edges(trigger, threshold)
+    period = abs(falling - rising) * 2
+    length = period // 2
+    edges = find_all_edges(trigger, threshold)
+    if falling < rising:
+        edges = edges[::-1]
+
+    peaks = []
+    for edge in edges:
+        starts = edge + period // 4
+        starts = np.concatenate(([starts[0] - period], starts))
+        starts = starts[(starts >= 0) & (starts + length <= len(trace))]
+        if not len(starts):
+            raise RangeError
+        peaks.append(trace[starts[:, np.newaxis] + np.arange(length)])
+
+    first_peaks, second_peaks = peaks
+    return first_peaks, second_peaks
+
+
+def peak_area(peak):
+    """
+    Return the area under a peak by Simpson's rule.
+
+    scipy.integrate is slow to import, so it is only imported when the
+    first area is calculated.
+
+    Args:
+        peak (numpy array): x-ray beam intensity trace of the peak
+    Returns:
+        float: area under the peak
+    """
+    from scipy import integrate
+    return integrate.simps(peak)
+
+
+def average_peaks(trigger, trace, threshold=TRIGGER_THRESHOLD):
+    """
+    Average the two x-ray peaks over every trigger period of the trace.
+
+    Args:
+        trigger (numpy array): square wave trigger signal
+        trace (numpy array): x-ray beam intensity trace
+        threshold (float): minimum step between samples counted as an edge
+    Returns:
+        means (tuple): mean first and second peaks
+        stds (tuple): standard deviations of the first and second peaks
+    Raises:
+        RangeError: if the trace does not contain both peaks
+    """
+    peaks = stack_peaks(trigger, trace, threshold)
+    means = tuple(p.mean(axis=0) for p in peaks)
+    stds = tuple(p.std(axis=0) for p in peaks)
+    return means, stds
@@ -0,0 +1,565 @@
+#!/usr/bin/env dls-python2.7
+"""Headless analysis of the x-ray traces of the I10 chicane.
+
+Windows the two x-ray peaks out of each acquisition of the traces and
+calculates their areas once, however many viewers there are. Results are
+handed to outputs: a LocalOutput passes them to subscribers in the same
+process, such as the beamline GUI plots, and a PvOutput puts them to the
+soft PVs of an IOC so that they are available without a GUI open. Viewers
+use results_source, which takes the results from those PVs if
+I10_ANALYSIS_SOURCE is set to 'pvs', and otherwise analyses the traces in
+the viewer's process. AnalysisService is a singleton and users should use
+get_instance.
+
+The analysis can be moved off the cothread that drives Qt into a worker
+thread by setting I10_ANALYSIS_WORKER to 'thread'. Results then arrive
+asynchronously, and acquisitions that arrive while the worker is busy are
+dropped except for the latest. The headless service can instead use a
+worker process reading the traces from shared memory. A process is forked,
+which is only safe before channel access and Qt have started their
+threads, so the GUIs only use a worker thread.
+
+Run as a script to analyse the traces and publish the results to PVs:
+
+    dls-python analysis_service.py
+"""
+
+
+from versions import require_versions
+if __name__ == '__main__':
+    require_versions('numpy==1.11.1', 'scipy==0.10.1', 'cothread==2.13')
+
+import argparse
+import multiprocessing
+import os
+import Queue
+import threading
+import time
+import traceback
+
+import cothread
+import numpy as np
+from cothread.catools import FORMAT_TIME
+
+import analysis
+from analysis import RangeError
+from controls import Arrays, PvMonitors, PvReferences
+from instrumentation import Stages, Timings
+
+
+# Samples of trace a worker process is started for by the headless service.
+WORKER_CAPACITY = 1000000
+# Environment variable that, set to 'pvs', takes results from the PVs.
+SOURCE_VARIABLE = 'I10_ANALYSIS_SOURCE'
+# Seconds without a result after which a headless service's last is stale.
+SERVICE_STALE_TIME = 10.0
+
+
+class AnalysisResult(object):
+
+    """
+    Peaks cut from one acquisition of the traces and their areas.
+
+    Attributes:
+        timestamp (float): time the acquisition was analysed, or given to
+            a worker to analyse
+        peaks (tuple): first and second peaks, as numpy arrays
+        areas (tuple): areas under the first and second peaks
+        ratio (float): first area over second area, NaN if the second is 0
+        valid (bool): False if the trace was cut off, when the peaks and
+            areas are NaN
+        stale (bool): True if this is the last result of a headless service
+            that has stopped publishing
+    """
+
+    def __init__(self, timestamp, peaks, areas, valid=True, stale=False):
+        self.timestamp = timestamp
+        self.peaks = tuple(peaks)
+        self.areas = tuple(areas)
+        self.ratio = (areas[0] / areas[1]) if areas[1] else float('nan')
+        self.valid = valid
+        self.stale = stale
+
+    @classmethod
+    def cut_off(cls, timestamp):
+        """Return the result of an acquisition whose trace is cut off."""
+        nan = float('nan')
+        return cls(timestamp, [np.array([nan, nan])] * 2, [nan, nan],
+                   valid=False)
+
+
+def analyse_peaks(trigger, trace, threshold, average_periods):
+    """
+    Window the peaks of an acquisition and find their areas.
+
+    Args:
+        trigger (numpy array): square wave trigger signal
+        trace (numpy array): x-ray beam intensity trace
+        threshold (float): minimum step between samples counted as an edge
+        average_periods (bool): whether to average the peaks over every
+            trigger period rather than cut them from the first
+    Returns:
+        peaks (tuple): first and second peaks
+        areas (list): areas under the first and second peaks
+    Raises:
+        RangeError: if the trace is cut off
+    """
+    if average_periods:
+        peaks, _ = analysis.average_peaks(trigger, trace, threshold)
+    else:
+        peaks = analysis.window_peaks(trigger, trace, threshold)
+    return peaks, [analysis.peak_area(peak) for peak in peaks]
+
+
+def _serve_requests(buffer, capacity, requests, results):
+    """
+    Analyse the acquisitions in the buffer as requested, until told to stop.
+
+    Each request is (length, threshold, average_periods, timestamp) for the
+    trigger and trace in the first length samples of the rows of the
+    buffer. Every request is answered with (result, error, seconds taken),
+    where the result is not valid if the acquisition could not be analysed
+    and the error then describes why, so that one bad acquisition does not
+    stop the worker.
+    """
+    traces = np.frombuffer(buffer, dtype=float).reshape(2, capacity)
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        length, threshold, average_periods, timestamp = request
+        start = time.time()
+        try:
+            peaks, areas = analyse_peaks(traces[0, :length],
+                                         traces[1, :length],
+                                         threshold, average_periods)
+            # Copy the peaks out of the buffer before it is reused.
+            result = AnalysisResult(timestamp,
+                                    [np.array(peak) for peak in peaks], areas)
+            error = None
+        except RangeError:
+            result, error = AnalysisResult.cut_off(timestamp), None
+        except Exception:
+            result = AnalysisResult.cut_off(timestamp)
+            error = traceback.format_exc()
+        results.put((result, error, time.time() - start))
+
+
+class AnalysisWorker(object):
+
+    """
+    Analyse acquisitions in a worker process or thread.
+
+    The trigger and trace are copied into a buffer shared with the worker,
+    in shared memory for a process, and only one acquisition is analysed at
+    a time. Acquisitions submitted while the worker is busy replace each
+    other, so only the latest is analysed next and stale ones are dropped.
+    Results are passed to the callback on the cothread thread.
+
+    A worker thread is restarted with a larger buffer when a longer trace
+    arrives. A worker process is forked, which is only safe before channel
+    access and Qt start their threads, so it should be given a capacity to
+    be started with, and traces longer than that are passed on as not valid
+    without being analysed.
+    """
+
+    def __init__(self, callback, process=True, capacity=0):
+        """
+        Args:
+            callback (function): called as callback(result, seconds) with
+                each AnalysisResult and the seconds taken to analyse it, or
+                None if it was not analysed
+            process (bool): whether to use a process rather than a thread
+            capacity (int): samples of trace to start the worker for now,
+                or 0 to start it for the first trace submitted
+        """
+        self.callback = callback
+        self.process = process
+        self.capacity = 0
+        self.worker = None
+        self.busy = False
+        self.pending = None
+        self.dropped = 0
+        self.too_long_reported = False
+        if capacity:
+            self._start(capacity)
+
+    def submit(self, trigger, trace, threshold, average_periods):
+        """
+        Analyse an acquisition when the worker is free.
+
+        Args:
+            trigger (numpy array): square wave trigger signal
+            trace (numpy array): x-ray beam intensity trace
+            threshold (float): minimum step between samples counted as an
+                edge
+            average_periods (bool): whether to average the peaks over every
+                trigger period
+        """
+        request = (trigger, trace, threshold, average_periods, time.time())
+        if self.busy:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = request
+        else:
+            self._send(*request)
+
+    def _send(self, trigger, trace, threshold, average_periods, timestamp):
+        """Copy an acquisition into the buffer and ask the worker for it."""
+        length = min(len(trigger), len(trace))
+        if length > self.capacity:
+            if self.process and self.worker is not None:
+                if not self.too_long_reported:
+                    print ('Trace of %d samples is longer than the %d the '
+                           'analysis worker can take' % (length,
+                                                         self.capacity))
+                    self.too_long_reported = True
+                # Pass it on after any result that is being finished.
+                cothread.Callback(self.callback,
+                                  AnalysisResult.cut_off(timestamp), None)
+                return
+            self._start(length)
+        self.traces[0, :length] = trigger[:length]
+        self.traces[1, :length] = trace[:length]
+        self.busy = True
+        self.requests.put((length, threshold, average_periods, timestamp))
+
+    def _start(self, capacity):
+        """Start a worker with a buffer for traces of up to capacity."""
+        self.close()
+        self.capacity = capacity
+        if self.process:
+            buffer = multiprocessing.RawArray('d', 2 * capacity)
+            self.requests = multiprocessing.Queue()
+            self.results = multiprocessing.Queue()
+            self.worker = multiprocessing.Process(
+                target=_serve_requests,
+                args=(buffer, capacity, self.requests, self.results))
+        else:
+            buffer = np.empty(2 * capacity)
+            self.requests = Queue.Queue()
+            self.results = Queue.Queue()
+            self.worker = threading.Thread(
+                target=_serve_requests,
+                args=(buffer, capacity, self.requests, self.results))
+        self.traces = np.frombuffer(buffer, dtype=float).reshape(2, capacity)
+        self.worker.daemon = True
+        self.worker.start()
+        self.receiver = threading.Thread(target=self._receive,
+                                         args=(self.results,))
+        self.receiver.daemon = True
+        self.receiver.start()
+
+    def _receive(self, results):
+        """Hand each result to the cothread thread, until the worker stops."""
+        while True:
+            answer = results.get()
+            if answer is None:
+                return
+            cothread.Callback(self._finish, *answer)
+
+    def _finish(self, result, error, seconds):
+        """Send the latest pending acquisition, then pass on the result."""
+        self.busy = False
+        if self.pending is not None:
+            request, self.pending = self.pending, None
+            self._send(*request)
+        if error is not None:
+            print 'Analysis failed:', error
+        self.callback(result, seconds)
+
+    def close(self):
+        """Stop the worker, once the results it has are passed on."""
+        if self.worker is not None:
+            self.requests.put(None)
+            self.worker.join()
+            self.results.put(None)
+            self.receiver.join()
+            self.worker = None
+            self.busy = False
+
+
+class AbstractOutput(object):
+
+    """Destination for the results of the analysis service."""
+
+    def publish(self, result):
+        """
+        Hand on the result of analysing one acquisition.
+
+        Args:
+            result (AnalysisResult): peaks and areas of the acquisition
+        """
+        raise NotImplementedError()
+
+
+class LocalOutput(AbstractOutput):
+
+    """Pass results to subscribers in the same process."""
+
+    def __init__(self):
+        self.subscribers = []
+        self.latest = None
+
+    def subscribe(self, callback):
+        """
+        Add a function to be called with each result.
+
+        Args:
+            callback (function): called as callback(result)
+        """
+        self.subscribers.append(callback)
+
+    def publish(self, result):
+        self.latest = result
+        for callback in self.subscribers:
+            callback(result)
+
+
+class PvOutput(AbstractOutput):
+
+    """Put results to the soft PVs of an IOC."""
+
+    def __init__(self):
+        self.backend = PvMonitors.get_instance().backend
+
+    def publish(self, result):
+        # The ratio is put last, as subscribers take it to mean that the
+        # rest of the result has arrived.
+        self.backend.caput(PvReferences.PEAK_PVS, list(result.peaks),
+                           wait=False)
+        self.backend.caput(
+            PvReferences.AREA_PVS + [PvReferences.RATIO_PV],
+            list(result.areas) + [result.ratio], wait=False)
+
+
+class PvSubscriber(object):
+
+    """
+    Results of a headless analysis service, taken from its PVs.
+
+    Provides the latest result and subscribe like AnalysisService, so that
+    viewers can show the service's results without analysing the traces
+    themselves. A result is passed on when its ratio arrives, which the
+    service puts after the peaks and areas. The PVs are monitored without
+    waiting for them to connect, so latest is None until the first result
+    arrives, and if no result arrives for SERVICE_STALE_TIME the last one
+    is passed on again marked as stale.
+    """
+
+    PVS = PvReferences.PEAK_PVS + PvReferences.AREA_PVS + [
+        PvReferences.RATIO_PV]
+
+    def __init__(self):
+        self.backend = PvMonitors.get_instance().backend
+        self.local = LocalOutput()
+        # The service's threshold is not published, so use the default.
+        self.trigger_threshold = analysis.TRIGGER_THRESHOLD
+        self.values = [None] * len(self.PVS)
+        self.last_arrival = None
+        for index, pv in enumerate(self.PVS):
+            self.backend.camonitor(
+                pv, lambda value, i=index: self.update(i, value),
+                format=FORMAT_TIME)
+        self.stale_timer = cothread.Timer(
+            SERVICE_STALE_TIME, self.check_stale, retrigger=True)
+
+    @property
+    def latest(self):
+        """The last result published by the service, or None."""
+        return self.local.latest
+
+    def subscribe(self, callback):
+        """Call callback(result) with each result the service publishes."""
+        self.local.subscribe(callback)
+
+    def update(self, index, value):
+        """Store a PV value, and pass on the result when its ratio arrives."""
+        self.values[index] = value
+        if (self.PVS[index] == PvReferences.RATIO_PV and
+                all(v is not None for v in self.values)):
+            self.last_arrival = time.time()
+            self.local.publish(self.result())
+
+    def check_stale(self):
+        """Pass on the last result as stale if the service has stopped."""
+        latest = self.latest
+        if (latest is not None and not latest.stale and
+                time.time() - self.last_arrival > SERVICE_STALE_TIME):
+            self.local.publish(AnalysisResult(
+                latest.timestamp, latest.peaks, latest.areas, latest.valid,
+                stale=True))
+
+    def result(self):
+        """Return the result held by the PVs."""
+        first_peak, second_peak, first_area, second_area, ratio = (
+            self.values)
+        return AnalysisResult(
+            ratio.timestamp, [np.asarray(first_peak), np.asarray(second_peak)],
+            [float(first_area), float(second_area)],
+            valid=not np.isnan(first_area))
+
+
+def results_source():
+    """
+    Return where a viewer should take analysis results from.
+
+    Returns:
+        PvSubscriber if SOURCE_VARIABLE is set to 'pvs', for viewers of a
+        headless service, otherwise the AnalysisService of this process
+    """
+    source = os.environ.get(SOURCE_VARIABLE)
+    if source == 'pvs':
+        return PvSubscriber()
+    if source:
+        print 'Analysis results can only be taken from pvs, not', source
+    return AnalysisService.get_instance()
+
+
+class AnalysisService(object):
+
+    """
+    Analyse each acquisition of the traces once and publish the results.
+
+    If average_periods is set, the peaks are averaged over every trigger
+    period in the trace rather than cut from the first. Results always go
+    to a LocalOutput, which GUIs subscribe to, and to any outputs added.
+    Acquisitions are analysed in the callback that received them unless
+    offload has chosen a worker.
+    """
+
+    __instance = None
+    # Environment variable that, set to 'thread', chooses a worker thread.
+    WORKER_VARIABLE = 'I10_ANALYSIS_WORKER'
+
+    @classmethod
+    def get_instance(cls):
+        """Make AnalysisService a singleton - only one instance exists."""
+        if cls.__instance is None:
+            cls.__instance = AnalysisService()
+        return cls.__instance
+
+    def __init__(self):
+        self.pv_monitor = PvMonitors.get_instance()
+        self.pv_monitor.register_trace_listener(self.update, batch=True)
+        self.local = LocalOutput()
+        self.outputs = [self.local]
+        self.trigger_threshold = analysis.TRIGGER_THRESHOLD
+        self.average_periods = False
+        self.timings = Timings.get_instance()
+        self.worker = None
+        worker = os.environ.get(self.WORKER_VARIABLE)
+        if worker:
+            if worker != 'thread':
+                print 'Only a worker thread can be used here, not', worker
+            self.offload(process=False)
+
+    @property
+    def latest(self):
+        """The result of the last acquisition analysed, or None."""
+        return self.local.latest
+
+    def add_output(self, output):
+        """Publish results to another output as well."""
+        self.outputs.append(output)
+
+    def subscribe(self, callback):
+        """Call callback(result) with the result of each acquisition."""
+        self.local.subscribe(callback)
+
+    def offload(self, process=True, capacity=0):
+        """
+        Analyse later acquisitions in a worker instead of the callback.
+
+        Any worker already started is closed first.
+
+        Args:
+            process (bool): whether to use a process rather than a thread;
+                a process must be started with a capacity before any PVs
+                are connected
+            capacity (int): samples of trace to start the worker for now,
+                or 0 to start it for the first trace
+        """
+        if self.worker is not None:
+            self.worker.close()
+        self.worker = AnalysisWorker(self._worker_result, process, capacity)
+
+    def update(self, changes):
+        """Analyse the traces once for a batch of changed PVs."""
+        if any(key == Arrays.WAVEFORMS for key, _ in changes):
+            trigger, trace = self.pv_monitor.get_waveforms()
+            if self.worker is None:
+                self.analyse(trigger, trace)
+            else:
+                self.worker.submit(trigger, trace, self.trigger_threshold,
+                                   self.average_periods)
+
+    def analyse(self, trigger, trace):
+        """
+        Window the peaks of an acquisition, find their areas and publish.
+
+        Args:
+            trigger (numpy array): square wave trigger signal
+            trace (numpy array): x-ray beam intensity trace
+        Returns:
+            AnalysisResult: the result published, which is not valid if
+                the trace is cut off or could not be analysed
+        """
+        start = time.time()
+        try:
+            peaks, areas = analyse_peaks(trigger, trace,
+                                         self.trigger_threshold,
+                                         self.average_periods)
+            result = AnalysisResult(time.time(), peaks, areas)
+        except RangeError:
+            print 'Trace is partially cut off'
+            result = AnalysisResult.cut_off(time.time())
+        except Exception:
+            # Keep the other listeners to the traces running.
+            print 'Analysis failed:', traceback.format_exc()
+            result = AnalysisResult.cut_off(time.time())
+        self.timings.record_since(Stages.ANALYSIS, start)
+        self.publish(result)
+        return result
+
+    def _worker_result(self, result, seconds):
+        """Publish a result from the worker and time its analysis."""
+        if seconds is not None:
+            self.timings.record(Stages.ANALYSIS, seconds)
+        self.publish(result)
+
+    def publish(self, result):
+        """Hand a result to every output."""
+        for output in self.outputs:
+            output.publish(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Analyse the I10 x-ray traces and publish the results.')
+    parser.add_argument('--average', action='store_true',
+                        help='average the peaks over every trigger period')
+    parser.add_argument('--threshold', type=float,
+                        default=analysis.TRIGGER_THRESHOLD,
+                        help='trigger step counted as an edge')
+    parser.add_argument('--worker', choices=['thread', 'process'],
+                        help='analyse the traces in a worker')
+    parser.add_argument('--capacity', type=int, default=WORKER_CAPACITY,
+                        help='longest trace a worker process can take')
+    args = parser.parse_args()
+
+    service = AnalysisService.get_instance()
+    service.average_periods = args.average
+    service.trigger_threshold = args.threshold
+    if args.worker == 'process':
+        # Fork the worker before channel access starts its threads.
+        service.offload(process=True, capacity=args.capacity)
+    elif args.worker:
+        service.offload(process=False)
+    service.add_output(PvOutput())
+    service.pv_monitor.connect([Arrays.WAVEFORMS])
+    cothread.WaitForQuit()
+
+
+if __name__ == '__main__':
+    main()
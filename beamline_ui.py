@@ -9,17 +9,14 @@ relative intensities.
 """
 
 
-from pkg_resources import require
-require('numpy==1.11.1')
-require('scipy==0.10.1')
-require('matplotlib==1.3.1')
-require('cothread==2.13')
-
-import cothread
-from cothread.catools import camonitor, FORMAT_CTRL
+from versions import require_versions
+require_versions('numpy==1.11.1', 'scipy==0.10.1', 'matplotlib==1.3.1',
+                 'cothread==2.13')
 
 import os
-import traceback
+
+import cothread
+from cothread.catools import FORMAT_CTRL
 
 from PyQt4 import QtGui
 from PyQt4 import QtCore
@@ -30,8 +27,15 @@ from matplotlib.backends.backend_qt4agg import (
 
 import plots
 import magnet_jogs
+from common_ui import CommonGui
 import controls
 import writers
+from instrumentation import StartupReport
+
+
+# Steps of starting the GUI, from when the process started.
+STARTUP = StartupReport()
+STARTUP.mark('imports')
 
 
 # Alarm colours
@@ -43,7 +47,7 @@ ALARM_COLORS = [
         ]
 
 
-class BeamlineGui(QMainWindow):
+class BeamlineGui(QMainWindow, CommonGui):
 
     """
     GUI for the beamline users.
@@ -54,6 +58,9 @@ class BeamlineGui(QMainWindow):
     """
 
     UI_FILENAME = 'beamlineui.ui'
+    # PVs used by the plots and bump jogs; none of the table PVs are needed.
+    PV_GROUPS = [controls.Arrays.WAVEFORMS] + list(
+        magnet_jogs.MagnetCoordinator.HEADROOM_KEYS)
 
     def __init__(self):
         """Initialise GUI."""
@@ -62,12 +69,20 @@ class BeamlineGui(QMainWindow):
         self.ui = uic.loadUi(filename)
         self.parent = QtGui.QMainWindow()
 
+        # Connect the PVs in the background and show the window while they
+        # connect.
         self.pv_monitor = controls.PvMonitors.get_instance()
+        self.pv_monitor.connect(self.PV_GROUPS, wait=False)
+        self.ui.statusBar().showMessage('Connecting to PVs...')
+        self.ui.show()
+        QtGui.QApplication.processEvents()
+        STARTUP.mark('window')
+
         self.knobs = magnet_jogs.MagnetCoordinator()
         self.pv_writer = writers.PvWriter()
+        self.queue = writers.JogQueue(self.pv_writer, self.jog_error)
 
-        # Initial setting for GUI: jog scaling = 1.
-        self.jog_scale = 1.0
+        # Initial setting for GUI: Gaussian scaling = 1.
         self.gauss_scale = 1.0
 
         # Initialise adjustment of Gaussian amplitude and standard deviation.
@@ -78,14 +93,15 @@ class BeamlineGui(QMainWindow):
         self.toolbar = NavigationToolbar(self.graph, self)
 
         # Connect buttons to PVs.
-        self.ui.bumpleftplusButton.clicked.connect(
-                lambda: self.jog_handler(magnet_jogs.Moves.BUMP_LEFT, 1))
-        self.ui.bumpleftminusButton.clicked.connect(
-                lambda: self.jog_handler(magnet_jogs.Moves.BUMP_LEFT, -1))
-        self.ui.bumprightplusButton.clicked.connect(
-                lambda: self.jog_handler(magnet_jogs.Moves.BUMP_RIGHT, 1))
-        self.ui.bumprightminusButton.clicked.connect(
-                lambda: self.jog_handler(magnet_jogs.Moves.BUMP_RIGHT, -1))
+        self.jog_buttons = [
+            (self.ui.bumpleftplusButton, magnet_jogs.Moves.BUMP_LEFT, 1),
+            (self.ui.bumpleftminusButton, magnet_jogs.Moves.BUMP_LEFT, -1),
+            (self.ui.bumprightplusButton, magnet_jogs.Moves.BUMP_RIGHT, 1),
+            (self.ui.bumprightminusButton, magnet_jogs.Moves.BUMP_RIGHT, -1),
+        ]
+        self.connect_jogs()
+        self.pv_monitor.register_straight_listener(
+            lambda changes: self.update_jog_buttons(), batch=True)
 
         self.ui.ampplusButton.clicked.connect(self.amp_plus)
         self.ui.ampminusButton.clicked.connect(self.amp_minus)
@@ -99,28 +115,41 @@ class BeamlineGui(QMainWindow):
 
         self.ui.checkBox.clicked.connect(self.gauss_fit)
 
-        self.ui.jog_scale_slider.valueChanged.connect(self.set_jog_scaling)
-        self.ui.jog_scale_textbox.setText(str(self.jog_scale))
-
         self.ui.gauss_scale_slider.valueChanged.connect(self.set_gauss_scaling)
         self.ui.gauss_scale_textbox.setText(str(self.gauss_scale))
 
         # Monitor the states of magnets and cycling.
-        camonitor(controls.PvReferences.MAGNET_STATUS_PV,
-                  self.update_magnet_led, format=FORMAT_CTRL)
-        camonitor(controls.PvReferences.CYCLING_STATUS_PV,
-                  self.update_cycling_textbox, format=FORMAT_CTRL)
+        self.pv_monitor.backend.camonitor(
+                controls.PvReferences.MAGNET_STATUS_PV,
+                self.update_magnet_led, format=FORMAT_CTRL)
+        self.pv_monitor.backend.camonitor(
+                controls.PvReferences.CYCLING_STATUS_PV,
+                self.update_cycling_textbox, format=FORMAT_CTRL)
 
         # Add graphs to the GUI.
         self.ui.graph_layout.addWidget(self.graph)
         self.ui.graph_layout.addWidget(self.toolbar)
 
+        self.start_status()
+
+        self.update_jog_buttons()
+
+        STARTUP.mark('constructed')
+        cothread.Spawn(self.report_startup)
+
+    def report_startup(self):
+        """Time the connection of the PVs and publish the startup report."""
+        self.pv_monitor.connect(self.PV_GROUPS)
+        STARTUP.mark('connected')
+        STARTUP.publish()
+
     def autoscale(self): # does this work??
         """Autoscale the graph axes to the correct size."""
         self.graph.ax.relim()
         self.graph.ax.autoscale_view()
         self.graph.ax.relim()
         self.graph.ax2.autoscale_view()
+        self.graph.draw()
 
     def gauss_fit(self):
         """Overlay theoretical gaussian and enable buttons to modify it."""
@@ -134,10 +163,9 @@ class BeamlineGui(QMainWindow):
         else:
             self.graph.clear_gaussian()
 
-    def set_jog_scaling(self):
-        """Change the scaling applied to magnet corrections."""
-        self.jog_scale = self.ui.jog_scale_slider.value() * 0.1
-        self.ui.jog_scale_textbox.setText(str(self.jog_scale))
+    def headroom(self):
+        """Return the headroom of each jog move from the PVs."""
+        return self.knobs.headroom
 
     # Methods controlling the theoretical gaussian.
     def amp_plus(self):
@@ -169,32 +197,6 @@ class BeamlineGui(QMainWindow):
         self.gauss_scale = self.ui.gauss_scale_slider.value()
         self.ui.gauss_scale_textbox.setText(str(self.gauss_scale))
 
-    def jog_handler(self, key, factor):
-        """
-        Handle button clicks.
-
-        When button clicked this class sends information to the writer and
-        provides exception handling in callbacks.
-        """
-        try:
-            self.pv_writer.write(key, factor * self.jog_scale)
-
-        except magnet_jogs.OverCurrentException, e:
-            msgBox = QtGui.QMessageBox(self.parent)
-            msgBox.setText('OverCurrent Exception: current applied to magnet ' +
-                           '%s is too high.' % e.magnet_index)
-            msgBox.exec_()
-        except (cothread.catools.ca_nothing, cothread.cadef.CAException), e:
-            print 'Cothread Exception:', e
-            msgBox = QtGui.QMessageBox(self.parent)
-            msgBox.setText('Cothread Exception: %s' % e)
-            msgBox.exec_()
-        except StandardError, e:
-            print 'Unexpected Exception:', e
-            msgBox = QtGui.QMessageBox(self.parent)
-            msgBox.setText('Unexpected Exception: %s' % e)
-            msgBox.setInformativeText(traceback.format_exc(3))
-            msgBox.exec_()
 
     def update_cycling_textbox(self, var):
         """Update cycling status from enum attached to pv."""
@@ -0,0 +1,238 @@
+#!/usr/bin/env dls-python2.7
+"""Benchmarks of the simulation and waveform analysis hot paths.
+
+Times Layout.generate_beams over growing lattices, Straight.step,
+Straight.step_many, Straight.p_beam_range, Straight.sweep_envelope and
+MagnetState.set, the trace windowing over growing traces and the simps
+areas of the windowed peaks. PvMonitors is mocked, so no PVs are needed.
+Results can be saved as JSON, for instance to store a new baseline after a
+deliberate change. With --compare they are compared with the stored
+baseline in benchmarks/baseline.json, or another results file, failing if
+any benchmark is slower than the tolerance allows. Every run also times a
+fixed calibration kernel, and times are scaled by how much faster or slower
+it ran than in the baseline, so that the comparison allows for the speed of
+the machine:
+
+    dls-python benchmarks/benchmark.py
+    dls-python benchmarks/benchmark.py --compare
+    dls-python benchmarks/benchmark.py --compare results.json
+    dls-python benchmarks/benchmark.py --output benchmarks/baseline.json
+"""
+
+
+from pkg_resources import require
+require('numpy>=1.10.1')
+require('scipy>=0.10.1')
+require('cothread>=2.13')
+require('mock')
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+import mock
+import numpy as np
+
+# Mock out catools as it requires EPICS binaries at import
+sys.modules['cothread.catools'] = mock.MagicMock()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+sys.path.append(ROOT)
+import analysis
+import controls
+import simulation
+import straight
+
+
+DATA = os.path.join(ROOT, 'example_data')
+LATTICE_REPEATS = [1, 10, 100]
+TRACE_REPEATS = [1, 10, 100]
+STEP_TIMES = [1, 200, 1000]
+FRAME_BUDGET = 0.02  # Seconds between frames of the simulation animation.
+CALIBRATION = 'calibration'  # Name of the calibration kernel's result.
+CALIBRATION_DATA = np.random.RandomState(0).rand(10000)
+
+
+def chicane_config(repeats):
+    """
+    Write a configuration file repeating the I10 straight.
+
+    Args:
+        repeats (int): number of copies of the straight, end to end
+    Returns:
+        str: name of the configuration file
+    """
+    lines = [line.split() for line in open(os.path.join(ROOT, 'config.txt'))]
+    start = float(lines[0][1])
+    end = float(lines[-1][1])
+    config = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+    for repeat in range(repeats):
+        shift = repeat * (end - start)
+        for element, s in lines[:-1]:
+            config.write('%s %f\n' % (element, float(s) + shift))
+    config.write('detector %f\n' % (end + (repeats - 1) * (end - start)))
+    config.close()
+    return config.name
+
+
+def mock_pv_monitors():
+    """PvMonitors serving fixed offsets, scales and limits."""
+    pvm = mock.Mock()
+    pvm.get_offsets.return_value = np.array([2.0, -1.5, 0.5, 1.0, -2.0])
+    pvm.get_scales.return_value = np.array([3.0, 2.5, 0.0, 2.0, 3.5])
+    pvm.get_max_currents.return_value = np.array([10.0] * 5)
+    pvm.get_min_currents.return_value = np.array([-10.0] * 5)
+    return pvm
+
+
+def calibration_kernel():
+    """Fixed mix of interpreter and numpy work that timings are scaled by."""
+    total = 0
+    for value in CALIBRATION_DATA[:1000]:
+        total += value * value
+    return total + np.sort(CALIBRATION_DATA).sum()
+
+
+def best_time(func, number):
+    """Best time per call of func over five repeats of number calls."""
+    return min(timeit.Timer(func).repeat(repeat=5, number=number)) / number
+
+
+def run_benchmarks():
+    """
+    Time the hot paths.
+
+    Returns:
+        dict: best time per call in seconds, by benchmark name
+    """
+    results = {CALIBRATION: best_time(calibration_kernel, 100)}
+
+    for repeats in LATTICE_REPEATS:
+        config = chicane_config(repeats)
+        try:
+            layout = simulation.Layout(config)
+        finally:
+            os.remove(config)
+        kicks = np.linspace(-1e-3, 1e-3, len(layout.kickers))
+        name = 'generate_beams[elements=%d]' % len(layout.path)
+        results[name] = best_time(lambda: layout.generate_beams(kicks), 1000)
+
+    with mock.patch.object(controls.PvMonitors, 'get_instance',
+                           return_value=mock_pv_monitors()):
+        cwd = os.getcwd()
+        os.chdir(ROOT)
+        try:
+            the_straight = straight.Straight()
+        finally:
+            os.chdir(cwd)
+
+    results['step'] = best_time(lambda: the_straight.step(50), 1000)
+    for count in STEP_TIMES:
+        times = np.arange(count)
+        results['step_many[times=%d]' % count] = best_time(
+            lambda: the_straight.step_many(times), 100)
+    strengths = np.array([[1, 1, 1, 0, 0], [0, 0, 1, 1, 1]])
+    results['p_beam_range'] = best_time(
+        lambda: the_straight.p_beam_range(strengths), 1000)
+
+    def sweep_envelope():
+        the_straight.set_offsets(the_straight.offsets + 1e-3)
+        return the_straight.sweep_envelope()
+    results['sweep_envelope'] = best_time(sweep_envelope, 100)
+
+    state = controls.MagnetState()
+    results['magnet_state_set'] = best_time(
+        lambda: state.set(controls.Arrays.OFFSETS, 2, 1.0, 0.0), 10000)
+
+    trigger = np.load(os.path.join(DATA, 'trigger.npy'))
+    trace = np.load(os.path.join(DATA, 'diode.npy'))
+    for repeats in TRACE_REPEATS:
+        long_trigger = np.tile(trigger, repeats)
+        long_trace = np.tile(trace, repeats)
+        size = len(long_trace)
+        results['window_peaks[samples=%d]' % size] = best_time(
+            lambda: analysis.window_peaks(long_trigger, long_trace), 100)
+        results['average_peaks[samples=%d]' % size] = best_time(
+            lambda: analysis.average_peaks(long_trigger, long_trace), 10)
+
+    # The peaks are windowed from the first trigger period, so their length
+    # does not grow with the trace.
+    first_peak, second_peak = analysis.window_peaks(trigger, trace)
+    results['simps[peak_samples=%d]' % len(first_peak)] = best_time(
+        lambda: (analysis.peak_area(first_peak),
+                 analysis.peak_area(second_peak)), 100)
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print results against the baseline and find regressions.
+
+    Baseline times are scaled by the ratio of the calibration times, if
+    both have one, before they are compared.
+
+    Args:
+        results (dict): times by benchmark name
+        baseline (dict): baseline times by benchmark name
+        tolerance (float): fraction by which a time may exceed its baseline
+    Returns:
+        list: names of benchmarks slower than the tolerance allows
+    """
+    scale = 1.0
+    if CALIBRATION in results and CALIBRATION in baseline:
+        scale = results[CALIBRATION] / baseline[CALIBRATION]
+        print 'Machine speed: %.2fx baseline' % (1 / scale)
+    regressions = []
+    for name in sorted(results):
+        line = '%-32s %10.1f us' % (name, results[name] * 1e6)
+        if name in baseline and name != CALIBRATION:
+            ratio = results[name] / (baseline[name] * scale)
+            line += '  %5.2fx baseline' % ratio
+            if ratio > 1 + tolerance:
+                regressions.append(name)
+                line += '  REGRESSION'
+        print line
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the simulation and waveform hot paths.')
+    parser.add_argument('--output', help='file to save the results to')
+    parser.add_argument('--compare', nargs='?', const=BASELINE,
+                        metavar='RESULTS',
+                        help='compare with a results file, by default the '
+                        'stored baseline')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='fraction by which a time may exceed baseline')
+    args = parser.parse_args()
+
+    results = run_benchmarks()
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    regressions = compare(results, baseline, args.tolerance)
+
+    frame_time = results['step']
+    print 'Straight.step uses %.1f%% of the %d ms frame budget' % (
+        100 * frame_time / FRAME_BUDGET, FRAME_BUDGET * 1000)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'numpy': np.__version__,
+                       'results': results}, f, indent=2, sort_keys=True)
+
+    if regressions:
+        print 'Regressions: %s' % ', '.join(regressions)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
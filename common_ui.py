@@ -0,0 +1,145 @@
+#!/usr/bin/env dls-python2.7
+"""Behaviour shared by the beamline and accelerator GUIs of the I10 chicane.
+
+CommonGui is mixed into both GUI classes so that their jog buttons, jog
+scale slider, status bar and jog error messages work the same way.
+"""
+
+
+import traceback
+
+import cothread.catools
+import numpy as np
+from PyQt4 import QtCore, QtGui
+
+import magnet_jogs
+import writers
+from instrumentation import Timings
+
+
+class CommonGui(object):
+
+    """
+    Jog buttons, jog scale slider and status bar of an I10 GUI.
+
+    Classes using it must be a QMainWindow and provide ui, holding a
+    jog_scale_slider, a jog_scale_textbox and a status bar, jog_buttons, a
+    list of (button, move, factor), a queue to write jogs to, parent, the
+    parent of message boxes, pv_monitor and the PV_GROUPS it connects, and
+    headroom, returning the headroom of each move as
+    MagnetCoordinator.headroom does. They can override over_current to
+    show jogs over the magnet limits differently.
+    """
+
+    STATUS_INTERVAL = 1000  # Milliseconds between timing status updates.
+    JOG_SCALE_STEPS = 10  # Jog scale slider steps per unit jog.
+
+    def connect_jogs(self):
+        """Connect the jog buttons and the jog scale slider."""
+        self.jog_scale = 1.0
+        for button, move, factor in self.jog_buttons:
+            button.clicked.connect(
+                lambda checked=False, move=move, factor=factor:
+                self.jog_handler(move, factor))
+        self.jog_scale_maximum = (self.ui.jog_scale_slider.maximum() /
+                                  float(self.JOG_SCALE_STEPS))
+        self.ui.jog_scale_slider.valueChanged.connect(self.set_jog_scaling)
+        self.ui.jog_scale_textbox.setText(str(self.jog_scale))
+
+    def headroom(self):
+        """
+        Return the headroom of each jog move.
+
+        Returns:
+            numpy array: lowest and highest factor of each move, NaN if not
+                known yet
+        """
+        raise NotImplementedError()
+
+    def set_jog_scaling(self):
+        """Change the scaling applied to magnet corrections."""
+        self.jog_scale = (self.ui.jog_scale_slider.value() /
+                          float(self.JOG_SCALE_STEPS))
+        self.ui.jog_scale_textbox.setText(str(self.jog_scale))
+        self.update_jog_buttons()
+
+    def update_jog_buttons(self):
+        """
+        Disable the jog buttons that would take a magnet over its limits.
+
+        Each button shows how large a jog it has room for, and the jog scale
+        slider is clamped to the largest of these.
+        """
+        self.show_headroom(self.headroom())
+
+    def show_headroom(self, headroom):
+        """Update the jog buttons and slider from the headroom of each move."""
+        if np.isnan(headroom).any():
+            for button, _, _ in self.jog_buttons:
+                button.setEnabled(False)
+                button.setToolTip('Connecting')
+            return
+        room = []
+        for button, move, factor in self.jog_buttons:
+            lowest, highest = headroom[move]
+            room.append(highest if factor > 0 else -lowest)
+            button.setEnabled(room[-1] >= self.jog_scale)
+            button.setToolTip('Headroom: %.1f' % room[-1])
+        slider = self.ui.jog_scale_slider
+        slider.setMaximum(max(slider.minimum(), int(
+            min(self.jog_scale_maximum, max(room)) * self.JOG_SCALE_STEPS)))
+
+    def jog_handler(self, key, factor):
+        """
+        Handle button clicks.
+
+        When button clicked this class queues the jog for the writer, which
+        reports exceptions to jog_error.
+        """
+        self.queue.write(key, factor * self.jog_scale)
+
+    def jog_error(self, e):
+        """Provide exception handling for queued jogs."""
+        if isinstance(e, magnet_jogs.OverCurrentException):
+            self.over_current(e)
+        elif isinstance(e, writers.WriteError):
+            print 'Write Exception:', e
+            self.show_message('Write Exception: %s' % e)
+        elif isinstance(e, (cothread.catools.ca_nothing,
+                            cothread.cadef.CAException)):
+            print 'Cothread Exception:', e
+            self.show_message('Cothread Exception: %s' % e)
+        else:
+            print 'Unexpected Exception:', e
+            self.show_message('Unexpected Exception: %s' % e,
+                              traceback.format_exc(3))
+
+    def over_current(self, e):
+        """Tell the user a jog would take magnets over their limits."""
+        self.show_message('OverCurrent Exception: current applied to ' +
+                          'magnets %s is too high.' % e.magnet_indices)
+
+    def show_message(self, text, informative_text=None):
+        """Show a message box until the user closes it."""
+        msgBox = QtGui.QMessageBox(self.parent)
+        msgBox.setText(text)
+        if informative_text is not None:
+            msgBox.setInformativeText(informative_text)
+        msgBox.exec_()
+
+    def start_status(self):
+        """Show the latencies of PV updates in the status bar."""
+        self.timings = Timings.get_instance()
+        self.status_timer = QtCore.QTimer(self)
+        self.status_timer.timeout.connect(self.update_status)
+        self.status_timer.start(self.STATUS_INTERVAL)
+
+    def update_status(self):
+        """Show the PVs still connecting, then the latencies of PV updates."""
+        connecting = [key for key in self.PV_GROUPS
+                      if not self.pv_monitor.is_connected(key)]
+        if connecting:
+            self.ui.statusBar().showMessage(
+                'Connecting to PVs: ' + ', '.join(connecting))
+        else:
+            self.ui.statusBar().showMessage(self.timings.status())
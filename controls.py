@@ -3,11 +3,22 @@
 
 Aids reading and writing from the many magnet PVs associated with the
 fast chicane. PvMonitors is a singleton and users should use get_instance.
+PVs are accessed through a backend, channel access unless another (such as
+replay.ReplayBackend) is chosen with PvMonitors.set_backend. Groups of PVs
+are connected in parallel when first needed, or in advance with
+PvMonitors.connect. The latest values of the magnet PVs are kept in a
+MagnetState.
 """
 
 
+import time
+
 import cothread
-from cothread.catools import caget, camonitor, FORMAT_TIME
+import numpy as np
+from cothread.catools import caget, camonitor, caput, FORMAT_TIME
+
+import limits
+from instrumentation import Stages, Timings
 
 
 class PvReferences(object):
@@ -37,6 +48,15 @@ class PvReferences(object):
         'BL10I-EA-USER-01:WAI1',
         'BL10I-EA-USER-01:WAI2']
 
+    # Soft PVs that analysis_service publishes its results to.
+    AREA_PVS = [
+        'BL10I-EA-USER-01:AREA1',
+        'BL10I-EA-USER-01:AREA2']
+    RATIO_PV = 'BL10I-EA-USER-01:RATIO'
+    PEAK_PVS = [
+        'BL10I-EA-USER-01:PEAK1',
+        'BL10I-EA-USER-01:PEAK2']
+
     MAGNET_STATUS_PV = 'SR10I-PC-FCHIC-01:GRPSTATE'
     BURT_STATUS_PV = 'CS-TI-BL10-01:BURT:OK'
     CYCLING_STATUS_PV = 'CS-TI-BL10-01:STATE'
@@ -44,7 +64,7 @@ class PvReferences(object):
 
 class Arrays(object):
 
-    """Keys for the dictionary of monitored PVs: PvMonitors().arrays."""
+    """Keys of the groups of monitored PVs."""
 
     OFFSETS = 'offsets'
     SCALES = 'scales'
@@ -56,6 +76,91 @@ class Arrays(object):
     ERRORS = 'errors'
 
 
+class MagnetState(object):
+
+    """
+    Latest values of the magnet PVs, one row per magnet.
+
+    Values are kept in a preallocated structured array with a field per
+    group of PVs, with the timestamp and alarm severity of each value in
+    arrays with the same fields. The derived fields high, low and headroom
+    are updated for a magnet whenever a value they depend on is set. Fields
+    are read as views of the array, so reads do not copy. Values that have
+    not been set are NaN, as are the fields derived from them.
+    """
+
+    MAGNETS = 5
+    NUMBERS = [Arrays.OFFSETS, Arrays.SCALES, Arrays.SET_SCALES, Arrays.SETI,
+               Arrays.IMIN, Arrays.IMAX]
+    TEXTS = [Arrays.ERRORS]
+    TEXT_LENGTH = 40  # Characters in an EPICS string.
+    FIELDS = NUMBERS + TEXTS
+
+    HIGH = 'high'  # offset + scale
+    LOW = 'low'  # offset - scale
+    HEADROOM = 'headroom'  # Smallest change in current to reach a limit.
+    DERIVED = [HIGH, LOW, HEADROOM]
+    SOURCES = [Arrays.OFFSETS, Arrays.SCALES, Arrays.IMIN, Arrays.IMAX]
+
+    def __init__(self):
+        numbers = [(key, float) for key in self.NUMBERS + self.DERIVED]
+        texts = [(key, 'S%d' % self.TEXT_LENGTH) for key in self.TEXTS]
+        self.values = np.zeros(self.MAGNETS, dtype=numbers + texts)
+        for key, _ in numbers:
+            self.values[key] = np.nan
+        self.timestamps = np.full(
+            self.MAGNETS, np.nan, dtype=[(key, float) for key in self.FIELDS])
+        self.severities = np.zeros(
+            self.MAGNETS, dtype=[(key, np.int8) for key in self.FIELDS])
+
+    def set(self, key, index, value, timestamp, severity=0):
+        """
+        Store the value of one PV and update the fields derived from it.
+
+        Args:
+            key (str): Arrays key of the PV's group
+            index (int): magnet of the PV
+            value: value of the PV
+            timestamp (float): time of the value, in seconds since the epoch
+            severity (int): alarm severity of the PV
+        """
+        self.values[key][index] = value
+        self.timestamps[key][index] = timestamp
+        self.severities[key][index] = severity
+        if key in self.SOURCES:
+            self._derive(index)
+
+    def _derive(self, index):
+        """Update the derived fields of one magnet."""
+        values = self.values
+        offset = values[Arrays.OFFSETS][index]
+        scale = values[Arrays.SCALES][index]
+        values[self.HIGH][index] = offset + scale
+        values[self.LOW][index] = offset - scale
+        low, high = limits.current_range(offset, scale)
+        values[self.HEADROOM][index] = np.minimum(
+            values[Arrays.IMAX][index] - high,
+            low - values[Arrays.IMIN][index])
+
+    def get(self, key):
+        """Return a view of one field of every magnet."""
+        return self.values[key]
+
+
+class ChannelAccess(object):
+
+    """PV backend that uses cothread channel access."""
+
+    def caget(self, pvs, **kwargs):
+        return caget(pvs, **kwargs)
+
+    def camonitor(self, pvs, callback, **kwargs):
+        return camonitor(pvs, callback, **kwargs)
+
+    def caput(self, pvs, values, **kwargs):
+        return caput(pvs, values, **kwargs)
+
+
 class PvMonitors(object):
 
     """
@@ -69,6 +174,37 @@ class PvMonitors(object):
 
     __instance = None
     __guard = True
+    __backend = None
+
+    # PV names, listeners and camonitor arguments of each group of PVs.
+    GROUPS = {
+        Arrays.OFFSETS: (
+            [ctrl + ':OFFSET' for ctrl in PvReferences.CTRLS], 'straight',
+            {'format': FORMAT_TIME}),
+        Arrays.SCALES: (
+            [ctrl + ':WFSCA' for ctrl in PvReferences.CTRLS], 'straight',
+            {'format': FORMAT_TIME}),
+        Arrays.SET_SCALES: (
+            [name + ':SETWFSCA' for name in PvReferences.NAMES], 'straight',
+            {'format': FORMAT_TIME}),
+        Arrays.WAVEFORMS: (PvReferences.TRACES, 'trace', {}),
+        Arrays.SETI: (
+            [name + ':SETI' for name in PvReferences.NAMES], 'straight',
+            {'format': FORMAT_TIME}),
+        Arrays.IMIN: (
+            [name + ':IMIN' for name in PvReferences.NAMES], 'straight',
+            {'format': FORMAT_TIME}),
+        Arrays.IMAX: (
+            [name + ':IMAX' for name in PvReferences.NAMES], 'straight',
+            {'format': FORMAT_TIME}),
+        Arrays.ERRORS: (
+            [name + ':ERRGSTR' for name in PvReferences.NAMES], 'straight',
+            {'format': FORMAT_TIME}),
+    }
+
+    # Seconds over which PV changes are collected before listeners are told.
+    # None informs listeners synchronously, 0 coalesces per cothread tick.
+    COALESCE_WINDOW = 0.02
 
     @classmethod
     def get_instance(cls):
@@ -79,83 +215,193 @@ class PvMonitors(object):
             cls.__guard = True
         return PvMonitors.__instance
 
+    @classmethod
+    def set_backend(cls, backend):
+        """
+        Choose the backend used to access PVs instead of channel access.
+
+        Args:
+            backend: object providing caget, camonitor and caput like
+                cothread.catools; must be set before the first get_instance
+        """
+        if cls.__instance is not None:
+            raise RuntimeError('Backend must be set before get_instance.')
+        cls.__backend = backend
+
     def __init__(self):
-        """Monitor values of PVs: offsets, scales etc."""
+        """Set up the monitors; no PVs are connected until they are needed."""
         if self.__guard:
             raise RuntimeError('Do not instantiate. ' +
                                'If you require an instance use get_instance.')
 
-        self.arrays = {
-            Arrays.OFFSETS: caget(
-                [ctrl + ':OFFSET' for ctrl in PvReferences.CTRLS]),
-            Arrays.SCALES: caget(
-                [ctrl + ':WFSCA' for ctrl in PvReferences.CTRLS]),
-            Arrays.SET_SCALES: caget(
-                [name + ':SETWFSCA' for name in PvReferences.NAMES]),
-            Arrays.WAVEFORMS: caget(PvReferences.TRACES),
-            Arrays.SETI: caget([name + ':SETI' for name in PvReferences.NAMES]),
-            Arrays.IMIN: caget([name + ':IMIN' for name in PvReferences.NAMES]),
-            Arrays.IMAX: caget([name + ':IMAX' for name in PvReferences.NAMES]),
-            Arrays.ERRORS: caget(
-                [name + ':ERRGSTR' for name in PvReferences.NAMES])
-        }
+        self.backend = self.__backend or ChannelAccess()
+        # Magnet PVs are kept in the state and traces in arrays.
+        self.state = MagnetState()
+        self.arrays = {}
+        self.connected = set()
+        self.connections = {}
 
         self.listeners = {'straight': [], 'trace': []}
+        self.pending = {'straight': [], 'trace': []}
+        self.arrivals = {'straight': None, 'trace': None}
+        self.coalesce_window = self.COALESCE_WINDOW
+        self.timings = Timings.get_instance()
+
+    def connect(self, keys=None, wait=True):
+        """
+        Connect groups of PVs, each in its own cothread.
+
+        Groups are connected in parallel, so connecting takes as long as the
+        slowest group rather than all of them. Listeners are told about
+        every PV of a group once it is connected. Groups that are connected
+        or connecting are not connected again.
+
+        Args:
+            keys (list): Arrays keys of the groups to connect, or None for
+                all of them
+            wait (bool): whether to wait until the groups are connected
+        """
+        if keys is None:
+            keys = self.GROUPS.keys()
+        tasks = []
+        for key in keys:
+            if key not in self.connections:
+                self.connections[key] = cothread.Spawn(
+                    self._connect_group, key, raise_on_wait=True)
+            tasks.append(self.connections[key])
+        if wait:
+            for task in tasks:
+                task.Wait()
+
+    def is_connected(self, key):
+        """Return whether the values of a group of PVs are available."""
+        return key in self.connected
+
+    def _connect_group(self, key):
+        """Get the values of a group of PVs and monitor them."""
+        pvs, listener_key, monitor_args = self.GROUPS[key]
+        arrival = time.time()
+        try:
+            values = self.backend.caget(pvs, **monitor_args)
+        except Exception:
+            # Allow the group to be connected again.
+            self.connections.pop(key, None)
+            raise
+        if key in MagnetState.FIELDS:
+            for index, value in enumerate(values):
+                self._store(key, index, value, arrival)
+        else:
+            self.arrays[key] = values
+        self.connected.add(key)
+        for index, pv in enumerate(pvs):
+            self.backend.camonitor(
+                pv, lambda x, i=index: self.update_values(
+                    x, key, i, listener_key), **monitor_args)
+        for index in range(len(pvs)):
+            self._queue_change(key, index, listener_key, arrival)
+
+    def register_straight_listener(self, l, batch=False):
+        """
+        Add new listener function to the list for updating the simulation.
 
-        for i in range(len(PvReferences.CTRLS)):
-            camonitor(PvReferences.CTRLS[i] + ':OFFSET',
-                      lambda x, i=i: self.update_values(
-                    x, Arrays.OFFSETS, i, 'straight'))
-            camonitor(PvReferences.CTRLS[i] + ':WFSCA',
-                      lambda x, i=i: self.update_values(
-                    x, Arrays.SCALES, i, 'straight'))
-
-        for idx, ioc in enumerate(PvReferences.NAMES):
-            camonitor(ioc + ':SETWFSCA',
-                      lambda x, i=idx: self.update_values(
-                    x, Arrays.SET_SCALES, i, 'straight'))
-            camonitor(ioc + ':SETI',
-                      lambda x, i=idx: self.update_values(
-                    x, Arrays.SETI, i, 'straight'))
-            camonitor(ioc + ':IMIN',
-                      lambda x, i=idx: self.update_values(
-                    x, Arrays.IMIN, i, 'straight'))
-            camonitor(ioc + ':IMAX',
-                      lambda x, i=idx: self.update_values(
-                    x, Arrays.IMAX, i, 'straight'))
-            camonitor(ioc + ':ERRGSTR',
-                      lambda x, i=idx: self.update_values(
-                    x, Arrays.ERRORS, i, 'straight'), format=FORMAT_TIME)
-
-        camonitor(PvReferences.TRACES[0],
-                  lambda x: self.update_values(x, Arrays.WAVEFORMS, 0, 'trace'))
-        camonitor(PvReferences.TRACES[1],
-                  lambda x: self.update_values(x, Arrays.WAVEFORMS, 1, 'trace'))
-
-        cothread.Yield()  # Ensure monitored values are connected
-
-    def register_straight_listener(self, l):
-        """Add new listener function to the list for updating the simulation."""
-        self.listeners['straight'].append(l)
-
-    def register_trace_listener(self, l):
-        """Add new listener function to the list for updating the plots."""
-        self.listeners['trace'].append(l)
+        Args:
+            l (function): called as l(key, index) for each changed PV, or
+                once as l(changes) with a list of (key, index) if batch
+            batch (bool): whether l takes all coalesced changes at once
+        """
+        self.listeners['straight'].append((l, batch))
+
+    def register_trace_listener(self, l, batch=False):
+        """
+        Add new listener function to the list for updating the plots.
+
+        Args:
+            l (function): called as l(key, index) for each changed PV, or
+                once as l(changes) with a list of (key, index) if batch
+            batch (bool): whether l takes all coalesced changes at once
+        """
+        self.listeners['trace'].append((l, batch))
+
+    def set_coalesce_window(self, window):
+        """
+        Set how long PV changes are collected before listeners are told.
+
+        Args:
+            window (float): seconds to wait, 0 to wait for the next cothread
+                tick or None to inform listeners on every update
+        """
+        self.coalesce_window = window
 
     def update_values(self, val, key, index, listener_key):
         """
-        Update arrays and tell listeners when a value has changed.
+        Store a value and tell listeners when it has changed.
+
+        The stored value is updated immediately. Unless coalescing is
+        disabled, listeners are told once about each changed key and index
+        at the end of the coalescing window, however often they changed.
 
         Args:
             val (float): monitored value
-            key (): key to relevant stored PV list (arrays)
-            index (): index for value in stored PV list
+            key (str): Arrays key of the PV's group
+            index (int): index of the PV in its group
             listener_key (str): key pointing to list of listeners to whom
                 this variable is relevant
         """
-        self.arrays[key][index] = val
-        for l in self.listeners[listener_key]:
-            l(key, index)
+        arrival = time.time()
+        self._store(key, index, val, arrival)
+        self.timings.record_since(Stages.CALLBACK, arrival)
+        self._queue_change(key, index, listener_key, arrival)
+
+    def _store(self, key, index, val, arrival):
+        """Store a PV value, with its timestamp and severity if it has them."""
+        if key in MagnetState.FIELDS:
+            self.state.set(key, index, val,
+                           getattr(val, 'timestamp', arrival),
+                           getattr(val, 'severity', 0))
+        else:
+            self.arrays[key][index] = val
+
+    def _queue_change(self, key, index, listener_key, arrival):
+        """Tell listeners of a change now, or at the end of the window."""
+        if self.coalesce_window is None:
+            self._notify(listener_key, [(key, index)], arrival)
+            return
+
+        pending = self.pending[listener_key]
+        if not pending:
+            self.arrivals[listener_key] = arrival
+            cothread.Spawn(self._flush_pending, listener_key)
+        if (key, index) not in pending:
+            pending.append((key, index))
+
+    def _flush_pending(self, listener_key):
+        """Wait for the coalescing window then tell listeners of changes."""
+        if self.coalesce_window:
+            cothread.Sleep(self.coalesce_window)
+        else:
+            cothread.Yield()
+        changes = self.pending[listener_key]
+        self.pending[listener_key] = []
+        self._notify(listener_key, changes, self.arrivals[listener_key])
+
+    def _notify(self, listener_key, changes, arrival):
+        """
+        Call each listener with a list of (key, index) changes.
+
+        While the listeners run, the time at which the first of the changes
+        arrived is the origin of the timings of later stages.
+        """
+        self.timings.record_since(Stages.DISPATCH, arrival)
+        self.timings.origin = arrival
+        try:
+            for l, batch in self.listeners[listener_key]:
+                if batch:
+                    l(changes)
+                else:
+                    for key, index in changes:
+                        l(key, index)
+        finally:
+            self.timings.origin = None
 
     def get_offsets(self):
         return self._get_array_value(Arrays.OFFSETS)
@@ -175,22 +421,35 @@ class PvMonitors(object):
     def get_min_currents(self):
         return self._get_array_value(Arrays.IMIN)
 
+    def get_waveforms(self):
+        return self._get_array_value(Arrays.WAVEFORMS)
+
     def get_errors(self):
         return self._get_array_value(Arrays.ERRORS)
 
-    def get_cache(self):
-        """Cache values of offsets and scales.
+    def get_highs(self):
+        """Return offset + scale of each magnet, NaN until both are known."""
+        return self.state.get(MagnetState.HIGH)
 
-        Puts offset and scale PVs into a dictionary that can be read by
-        the table.
-        """
-        cache = {}
-        for i in range(5):
-            cache['%02d' % i] = {
-                Arrays.OFFSETS: self._get_array_value(Arrays.OFFSETS)[i],
-                Arrays.SCALES: self._get_array_value(Arrays.SCALES)[i]
-            }
-        return cache
+    def get_lows(self):
+        """Return offset - scale of each magnet, NaN until both are known."""
+        return self.state.get(MagnetState.LOW)
+
+    def get_headroom(self):
+        """Return how far each magnet's current is from its nearest limit."""
+        return self.state.get(MagnetState.HEADROOM)
+
+    def get_severities(self, key):
+        """Return the alarm severities of a group of magnet PVs."""
+        return self.state.severities[key]
+
+    def get_timestamps(self, key):
+        """Return the times of the values of a group of magnet PVs."""
+        return self.state.timestamps[key]
 
     def _get_array_value(self, array_key):
+        if array_key not in self.connected:
+            self.connect([array_key])
+        if array_key in MagnetState.FIELDS:
+            return self.state.get(array_key)
         return self.arrays[array_key]
@@ -0,0 +1,190 @@
+#!/usr/bin/env dls-python2.7
+"""Latency histograms for the path from a PV update to the screen.
+
+Stages of the path record how long they took, or how long after the PV
+update that started them they finished, into per-stage histograms with
+logarithmic bins. Recording is a clock read and a bisect, cheap enough to
+leave on in the control room. Timings is a singleton and users should use
+get_instance. StartupReport times the steps of starting a GUI from when the
+process started.
+"""
+
+
+import bisect
+import json
+import os
+import time
+
+
+class Stages(object):
+
+    """Names of the timed stages."""
+
+    CALLBACK = 'callback'  # Storing a camonitor update in PvMonitors.
+    DISPATCH = 'dispatch'  # From a PV update to its listeners being called.
+    ANALYSIS = 'analysis'  # Windowing and areas of the x-ray trace.
+    TABLE = 'table'  # From a PV update to its accelerator GUI table cell.
+    DRAW = 'draw'  # Blitting the changed lines of a plot.
+    PV_TO_PIXEL = 'pv_to_pixel'  # From a PV update to the plot drawn.
+    WRITE = 'write'  # From a jog to a put completing.
+
+
+class LatencyHistogram(object):
+
+    """Counts of latencies in logarithmic bins from 10 us to 10 s."""
+
+    EDGES = [10 ** (exponent / 10.0) for exponent in range(-50, 11)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.EDGES) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        """Count a latency."""
+        self.counts[bisect.bisect(self.EDGES, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        """
+        Return an upper bound on a percentile of the latencies.
+
+        Args:
+            percent (float): percentile to find, from 0 to 100
+        Returns:
+            float: upper edge of the bin containing the percentile
+        """
+        target = self.count * percent / 100.0
+        seen = 0
+        for edge, count in zip(self.EDGES, self.counts):
+            seen += count
+            if seen >= target:
+                return edge
+        return self.max
+
+    def summary(self):
+        """Return the count, mean, percentiles and maximum in a dictionary."""
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'edges': self.EDGES,
+            'counts': self.counts,
+        }
+
+
+class Timings(object):
+
+    """
+    Latency histograms for each stage.
+
+    origin is the time of the PV update that started the work currently
+    being done, so that later stages can measure latency from it.
+    """
+
+    __instance = None
+
+    @classmethod
+    def get_instance(cls):
+        """Make Timings a singleton - only one instance of this class."""
+        if cls.__instance is None:
+            cls.__instance = Timings()
+        return cls.__instance
+
+    def __init__(self):
+        self.histograms = {}
+        self.origin = None
+        self.enabled = True
+
+    def record(self, stage, seconds):
+        """Add a latency to the histogram of a stage."""
+        if self.enabled:
+            if stage not in self.histograms:
+                self.histograms[stage] = LatencyHistogram()
+            self.histograms[stage].add(seconds)
+
+    def record_since(self, stage, start):
+        """Add the time since start to the histogram of a stage."""
+        if start is not None:
+            self.record(stage, time.time() - start)
+
+    def reset(self):
+        """Forget all recorded latencies."""
+        self.histograms = {}
+
+    def status(self):
+        """Return a line summarising the 99th percentile of each stage."""
+        return '  '.join(
+            '%s p99 %.1f ms' % (stage, hist.percentile(99) * 1e3)
+            for stage, hist in sorted(self.histograms.items()))
+
+    def dump(self, filename):
+        """Write the histograms of all stages to a JSON file."""
+        with open(filename, 'w') as f:
+            json.dump(dict((stage, hist.summary())
+                           for stage, hist in self.histograms.items()),
+                      f, indent=2, sort_keys=True)
+
+
+def process_start_time():
+    """
+    Return the time at which this process started.
+
+    The start is read from /proc, to within a clock tick, so that the time
+    spent starting the interpreter and importing modules is included. Where
+    /proc is not available the current time is returned.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # Fields after the command name, which may contain spaces.
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        started = float(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return time.time() - uptime + started
+    except (IOError, OSError, IndexError, ValueError):
+        return time.time()
+
+
+class StartupReport(object):
+
+    """
+    Times of the steps of starting a GUI, from when the process started.
+
+    If the I10_STARTUP_REPORT environment variable names a file, publish
+    prints the report and writes it to that file.
+    """
+
+    REPORT_VARIABLE = 'I10_STARTUP_REPORT'
+
+    def __init__(self, start=None):
+        self.start = process_start_time() if start is None else start
+        self.steps = []
+
+    def mark(self, step):
+        """Record that a step has finished."""
+        self.steps.append((step, time.time() - self.start))
+
+    def report(self):
+        """Return each step and its time since the process started."""
+        return '\n'.join('%-12s %6.3f s' % (step, seconds)
+                         for step, seconds in self.steps)
+
+    def dump(self, filename):
+        """Write the steps and their times to a JSON file."""
+        with open(filename, 'w') as f:
+            json.dump([{'step': step, 'seconds': seconds}
+                       for step, seconds in self.steps], f, indent=2)
+
+    def publish(self):
+        """Print and save the report if the environment asks for it."""
+        filename = os.environ.get(self.REPORT_VARIABLE)
+        if filename:
+            print 'Startup times:'
+            print self.report()
+            self.dump(filename)
@@ -0,0 +1,106 @@
+#!/usr/bin/env dls-python2.7
+"""Check magnet currents against their limits.
+
+During a cycle each magnet current sweeps between offset - |scale| and
+offset + |scale|, which must stay between the magnet's IMIN and IMAX. All
+functions take arrays with the five magnets along the last axis, and any
+leading axes are broadcast over, so many candidate settings can be checked
+in one call.
+"""
+
+
+import numpy as np
+
+
+def current_range(offsets, scales):
+    """
+    Return the lowest and highest currents over a cycle.
+
+    Args:
+        offsets (numpy array): magnet offsets
+        scales (numpy array): magnet scales
+    Returns:
+        low (numpy array): offset - |scale|
+        high (numpy array): offset + |scale|
+    """
+    offsets = np.asarray(offsets, dtype=float)
+    spread = np.abs(np.asarray(scales, dtype=float))
+    return offsets - spread, offsets + spread
+
+
+def violations(offsets, scales, imaxs, imins):
+    """
+    Find the magnets whose currents would exceed their limits.
+
+    Args:
+        offsets (numpy array): magnet offsets
+        scales (numpy array): magnet scales
+        imaxs (numpy array): maximum magnet currents
+        imins (numpy array): minimum magnet currents
+    Returns:
+        numpy array: True for each magnet over its limits
+    """
+    low, high = current_range(offsets, scales)
+    return (high > np.asarray(imaxs, dtype=float)) | (
+        low < np.asarray(imins, dtype=float))
+
+
+def offending_magnets(mask):
+    """
+    Return the indices of the magnets over their limits.
+
+    Args:
+        mask (numpy array): violations for one setting of the magnets
+    Returns:
+        list: indices of the magnets over their limits
+    """
+    return np.flatnonzero(mask).tolist()
+
+
+def change_limits(offsets, scales, imaxs, imins):
+    """
+    Return how far the offset and scale of each magnet can change.
+
+    Args:
+        offsets (numpy array): magnet offsets
+        scales (numpy array): magnet scales
+        imaxs (numpy array): maximum magnet currents
+        imins (numpy array): minimum magnet currents
+    Returns:
+        offset_range (numpy array): rows of the lowest and highest changes
+            of the offsets that keep the magnets within their limits
+        scale_range (numpy array): as offset_range, for the scales
+    """
+    offsets = np.asarray(offsets, dtype=float)
+    scales = np.asarray(scales, dtype=float)
+    imaxs = np.asarray(imaxs, dtype=float)
+    imins = np.asarray(imins, dtype=float)
+    spread = np.abs(scales)
+    offset_range = np.array([imins + spread - offsets,
+                             imaxs - spread - offsets])
+    reach = np.minimum(imaxs - offsets, offsets - imins)
+    scale_range = np.array([-reach - scales, reach - scales])
+    return offset_range, scale_range
+
+
+def factor_range(jogs, change_range):
+    """
+    Return the range of factors that jogs can be applied with.
+
+    Args:
+        jogs (numpy array): change of each magnet made by a jog
+        change_range (numpy array): rows of the lowest and highest changes
+            of each magnet, as returned by change_limits
+    Returns:
+        lowest (numpy array): most negative factor allowed, at most zero
+        highest (numpy array): most positive factor allowed, at least zero
+    """
+    jogs = np.asarray(jogs, dtype=float)
+    low, high = change_range
+    with np.errstate(divide='ignore', invalid='ignore'):
+        upper = np.where(jogs > 0, high / jogs,
+                         np.where(jogs < 0, low / jogs, np.inf))
+        lower = np.where(jogs > 0, low / jogs,
+                         np.where(jogs < 0, high / jogs, -np.inf))
+    return (np.minimum(lower.max(axis=-1), 0),
+            np.maximum(upper.min(axis=-1), 0))
@@ -9,7 +9,9 @@ their maximum current values.
 
 import numpy as np
 
-from controls import PvMonitors
+from controls import PvMonitors, Arrays
+import limits
+import straight
 
 
 class Moves(object):
@@ -28,9 +30,12 @@ class OverCurrentException(Exception):
 
     """Exception in the case of a jog that exceeds magnet tolerances."""
 
-    def __init__(self, magnet_index):
+    def __init__(self, magnet_indices):
         super(OverCurrentException, self).__init__()
-        self.magnet_index = magnet_index
+        if isinstance(magnet_indices, (int, np.integer)):
+            magnet_indices = [magnet_indices]
+        self.magnet_indices = list(magnet_indices)
+        self.magnet_index = self.magnet_indices[0]
 
 
 class MagnetCoordinator(object):
@@ -41,6 +46,10 @@ class MagnetCoordinator(object):
     Contains information about jogs to be applied to magnet scales and
     offsets, applies these jogs to the values given to it and
     checks this doesn't send the values over the magnet current limits.
+
+    headroom holds the most negative and most positive factor each move can
+    be applied with, kept up to date as the magnet PVs change, or NaN until
+    the PVs are connected.
     """
 
     BUTTON_DATA = {
@@ -54,32 +63,159 @@ class MagnetCoordinator(object):
         Moves.SCALE: np.array([1e-2, 1e-2, 0, 1e-2, 1e-2]),
         }
 
+    # Rows of BUTTON_DATA indexed by move.
+    BUTTON_MATRIX = np.array([BUTTON_DATA[move] for move in range(6)])
+    SCALE_MOVES = np.arange(6) == Moves.SCALE
+    # PVs that the headroom depends on.
+    HEADROOM_KEYS = (Arrays.OFFSETS, Arrays.SCALES, Arrays.IMAX, Arrays.IMIN)
+    # Singular values below this fraction of the largest are treated as zero.
+    RCOND = 1e-10
+
     def __init__(self):
-        pass
+        self.pvm = PvMonitors.get_instance()
+        self.straight = None
+        self.offset_range = np.zeros((2, 5))
+        self.scale_range = np.zeros((2, 5))
+        # Unknown until the PVs it depends on are connected.
+        self.headroom = np.full((len(self.BUTTON_MATRIX), 2), np.nan)
+        if all(self.pvm.is_connected(key) for key in self.HEADROOM_KEYS):
+            self.update_headroom([(Arrays.OFFSETS, i) for i in range(5)])
+        self.pvm.register_straight_listener(self.update_headroom, batch=True)
 
     def jog(self, old_values, ofs, factor):
         """Increment the list of PVs by the appropriate offset from the list."""
-        ofs = factor * self.BUTTON_DATA[ofs]
+        values = old_values + factor * self.BUTTON_DATA[ofs]
 
-        values = old_values + ofs
-
-        _check_bounds(ofs)
+        self.check_bounds(
+            self.pvm.get_offsets(), self.pvm.get_scales(), ofs, factor)
 
         return values
 
-
-def _check_bounds(ofs):
-    """Raise exception if new value exceeds magnet current limit."""
-    pvm = PvMonitors.get_instance()
-    scales = [abs(scale) for scale in pvm.get_scales()]
-    offsets = pvm.get_offsets()
-    imaxs = pvm.get_max_currents()
-    imins = pvm.get_min_currents()
-
-    # Check errors on limits.
-    for idx, (max_val, min_val, offset, scale, new_val) in enumerate(
-            zip(imaxs, imins, offsets, scales, ofs)):
-        high = offset + new_val + scale
-        low = offset + new_val - scale
-        if high > max_val or low < min_val:
-            raise OverCurrentException(idx)
+    def violations(self, offsets, scales, moves, factors):
+        """
+        Find the magnets a batch of jogs would take over their limits.
+
+        Args:
+            offsets (numpy array): magnet offsets before the jogs
+            scales (numpy array): magnet scales before the jogs
+            moves (list): Moves to check
+            factors (list): factor applied to each move
+        Returns:
+            numpy array: one row of magnet violations per move
+        """
+        moves = np.asarray(moves)
+        jogs = (np.asarray(factors, dtype=float)[:, np.newaxis] *
+                self.BUTTON_MATRIX[moves])
+        scale_jogs = (moves == Moves.SCALE)[:, np.newaxis]
+        return limits.violations(
+            offsets + np.where(scale_jogs, 0, jogs),
+            scales + np.where(scale_jogs, jogs, 0),
+            self.pvm.get_max_currents(), self.pvm.get_min_currents())
+
+    def update_headroom(self, changes):
+        """Recalculate the headroom for the magnets whose PVs changed."""
+        indices = sorted(set(
+            index for key, index in changes if key in self.HEADROOM_KEYS))
+        if not indices:
+            return
+        values = [np.asarray(getter(), dtype=float)[indices] for getter in (
+            self.pvm.get_offsets, self.pvm.get_scales,
+            self.pvm.get_max_currents, self.pvm.get_min_currents)]
+        (self.offset_range[:, indices],
+         self.scale_range[:, indices]) = limits.change_limits(*values)
+        self.headroom = self._headroom(self.offset_range, self.scale_range)
+
+    def calculate_headroom(self, offsets, scales):
+        """
+        Calculate the headroom of each move for other offsets and scales.
+
+        Args:
+            offsets (numpy array): magnet offsets, e.g. simulated ones
+            scales (numpy array): magnet scales
+        Returns:
+            numpy array: most negative and most positive factor of each move
+        """
+        return self._headroom(*limits.change_limits(
+            offsets, scales, self.pvm.get_max_currents(),
+            self.pvm.get_min_currents()))
+
+    def _headroom(self, offset_range, scale_range):
+        change_range = np.where(self.SCALE_MOVES[:, np.newaxis],
+                                scale_range[:, np.newaxis],
+                                offset_range[:, np.newaxis])
+        return np.transpose(
+            limits.factor_range(self.BUTTON_MATRIX, change_range))
+
+    def solve(self, offsets, scales, displacements=None, angles=None):
+        """
+        Find the offsets that move the photon beams as requested.
+
+        The change in offsets is the smallest that keeps the electron beam
+        leaving the straight unchanged, so that the bump stays closed, and
+        moves the photon beams at the insertion devices as close as possible
+        to the requested changes. Kicks are linear in the offsets around
+        their current values, and the response of the photon beams to the
+        kicks is cached by straight.Straight, so a solve only involves
+        matrices with one column per magnet.
+
+        Args:
+            offsets (numpy array): magnet offsets before the move
+            scales (numpy array): magnet scales
+            displacements (list): change in the photon beam position at each
+                insertion device in metres, None or NaN to leave it free
+            angles (list): change in the photon beam angle at each insertion
+                device in radians, None or NaN to leave it free
+        Returns:
+            numpy array: new offsets
+        Raises:
+            OverCurrentException: if the new offsets take any magnet over
+                its limits
+        """
+        if self.straight is None:
+            self.straight = straight.Straight()
+        else:
+            self.straight.reload_layout()
+        electron_response, photon_response = self.straight.response()
+        offsets = np.asarray(offsets, dtype=float)
+        n_ids = len(photon_response)
+        requested = np.empty((2, n_ids))
+        for row, values in zip(requested, (displacements, angles)):
+            if values is None:
+                values = [None] * n_ids
+            row[:] = [np.nan if value is None else value for value in values]
+        requested = requested.ravel()
+
+        # Derivative of straight.Straight.amps_to_radians at the offsets.
+        sines = offsets * straight.Straight.AMP_TO_SINE
+        kick_per_amp = 2.0 * straight.Straight.AMP_TO_SINE / np.sqrt(
+            1 - sines ** 2)
+        photon = photon_response * kick_per_amp
+        targets = np.concatenate((photon[:, 0], photon[:, 1]))
+        closure = electron_response[-1] * kick_per_amp
+
+        # Offset changes that leave the closure unchanged.
+        _, singular, vt = np.linalg.svd(closure)
+        rank = np.sum(singular > self.RCOND * singular[0])
+        null_space = vt[rank:].T
+
+        free = np.isnan(requested)
+        change = np.zeros_like(offsets)
+        if not free.all():
+            weights = np.linalg.lstsq(
+                np.dot(targets[~free], null_space), requested[~free],
+                rcond=self.RCOND)[0]
+            change = np.dot(null_space, weights)
+
+        new_offsets = offsets + change
+        mask = limits.violations(new_offsets, scales,
+                                 self.pvm.get_max_currents(),
+                                 self.pvm.get_min_currents())
+        if mask.any():
+            raise OverCurrentException(limits.offending_magnets(mask))
+        return new_offsets
+
+    def check_bounds(self, offsets, scales, move, factor):
+        """Raise exception if a jog takes any magnet over its limits."""
+        mask = self.violations(offsets, scales, [move], [factor])[0]
+        if mask.any():
+            raise OverCurrentException(limits.offending_magnets(mask))
@@ -5,15 +5,19 @@ Plots are available for use in eithier the beamline or accelerator GUIs.
 """
 
 
+import time
+
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt4agg import (
     FigureCanvasQTAgg as FigureCanvas)
-import scipy.integrate as integ
 import controls
 import cothread
 
+import analysis
+import analysis_service
+from instrumentation import Stages, Timings
+
 
 class BaseFigureCanvas(FigureCanvas):
 
@@ -27,7 +31,7 @@ class BaseFigureCanvas(FigureCanvas):
         transparent (goes blue for simulation mode), get instance of PvMonitors
         to receive updated PV values.
         """
-        self.figure = plt.figure()
+        self.figure = Figure()
         FigureCanvas.__init__(self, self.figure)
         self.figure.patch.set_facecolor('blue')
         self.figure.patch.set_alpha(0.0)
@@ -36,7 +40,17 @@ class BaseFigureCanvas(FigureCanvas):
 
 class Simulation(BaseFigureCanvas):
 
-    """Plot the simulation of the I10 fast chicane."""
+    """
+    Plot the simulation of the I10 fast chicane.
+
+    Only the beams are animated. The axes, element markers, shading and
+    limits are cached as a background whenever the figure is drawn in full,
+    and each frame blits the beams over it. The layout file is checked for
+    changes on a slower timer, and the figure is rebuilt when it changes.
+    """
+
+    INTERVAL = 20  # Milliseconds between animation frames.
+    LAYOUT_INTERVAL = 2000  # Milliseconds between checks of the layout file.
 
     def __init__(self, straight):
         """Initialise the straight, axes, animation and graph shading."""
@@ -44,10 +58,36 @@ class Simulation(BaseFigureCanvas):
         self.straight = straight
         self.fill1 = None
         self.fill2 = None
+        self.limits = []
+        self.cycle = None
+        self.positions = None
+        self.background = None
+        self.frame = 0
         self.ax = self.fig_setup()
         self.beams = self.data_setup()
-        self.anim = animation.FuncAnimation(self.figure, self.animate,
-                    init_func=self.init_data, frames=1000, interval=20)
+        self.mpl_connect('draw_event', self.on_draw)
+        self.timer = self.new_timer(interval=self.INTERVAL)
+        self.timer.add_callback(self.next_frame)
+        self.timer.start()
+        self.layout_timer = self.new_timer(interval=self.LAYOUT_INTERVAL)
+        self.layout_timer.add_callback(self.check_layout)
+        self.layout_timer.start()
+
+    def check_layout(self):
+        """Rebuild the figure if the straight's layout file has changed."""
+        if self.straight.reload_layout():
+            shown_limits = bool(self.limits)
+            self.figure.clear()
+            self.fill1 = None
+            self.fill2 = None
+            self.limits = []
+            self.cycle = None
+            self.background = None
+            self.ax = self.fig_setup()
+            self.beams = self.data_setup()
+            self.update_colourin()
+            if shown_limits:
+                self.magnet_limits()
 
     def fig_setup(self):
         """Set up axes."""
@@ -64,7 +104,7 @@ class Simulation(BaseFigureCanvas):
         for i in self.straight.data.ids:
             ax1.axvline(x=i.s, color='b', linestyle='dashed')
 
-        plt.tight_layout()
+        self.figure.tight_layout()
 
         return ax1
 
@@ -75,9 +115,30 @@ class Simulation(BaseFigureCanvas):
                 self.ax.plot([], [], 'r')[0],
                 self.ax.plot([], [], 'r')[0]
                 ]
+        for line in beams:
+            line.set_animated(True)
 
         return beams
 
+    def on_draw(self, _):
+        """Cache the background of a full draw and draw the beams over it."""
+        self.background = self.copy_from_bbox(self.ax.bbox)
+        for line in self.beams:
+            self.ax.draw_artist(line)
+
+    def next_frame(self):
+        """Blit the beams for the next frame over the cached background."""
+        self.animate(self.frame)
+        self.frame = (self.frame + 1) % self.straight.PERIOD
+
+        if self.background is None:
+            self.draw_idle()
+        else:
+            self.restore_region(self.background)
+            for line in self.beams:
+                self.ax.draw_artist(line)
+            self.blit(self.ax.bbox)
+
     def init_data(self):
 
         for line in self.beams:
@@ -89,6 +150,9 @@ class Simulation(BaseFigureCanvas):
         """
         Extract electron and photon beam positions from data for plotting.
 
+        Positions for a whole period are taken from the straight's cached
+        cycle, and only recalculated when the straight discards its cycle.
+
         Args:
             t (int): time counter for the animation
         Returns:
@@ -97,15 +161,16 @@ class Simulation(BaseFigureCanvas):
             p_positions (numpy array): photon position data (remove velocity
             data as not needed for plotting)
         """
-        e_positions = np.array(self.straight.step(t)[0])[:, 0].tolist()
-        # Remove duplicates in data.
-        for i in range(len(self.straight.data.get_elements('drift'))):
-            if e_positions[i] == e_positions[i+1]:
-                e_positions.pop(i+1)
+        cycle = self.straight.cycle()
+        if cycle is not self.cycle:
+            e_beams, p_beams = cycle
+            self.positions = (
+                e_beams[:, self.straight.data.xaxis_index, 0],
+                p_beams[:, :, [0, 2]])
+            self.cycle = cycle
 
-        p_positions = np.array(self.straight.step(t)[1])[:, [0, 2]]
-
-        return e_positions, p_positions
+        frame = t % self.straight.PERIOD
+        return self.positions[0][frame], self.positions[1][frame]
 
     def animate(self, t):
         """
@@ -137,47 +202,27 @@ class Simulation(BaseFigureCanvas):
         if self.fill2:
             self.ax.collections.remove(self.fill2)
 
-        strengths = [np.array([1, 1, 1, 0, 0]), np.array([0, 0, 1, 1, 1])]
-        edges = [[], []]
-        for s in range(2):
-            edges[s] = np.array(
-                self.straight.p_beam_range(strengths[s]))[:, [0, 2]]
-
-        beam1max = edges[0][0]
-        beam1min = edges[1][0]
-        beam2max = edges[1][1]
-        beam2min = edges[0][1]
+        low, high = self.straight.sweep_envelope()
 
         self.fill1 = self.ax.fill_between(
                                self.straight.data.photon_coordinates[0],
-                               beam1min, beam1max, facecolor='blue', alpha=0.2)
+                               low[0], high[0], facecolor='blue', alpha=0.2)
         self.fill2 = self.ax.fill_between(
                                self.straight.data.photon_coordinates[1],
-                               beam2min, beam2max, facecolor='green', alpha=0.2)
+                               low[1], high[1], facecolor='green', alpha=0.2)
+        self.draw_idle()
 
     def magnet_limits(self):
         """Show maximum currents that can be passed through the magnets."""
-        max_currents = self.pv_monitor.get_max_currents()
-
-        strengths = [np.array([max_currents[0],
-                              -max_currents[1],
-                               max_currents[2], 0, 0]),
-                     np.array([0, 0, max_currents[2],
-                              -max_currents[3],
-                               max_currents[4]])]
+        edges = self.straight.limit_envelope(
+            self.pv_monitor.get_max_currents())
 
-        edges = [[], []]
-        for s in range(2):
-            edges[s] = np.array(self.straight.p_beam_lim(strengths[s])
-                               )[:, [0, 2]]
-
-        beam1max = edges[0][0]
-        beam2max = edges[1][1]
-
-        self.ax.plot(self.straight.data.photon_coordinates[0],
-                                   beam1max, 'r--')
-        self.ax.plot(self.straight.data.photon_coordinates[1],
-                                   beam2max, 'r--')
+        self.limits = (
+            self.ax.plot(self.straight.data.photon_coordinates[0],
+                         edges[0], 'r--') +
+            self.ax.plot(self.straight.data.photon_coordinates[1],
+                         edges[1], 'r--'))
+        self.draw_idle()
 
 
 class OverlaidWaveforms(BaseFigureCanvas):
@@ -185,22 +230,41 @@ class OverlaidWaveforms(BaseFigureCanvas):
     """
     Overlay the two intensity peaks of the x-ray beams.
 
-    'Cuts out' two peaks from X-ray intensity trace corresponding to the two
-    X-ray beams and displays them overlaid. Calculates areas under peaks and
-    displays as a legend, plots Gaussian for visual comparison of peak shapes.
+    Shows the two peaks cut from the X-ray intensity trace by the analysis
+    service, overlaid, with their areas as a legend, and plots a Gaussian
+    for visual comparison of peak shapes. The results are taken from the
+    PVs of a headless service if the environment asks for them, and
+    otherwise from the service in this process, so the peaks and areas are
+    calculated once per acquisition however many plots there are. The areas
+    are kept in a history and their ratio is plotted as a trend.
+
+    The traces, peaks and legend are animated artists: they are blitted over
+    a cached background at no more than MAX_FPS, and the background is only
+    redrawn in full when the figure itself is drawn.
     """
 
+    MAX_FPS = 10
+    TREND_MIN_SPAN = 1.0  # Fewest minutes shown by the trend axes.
+    TREND_MARGIN = 0.1  # Fraction of the ratio range added above and below.
+
     def __init__(self, ctrls):
         BaseFigureCanvas.__init__(self)
 
-        self.ax = self.figure.add_subplot(2, 1, 1)
+        self.ax = self.figure.add_subplot(3, 1, 1)
         self.controls = ctrls
         self.pv_monitor = self.controls.PvMonitors.get_instance()
-        self.pv_monitor.register_trace_listener(self.update_waveforms)
-        self.pv_monitor.register_trace_listener(self.update_overlaid_plot)
+        self.pv_monitor.register_trace_listener(self.update_plots, batch=True)
 
-        trigger = self.pv_monitor.arrays[self.controls.Arrays.WAVEFORMS][0]
-        trace = self.pv_monitor.arrays[self.controls.Arrays.WAVEFORMS][1]
+        self.background = None
+        self.dirty = False
+        self.last_draw = 0
+        self.timings = Timings.get_instance()
+        self.draw_origin = None
+        self.service = analysis_service.results_source()
+        self.mpl_connect('draw_event', self.on_draw)
+
+        trigger = self.pv_monitor.get_waveforms()[0]
+        trace = self.pv_monitor.get_waveforms()[1]
 
         traces_x_axis = range(len(trace))
         self.trace_lines = [
@@ -211,8 +275,12 @@ class OverlaidWaveforms(BaseFigureCanvas):
         self.ax.set_ylabel('Voltage/V')
         self.ax.set_title('Square wave trigger signal and beam intensity trace')
 
-        self.ax2 = self.figure.add_subplot(2, 1, 2)
-        first_peak, second_peak = self.get_windowed_data(trigger, trace)
+        self.ax2 = self.figure.add_subplot(3, 1, 2)
+        result = self.service.latest
+        if result is None and isinstance(
+                self.service, analysis_service.AnalysisService):
+            result = self.service.analyse(trigger, trace)
+        first_peak, second_peak = result.peaks if result else ([], [])
         self.overlaid_x_axis = range(len(first_peak))
         self.overlaid_lines = [
                      self.ax2.plot(self.overlaid_x_axis, first_peak, 'b')[0],
@@ -221,81 +289,121 @@ class OverlaidWaveforms(BaseFigureCanvas):
         self.ax2.set_xlabel('Time samples')
         self.ax2.set_ylabel('Voltage/V')
         self.ax2.set_title('Beam intensity peaks overlaid')
-        plt.tight_layout()
+
+        self.ax3 = self.figure.add_subplot(3, 1, 3)
+        self.area_history = analysis.AreaHistory()
+        self.start_time = time.time()
+        self.trend_line = self.ax3.plot([], [], 'k')[0]
+        self.ax3.set_xlabel('Time/min')
+        self.ax3.set_ylabel('Area ratio')
+        self.ax3.set_title('Ratio of first to second peak area')
+        self.ax3.set_ymargin(self.TREND_MARGIN)
+        self.figure.tight_layout()
+
+        self.blit_lines = (self.trace_lines + self.overlaid_lines
+                           + [self.trend_line])
+        for line in self.blit_lines:
+            line.set_animated(True)
+        self.service.subscribe(self.show_result)
+
+    def on_draw(self, _):
+        """Cache the background of a full draw and draw the lines over it."""
+        self.background = self.copy_from_bbox(self.figure.bbox)
+        self.draw_animated()
+
+    def draw_animated(self):
+        """Draw the animated lines and legend onto the canvas."""
+        for artist in self.blit_lines:
+            self.figure.draw_artist(artist)
+        if self.ax2.legend_ is not None:
+            self.figure.draw_artist(self.ax2.legend_)
+
+    def request_draw(self):
+        """Mark the lines as changed and redraw them within 1/MAX_FPS s."""
+        if not self.dirty:
+            self.dirty = True
+            self.draw_origin = self.timings.origin
+            cothread.Spawn(self.draw_later)
+
+    def draw_later(self):
+        """Wait out the frame rate limit then blit the changed lines."""
+        wait = self.last_draw + 1.0 / self.MAX_FPS - time.time()
+        if wait > 0:
+            cothread.Sleep(wait)
+        self.dirty = False
+        self.last_draw = time.time()
+
+        if self.background is None:
+            self.draw_idle()
+        else:
+            self.restore_region(self.background)
+            self.draw_animated()
+            self.blit(self.figure.bbox)
+            self.timings.record_since(Stages.DRAW, self.last_draw)
+            self.timings.record_since(Stages.PV_TO_PIXEL, self.draw_origin)
+
+    def update_plots(self, changes):
+        """Update the traces once for a batch of changed PVs."""
+        for key in set(key for key, _ in changes):
+            self.update_waveforms(key, None)
 
     def update_waveforms(self, key, _):
         """Update plot data whenever it changes."""
         if key == self.controls.Arrays.WAVEFORMS:
-            self.trace_lines[0].set_ydata(self.pv_monitor.arrays[key][0])
-            self.trace_lines[1].set_ydata(self.pv_monitor.arrays[key][1])
-            self.draw()
-
-    def update_overlaid_plot(self, key, _):
-        """Update overlaid plot data whenever it changes, calculate areas."""
-        if key == self.controls.Arrays.WAVEFORMS:
-
-            trigger = self.pv_monitor.arrays[self.controls.Arrays.WAVEFORMS][0]
-            trace = self.pv_monitor.arrays[self.controls.Arrays.WAVEFORMS][1]
-            waveforms = [trigger, trace]
-
-            first_peak, second_peak = self.get_windowed_data(waveforms[0], waveforms[1])
-            self.overlaid_lines[0].set_ydata(first_peak)
-            self.overlaid_lines[0].set_xdata(range(len(first_peak)))
-            self.overlaid_lines[1].set_ydata(second_peak)
-            self.overlaid_lines[1].set_xdata(range(len(second_peak)))
-
-            areas = [integ.simps(first_peak), integ.simps(second_peak)]
-            labels = ['%.1f' % areas[0], '%.1f' % areas[1]]
-
-#            for area in areas:
-#                if area < 0.1:
-#                    raise RangeError # calculation warning error for example
-            self.ax2.legend([self.overlaid_lines[0], self.overlaid_lines[1]],
-                           labels)
-
-        self.draw()
-
-    def get_windowed_data(self, trigger, trace):
-        """Overlay the two peaks."""
-        try:
-            diff = np.diff(trigger)
-
-            length = len(trace)
-            # TODO: this parameter probably shouldn't be hard coded
-            stepvalue = 0.5
-
-            if min(diff) > -1 * stepvalue or max(diff) < stepvalue:
-                raise RangeError
-
-            maxtrig = next(x for x in diff if x > stepvalue)
-            mintrig = next(x for x in diff if x < -1 * stepvalue)
-            edges = [np.where(diff == maxtrig)[0][0],
-                     np.where(diff == mintrig)[0][0]]
-
+            self.trace_lines[0].set_ydata(self.pv_monitor.get_waveforms()[0])
+            self.trace_lines[1].set_ydata(self.pv_monitor.get_waveforms()[1])
+            self.request_draw()
 
-            cothread.Yield()
-            trigger_length = (edges[1]-edges[0])*2
-
-            if length < trigger_length:
-                raise RangeError
-            if edges[1] > edges[0]:  # So that colours don't swap around
-                first_peak = np.roll(trace[:trigger_length], - edges[0]
-                                - trigger_length/4)[:trigger_length/2]
-                second_peak = np.roll(trace[:trigger_length], - edges[1]
-                                - trigger_length/4)[:trigger_length/2]
-            else:
-                first_peak = np.roll(trace[:trigger_length], - edges[1]
-                                - trigger_length/4)[:trigger_length/2]
-                second_peak = np.roll(trace[:trigger_length], - edges[0]
-                                - trigger_length/4)[:trigger_length/2]
+    def show_result(self, result):
+        """
+        Update the overlaid plot and trend with the service's result.
 
-            return first_peak, second_peak
+        A stale result has been shown already, so only its legend changes.
+        """
+        if not result.stale:
+            self.overlaid_x_axis = range(len(result.peaks[0]))
+            for line, peak in zip(self.overlaid_lines, result.peaks):
+                line.set_ydata(peak)
+                line.set_xdata(range(len(peak)))
+            self.area_history.append(result.timestamp, *result.areas)
+            self.update_trend()
+
+        if result.valid:
+            labels = ['%.1f' % area for area in result.areas]
+        else:
+            labels = ['Trace cut off'] * 2
+        if result.stale:
+            labels = ['%s (stale)' % label for label in labels]
+        legend = self.ax2.legend(self.overlaid_lines[:2], labels)
+        legend.set_animated(True)
+        self.request_draw()
+
+    def update_trend(self):
+        """
+        Plot the history of the peak area ratio.
 
-        except RangeError:
-            print 'Trace is partially cut off' # status bar? callback?
-            first_peak = [float('nan'), float('nan')]
-            second_peak = [float('nan'), float('nan')]
-            return first_peak, second_peak
+        The trend is blitted like the other lines, so when the latest ratio
+        falls outside the axes they are rescaled and the background dropped
+        to force a full draw. The time axis is rescaled to twice the span of
+        the history, so that later ratios fit without another full draw
+        until the history has doubled.
+        """
+        history = self.area_history.get()
+        minutes = (history[:, analysis.AreaHistory.TIME]
+                   - self.start_time) / 60
+        ratios = history[:, analysis.AreaHistory.RATIO]
+        self.trend_line.set_data(minutes, ratios)
+
+        xmin, xmax = self.ax3.get_xlim()
+        ymin, ymax = self.ax3.get_ylim()
+        if np.isfinite(ratios[-1]) and not (xmin <= minutes[-1] <= xmax and
+                                            ymin <= ratios[-1] <= ymax):
+            self.ax3.relim()
+            self.ax3.autoscale_view()
+            start = minutes[0]
+            span = max(minutes[-1] - start, self.TREND_MIN_SPAN)
+            self.ax3.set_xlim(start, start + 2 * span)
+            self.background = None
 
     def gaussian(self, amp_step, sigma_step):
         """
@@ -316,22 +424,14 @@ class OverlaidWaveforms(BaseFigureCanvas):
 
         # This is new code to 'guess' the size of the Gaussian from the
         # existing data rather than from hard-coded numbers.
-        # TODO: test this! Possibly link up to the get_windowed_data function
-        # as it uses a lot of the same functionality
-        trigger = self.pv_monitor.arrays[self.controls.Arrays.WAVEFORMS][0]
-        trace = self.pv_monitor.arrays[self.controls.Arrays.WAVEFORMS][1]
+        # TODO: test this!
+        trigger = self.pv_monitor.get_waveforms()[0]
+        trace = self.pv_monitor.get_waveforms()[1]
         amplitude = max(trace) + amp_step
-        diff = np.diff(trigger)
-        stepvalue = 0.5
-        if min(diff) > -1 * stepvalue or max(diff) < stepvalue:
-            raise RangeError
-        else:
-            maxtrig = next(x for x in diff if x > stepvalue)
-            mintrig = next(x for x in diff if x < -1 * stepvalue)
-            edges = [np.where(diff == maxtrig)[0][0],
-                     np.where(diff == mintrig)[0][0]]
-            half_trigger_length = (edges[1]-edges[0])
-            sigma = half_trigger_length/4 + sigma_step
+        rising, falling = analysis.find_edges(
+            trigger, self.service.trigger_threshold)
+        half_trigger_length = abs(falling - rising)
+        sigma = half_trigger_length/4 + sigma_step
 
         gauss = self.ax2.plot(amplitude * np.exp(-x**2 / (2 * sigma**2)), 'r')
         self.overlaid_lines.append(gauss)
@@ -343,10 +443,3 @@ class OverlaidWaveforms(BaseFigureCanvas):
         self.ax2.relim()
         self.ax2.autoscale_view()
         self.draw()
-
-
-class RangeError(Exception):
-
-    """Raised when the trace data is partially cut off."""
-
-    pass
@@ -0,0 +1,268 @@
+#!/usr/bin/env dls-python2.7
+"""Replay recorded PV values through PvMonitors without channel access.
+
+ReplayBackend stands in for cothread.catools: it answers caget from stored
+values, and replays timelines of recorded values into camonitor callbacks
+at a chosen speed. Run this module to drive either GUI from the recorded
+traces in example_data, e.g. to benchmark the plots offline; --timings
+saves the latency histograms of the run.
+"""
+
+
+from versions import require_versions
+if __name__ == '__main__':
+    # The GUIs are imported later and keep these versions, which suit both.
+    require_versions('numpy==1.11.1', 'scipy==0.10.1', 'matplotlib==1.3.1',
+                     'cothread==2.13')
+
+import argparse
+import os
+import time
+
+import numpy as np
+import cothread
+
+from controls import PvReferences, PvMonitors
+from instrumentation import Timings
+
+
+EXAMPLE_DATA = os.path.join(os.path.dirname(__file__), 'example_data')
+
+# Placeholder magnet current limits (Amps) for replayed chicanes.
+REPLAY_IMAX = 20.0
+REPLAY_IMIN = -20.0
+
+
+class ReplayFloat(float):
+
+    """Float with the attributes of a cothread augmented value."""
+
+    pass
+
+
+class ReplayInt(int):
+
+    """Int with the attributes of a cothread augmented value."""
+
+    pass
+
+
+class ReplayStr(str):
+
+    """String with the attributes of a cothread augmented value."""
+
+    pass
+
+
+class ReplayArray(np.ndarray):
+
+    """Array with the attributes of a cothread augmented value."""
+
+    pass
+
+
+def augment(value, name, severity=0, enums=None):
+    """
+    Wrap a value so that it looks like one returned by cothread.
+
+    Args:
+        value: recorded value, numpy array, string, int or float
+        name (str): name of the PV
+        severity (int): alarm severity of the value
+        enums (list): enum strings, for enum PVs monitored with FORMAT_CTRL
+    Returns:
+        value with name, ok, severity, status and timestamp attributes
+    """
+    if isinstance(value, np.ndarray):
+        result = value.view(ReplayArray)
+    elif isinstance(value, str):
+        result = ReplayStr(value)
+    elif isinstance(value, int):
+        result = ReplayInt(value)
+    else:
+        result = ReplayFloat(value)
+
+    result.name = name
+    result.ok = True
+    result.severity = severity
+    result.status = 0
+    result.timestamp = time.time()
+    if enums is not None:
+        result.enums = enums
+    return result
+
+
+class ReplayBackend(object):
+
+    """
+    PV backend replaying recorded values.
+
+    Writes with caput are stored and passed on to monitors, so jogs made
+    while replaying are seen by the listeners like real PV changes.
+    """
+
+    def __init__(self, values, timelines=None, speed=1.0, enums=None):
+        """
+        Initialise the stored values and the replay events.
+
+        Args:
+            values (dict): initial value of every PV, by name
+            timelines (dict): list of (seconds, value) to replay, by name
+            speed (float): replay speed relative to the recording, or None
+                to replay as fast as possible
+            enums (dict): enum strings of enum PVs, by name
+        """
+        self.enums = enums or {}
+        self.values = dict(
+            (pv, self._augment(pv, value)) for pv, value in values.items())
+        self.events = sorted(
+            ((t, pv, self._augment(pv, value))
+             for pv, timeline in (timelines or {}).items()
+             for t, value in timeline),
+            key=lambda event: event[0])
+        self.speed = speed
+        self.monitors = {}
+
+    def _augment(self, pv, value):
+        return augment(value, pv, enums=self.enums.get(pv))
+
+    def caget(self, pvs, **kwargs):
+        throw = kwargs.get('throw', True)
+        if isinstance(pvs, str):
+            return self._get(pvs, throw)
+        return [self._get(pv, throw) for pv in pvs]
+
+    def _get(self, pv, throw):
+        """Return a stored value, or like catools a failed one if not throw."""
+        if throw or pv in self.values:
+            return self.values[pv]
+        nothing = augment(0, pv)
+        nothing.ok = False
+        return nothing
+
+    def camonitor(self, pvs, callback, **kwargs):
+        if isinstance(pvs, str):
+            pvs = [pvs]
+        for pv in pvs:
+            self.monitors.setdefault(pv, []).append(callback)
+
+    def caput(self, pvs, values, **kwargs):
+        if isinstance(pvs, str):
+            pvs, values = [pvs], [values]
+        for pv, value in zip(pvs, values):
+            self.update(pv, self._augment(pv, value))
+
+    def update(self, pv, value):
+        """Store a new value and pass it to the PV's monitors."""
+        value.timestamp = time.time()
+        self.values[pv] = value
+        for callback in self.monitors.get(pv, []):
+            callback(value)
+
+    def play(self):
+        """Replay the timelines, yielding to other cothreads between events."""
+        start = time.time()
+        for t, pv, value in self.events:
+            if self.speed:
+                delay = start + t / self.speed - time.time()
+                if delay > 0:
+                    cothread.Sleep(delay)
+                else:
+                    cothread.Yield()
+            else:
+                cothread.Yield()
+            self.update(pv, value)
+
+    def start(self):
+        """Replay the timelines in a new cothread."""
+        return cothread.Spawn(self.play)
+
+
+def default_values(directory=EXAMPLE_DATA):
+    """
+    Initial values for all the PVs used by the GUIs.
+
+    Magnets start with zero currents and placeholder limits; the traces
+    start as the recording in directory.
+    """
+    values = {
+        PvReferences.TRACES[0]: np.load(
+            os.path.join(directory, 'trigger.npy')),
+        PvReferences.TRACES[1]: np.load(
+            os.path.join(directory, 'diode.npy')),
+        PvReferences.MAGNET_STATUS_PV: 0,
+        PvReferences.BURT_STATUS_PV: 1,
+        PvReferences.CYCLING_STATUS_PV: 0,
+    }
+    for ctrl in PvReferences.CTRLS:
+        values[ctrl + ':OFFSET'] = 0.0
+        values[ctrl + ':WFSCA'] = 0.0
+    for name in PvReferences.NAMES:
+        values[name + ':SETWFSCA'] = 0.0
+        values[name + ':SETI'] = 0.0
+        values[name + ':IMIN'] = REPLAY_IMIN
+        values[name + ':IMAX'] = REPLAY_IMAX
+        values[name + ':ERRGSTR'] = ''
+    return values
+
+
+def waveform_timelines(directory=EXAMPLE_DATA, count=1000, interval=0.1):
+    """
+    Timelines repeating the recorded trigger and trace.
+
+    Args:
+        directory (str): directory containing trigger.npy and diode.npy
+        count (int): number of acquisitions to replay
+        interval (float): seconds between acquisitions
+    Returns:
+        dict: list of (seconds, value) for each trace PV
+    """
+    trigger = np.load(os.path.join(directory, 'trigger.npy'))
+    trace = np.load(os.path.join(directory, 'diode.npy'))
+    times = np.arange(count) * interval
+    return {
+        PvReferences.TRACES[0]: [(t, trigger) for t in times],
+        PvReferences.TRACES[1]: [(t, trace) for t in times],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run an I10 chicane GUI on recorded PV values.')
+    parser.add_argument('gui', choices=['beamline', 'accelerator'])
+    parser.add_argument('--data', default=EXAMPLE_DATA,
+                        help='directory containing trigger.npy and diode.npy')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='number of acquisitions to replay')
+    parser.add_argument('--interval', type=float, default=0.1,
+                        help='seconds between recorded acquisitions')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed, 0 for as fast as possible')
+    parser.add_argument('--timings',
+                        help='file to write latency histograms to on exit')
+    args = parser.parse_args()
+
+    backend = ReplayBackend(
+        default_values(args.data),
+        waveform_timelines(args.data, args.count, args.interval),
+        speed=args.speed or None,
+        enums={PvReferences.CYCLING_STATUS_PV: ['Replay']})
+    PvMonitors.set_backend(backend)
+
+    cothread.iqt()
+    if args.gui == 'beamline':
+        import beamline_ui
+        gui = beamline_ui.BeamlineGui()
+    else:
+        import accelerators_ui
+        gui = accelerators_ui.AccelGui()
+    gui.ui.show()
+    backend.start()
+    cothread.WaitForQuit()
+
+    if args.timings:
+        Timings.get_instance().dump(args.timings)
+
+
+if __name__ == '__main__':
+    main()
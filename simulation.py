@@ -140,7 +140,10 @@ class Layout(object):
         self.xaxis = [0]
         self.xaxis.extend([i.s for i in self.path
                       if i.get_type() != 'drift'])
-        self.travel = [Drift(self.ids[i].s) for i in range(len(self.ids))]
+        self.xaxis_index = [0]
+        self.xaxis_index.extend([idx for idx, i in enumerate(self.path)
+                            if i.get_type() != 'drift'])
+        self._compile()
 
     def _load(self, filename):
         """Load data from configuration file.
@@ -157,12 +160,42 @@ class Layout(object):
 
         # Set lengths of drifts.
 
-        for p in path:
+        for p, next_p in zip(path, path[1:]):
             if p.get_type() == 'drift':
-                p.set_length(path[path.index(p)+1].s - p.s)
+                p.set_length(next_p.s - p.s)
 
         return path
 
+    def _compile(self):
+        """
+        Precompute the straight as contiguous arrays.
+
+        Every element either drifts the beam (position += length * angle) or
+        kicks it (angle += k), so propagation reduces to two cumulative sums
+        over per-element lengths and kicks. Indices of the kickers and
+        insertion devices in the path are stored so that kicks can be
+        scattered in and photon beams gathered out without visiting elements.
+
+        As the beams are linear in the kicks, their response to a unit kick
+        from each kicker is also stored, with kickers along the last axis:
+        electron_response has shape (elements, 2, kickers) and
+        photon_response (ids, 4, kickers).
+        """
+        types = [x.get_type() for x in self.path]
+        self._lengths = np.array([x.length if t == 'drift' else 0.0
+                                  for x, t in zip(self.path, types)])
+        self._kicker_index = np.array(
+            [i for i, t in enumerate(types) if t == 'kicker'], dtype=int)
+        self._id_index = np.array(
+            [i for i, t in enumerate(types) if t == 'insertiondevice'],
+            dtype=int)
+        self._photon_lengths = np.array(
+            [end - start for start, end in self.photon_coordinates])
+
+        e_beams, p_beams = self.propagate(np.eye(len(self._kicker_index)))
+        self.electron_response = e_beams.transpose(1, 2, 0)
+        self.photon_response = p_beams.transpose(1, 2, 0)
+
     def get_elements(self, which):
         """Return list of elements of a particular type from the straight.
 
@@ -174,7 +207,7 @@ class Layout(object):
         """
         return [x for x in self.path if x.get_type() == which]
 
-    def generate_beams(self):
+    def generate_beams(self, kicks=None):
         """
         Generate electron beam and photon beams.
 
@@ -182,22 +215,39 @@ class Layout(object):
         complete electron beam from list of vectors at positions along straight.
         Photon beams are initialised at the two insertion devices.
 
+        Args:
+            kicks (numpy array): kicker strengths; defaults to the strengths
+                currently set on the kickers
         Returns:
             e_beam (numpy array): list of electron vectors
-            p_beam (list): list of photon vectors
+            p_beam (numpy array): list of photon vectors
         """
-        e_vector = np.array([0, 0])
-        e_beam = np.zeros((len(self.path), 2))
-        p_vector = []
+        if kicks is None:
+            kicks = [kicker.k for kicker in self.kickers]
+        return self.propagate(kicks)
 
-        for x in self.path:
-            if x.get_type() != 'detector':
-                e_vector = x.increment(e_vector)
-                e_beam[self.path.index(x)+1] = e_vector
-            if x.get_type() == 'insertiondevice':
-                p_vector.append(e_vector.tolist())
+    def propagate(self, kicks):
+        """
+        Send an electron beam through the precomputed straight.
 
-        p_beam = self.create_photon_beam(p_vector)
+        Args:
+            kicks (numpy array): kicker strengths, one per kicker in the last
+                axis; any leading axes are broadcast over
+        Returns:
+            e_beam (numpy array): electron vectors entering each element
+            p_beam (numpy array): photon vectors from each insertion device
+        """
+        kicks = np.asarray(kicks, dtype=float)
+        element_kicks = np.zeros(kicks.shape[:-1] + (len(self.path),))
+        element_kicks[..., self._kicker_index] = kicks
+
+        angles = np.cumsum(element_kicks, axis=-1)
+        positions = np.cumsum(angles * self._lengths, axis=-1)
+        vectors = np.stack((positions, angles), axis=-1)
+
+        e_beam = np.zeros(vectors.shape)
+        e_beam[..., 1:, :] = vectors[..., :-1, :]
+        p_beam = self.create_photon_beam(vectors[..., self._id_index, :])
 
         return e_beam, p_beam
 
@@ -206,15 +256,11 @@ class Layout(object):
         Take initialised photon beams and extend them to the detector.
 
         Args:
-            vector (list): initialised photon beams
+            vector (numpy array): initialised photon beams
         Returns:
-            vector (list): extended photon beams
+            vector (numpy array): extended photon beams
         """
-        for i in range(len(self.ids)):
-            self.travel[i].set_length(self.photon_coordinates[i][1]
-                                      - self.photon_coordinates[i][0])
-            vector[i].extend(self.travel[i].increment(vector[i]))
-
-        return vector
-
-
+        vector = np.asarray(vector, dtype=float)
+        end = vector[..., 0] + self._photon_lengths * vector[..., 1]
+        return np.concatenate(
+            (vector, np.stack((end, vector[..., 1]), axis=-1)), axis=-1)
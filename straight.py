@@ -10,8 +10,9 @@ RealModeController.
 """
 
 
+import os
+
 import numpy as np
-import scipy.constants
 
 import simulation
 import controls
@@ -27,9 +28,14 @@ class RealModeController(object):
 
     def __init__(self):
         self.pvm = controls.PvMonitors.get_instance()
-        self.pvm.register_straight_listener(self.update)
+        self.pvm.register_straight_listener(self.update_changes, batch=True)
         self.straights = []
 
+    def update_changes(self, changes):
+        """Update scales and offsets once for a batch of changed PVs."""
+        for key in set(key for key, _ in changes):
+            self.update(key, None)
+
     def update(self, key, _):
         """Update scales and offsets whenever they change."""
         if key == controls.Arrays.SCALES:
@@ -61,8 +67,11 @@ class SimModeController(object):
     def __init__(self):
 
         self.straights = []
-        self.offsets = controls.PvMonitors.get_instance().get_offsets()
-        self.scales = controls.PvMonitors.get_instance().get_scales()
+        # Copies, as the PV getters return views of the live values.
+        self.offsets = np.array(
+            controls.PvMonitors.get_instance().get_offsets(), dtype=float)
+        self.scales = np.array(
+            controls.PvMonitors.get_instance().get_scales(), dtype=float)
 
     def update_sim(self, key, values):
         """
@@ -73,11 +82,11 @@ class SimModeController(object):
             values (list): list of jogs to be applied
         """
         if key == controls.Arrays.SCALES:
-            self.scales = values
+            self.scales = np.array(values, dtype=float)
             self.update_scales()
 
         if key == controls.Arrays.OFFSETS:
-            self.offsets = values
+            self.offsets = np.array(values, dtype=float)
             self.update_offsets()
 
     def register_straight(self, straight):
@@ -121,9 +130,18 @@ class Straight(object):
     beam and produces photon beams at the insertion devices.
     """
 
-    BEAM_RIGIDITY = 3e9/scipy.constants.c
+    SPEED_OF_LIGHT = 299792458.0  # Metres per second, exact.
+    BEAM_RIGIDITY = 3e9/SPEED_OF_LIGHT
     AMP_TO_TESLA = np.array([  # Values from MML magnet_calibrations.csv
         0.034796/23, -0.044809/23, 0.011786/12, -0.045012/23, 0.035174/23])
+    # Sine of half the kick per amp, broadcast over the last (magnet) axis.
+    AMP_TO_SINE = AMP_TO_TESLA / (2.0 * BEAM_RIGIDITY)
+    # Signs pointing each magnet's kick in the right direction.
+    KICK_DIRECTIONS = np.array([1, -1, 1, -1, 1])
+    # Signs of the magnet currents of the bump deflecting each photon beam.
+    BUMP_DIRECTIONS = np.array([[1, -1, 1, 0, 0], [0, 0, 1, -1, 1]])
+    PERIOD = 200  # Time steps in one cycle of calculate_strengths.
+    LAYOUT_FILENAME = 'config.txt'
 
     def __init__(self):
         """
@@ -132,44 +150,107 @@ class Straight(object):
         Get layout of straight, initialise values of PVs and link them
         up to listen to the monitored PV values.
         """
-        self.data = simulation.Layout('config.txt')
-        self.scales = controls.PvMonitors.get_instance().get_scales()
-        self.offsets = controls.PvMonitors.get_instance().get_offsets()
+        self.layout_filename = os.path.abspath(self.LAYOUT_FILENAME)
+        self.data = None
+        self._layout_mtime = None
+        self.reload_layout()
+        self.scales = np.array(
+            controls.PvMonitors.get_instance().get_scales(), dtype=float)
+        self.offsets = np.array(
+            controls.PvMonitors.get_instance().get_offsets(), dtype=float)
+        self._cycle = None
+
+    def reload_layout(self):
+        """
+        Load the layout, and with it the responses, if the file changed.
+
+        The file is only checked when this is called, not as the beams are
+        calculated, so that animation frames do not touch the filesystem.
+
+        Returns:
+            bool: whether the layout was loaded
+        """
+        mtime = os.path.getmtime(self.layout_filename)
+        if mtime == self._layout_mtime:
+            return False
+        self.data = simulation.Layout(self.layout_filename)
+        self._layout_mtime = mtime
+        self._cycle = None
+        return True
+
+    def response(self):
+        """
+        Return the linear response of the beams to each kicker.
+
+        The responses are built with the layout and kept until the layout
+        is reloaded.
+
+        Returns:
+            electron_response (numpy array): change of the electron vectors
+                per radian of kick, shape (elements, 2, kickers)
+            photon_response (numpy array): change of the photon vectors per
+                radian of kick, shape (ids, 4, kickers)
+        """
+        return self.data.electron_response, self.data.photon_response
+
+    def beams(self, kicks):
+        """
+        Calculate electron and photon beams from the response matrices.
+
+        Args:
+            kicks (numpy array): kicker strengths, one per kicker in the last
+                axis; any leading axes are broadcast over
+        Returns:
+            e_beam (numpy array): electron vectors entering each element
+            p_beam (numpy array): photon vectors from each insertion device
+        """
+        electron_response, photon_response = self.response()
+        return (np.dot(kicks, electron_response.transpose(0, 2, 1)),
+                np.dot(kicks, photon_response.transpose(0, 2, 1)))
 
     def set_scales(self, scales):
-        self.scales = scales
+        """Store a copy of the scales, discarding the cycle if they changed."""
+        scales = np.array(scales, dtype=float)
+        if not np.array_equal(scales, self.scales):
+            self.scales = scales
+            self._cycle = None
 
     def set_offsets(self, offsets):
-        self.offsets = offsets
+        """Store a copy of the offsets, discarding the cycle if they changed."""
+        offsets = np.array(offsets, dtype=float)
+        if not np.array_equal(offsets, self.offsets):
+            self.offsets = offsets
+            self._cycle = None
 
     def amps_to_radians(self, current):
         """
         Convert currents (Amps) to fields (Tesla) to kick strength (rads).
 
         Args:
-            current (numpy array): array of magnet current values
+            current (numpy array): array of magnet current values, with
+                magnets along the last axis
         Returns:
-            kick (numpy array): array of strengths
+            kick (numpy array): array of strengths of the same shape
         """
-        field = current * self.AMP_TO_TESLA
-        kick = np.array([2.0 * np.arcsin(x / (2.0 * self.BEAM_RIGIDITY))
-                            for x in field])
-        return kick
+        return 2.0 * np.arcsin(
+            np.asarray(current, dtype=float) * self.AMP_TO_SINE)
 
     def calculate_strengths(self, t):
         """
         Calculate time-varying strengths of kicker magnets.
             Args:
-                t (int): time in sec
+                t (int or numpy array): time in sec, or an array of times
             Returns:
-                new kicker strengths (array of 5 by 1)
-        """
-        waves = np.array([
-                np.sin(t * np.pi / 100) + 1,
-                np.sin(t * np.pi / 100) + 1,
-                2,
-                -np.sin(t * np.pi / 100) + 1,
-                -np.sin(t * np.pi / 100) + 1]) * 0.5
+                new kicker strengths (array of 5 by 1, or times by 5)
+        """
+        t = np.asarray(t, dtype=float)[..., np.newaxis]
+        wave = np.sin(t * np.pi / 100)
+        waves = np.concatenate((
+                wave + 1,
+                wave + 1,
+                np.ones_like(wave) * 2,
+                -wave + 1,
+                -wave + 1), axis=-1) * 0.5
         return self.amps_to_radians(self.scales * waves + self.offsets)
 
     def _strength_setup(self, strength_values):
@@ -189,32 +270,84 @@ class Straight(object):
 
         return e_beam, p_beam
 
+    def step_many(self, times):
+        """
+        Create electron and photon beams for many times in one pass.
+
+        Args:
+            times (numpy array): times at which to evaluate the straight
+        Returns:
+            e_beam (numpy array): electron vectors, shape (times, elements, 2)
+            p_beam (numpy array): photon vectors, shape (times, ids, 4)
+        """
+        return self.beams(self.calculate_strengths(times))
+
+    def cycle(self):
+        """
+        Create electron and photon beams for one period of the magnets.
+
+        The beams are calculated once with step_many and cached until the
+        scales or offsets change or the layout is reloaded.
+
+        Returns:
+            e_beam (numpy array): electron vectors for times 0 to PERIOD - 1
+            p_beam (numpy array): photon vectors for times 0 to PERIOD - 1
+        """
+        if self._cycle is None:
+            self._cycle = self.step_many(np.arange(self.PERIOD))
+        return self._cycle
+
+    def sweep_envelope(self):
+        """
+        Find the range over which the photon beams sweep during a cycle.
+
+        The range is taken from the cached cycle, so it is calculated in one
+        pass for all times and does not change the kickers.
+
+        Returns:
+            low (numpy array): lowest position of each photon beam at its
+                insertion device and at the detector, shape (ids, 2)
+            high (numpy array): highest positions, shape (ids, 2)
+        """
+        positions = self.cycle()[1][..., [0, 2]]
+        return positions.min(axis=0), positions.max(axis=0)
+
+    def limit_envelope(self, max_currents):
+        """
+        Find the photon beams produced with the magnets at maximum current.
+
+        Each photon beam is deflected by the magnets of its own bump at
+        their maximum currents, with the other magnets off.
+
+        Args:
+            max_currents (numpy array): maximum current of each magnet
+        Returns:
+            numpy array: position of each photon beam at its insertion
+            device and at the detector, shape (ids, 2)
+        """
+        currents = self.BUMP_DIRECTIONS * np.asarray(max_currents, dtype=float)
+        p_beams = self.p_beam_lim(currents)
+        ids = np.arange(len(currents))
+        return p_beams[ids, ids][:, [0, 2]]
+
     def p_beam_range(self, strength_values):
         """
         Find edges of photon beam range.
 
         Calculate beams defining maximum range through which the
-        photon beams sweep during a cycle.
+        photon beams sweep during a cycle. Many sets of strength values can
+        be given at once, one per row.
         """
-        self._strength_setup(self.amps_to_radians(
-            self.scales * strength_values + self.offsets))
-
-        p_beam = self.data.generate_beams()[1]
-
-        return p_beam
+        return self.beams(self.amps_to_radians(
+            self.scales * strength_values + self.offsets))[1]
 
     def p_beam_lim(self, currents):
         """
         Plot limits on the photon beams due to magnet strengths.
 
         Calculate the photon beam produced by magnets at their maximum
-        strength settings.
+        strength settings. Many sets of currents can be given at once, one
+        per row.
         """
-        kick_limits = (self.amps_to_radians(currents)
-                      * np.array([1, -1, 1, -1, 1]))
-        # multiply by +1 and -1 to point magnets in right directions
-        self._strength_setup(kick_limits)
-        p_beam = self.data.generate_beams()[1]
-
-        return p_beam
-
+        kick_limits = self.amps_to_radians(currents) * self.KICK_DIRECTIONS
+        return self.beams(kick_limits)[1]
@@ -0,0 +1,12 @@
+"""Stand ins for the parts of cothread used by the modules under test."""
+
+
+class Task(object):
+
+    """Stand in for a cothread Spawn that runs immediately."""
+
+    def __init__(self, func, *args, **kwargs):
+        self.result = func(*args)
+
+    def Wait(self):
+        return self.result
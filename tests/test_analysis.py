@@ -0,0 +1,111 @@
+import unittest
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import analysis
+
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'example_data')
+
+
+def square_wave(periods, period, first_edge):
+    """Trigger rising at first_edge and switching every half period."""
+    samples = np.arange(periods * period)
+    return ((samples - first_edge - 1) // (period // 2) % 2 == 0) * 3.0
+
+
+class AnalysisTests(unittest.TestCase):
+
+    def setUp(self):
+        self.trigger = np.load(os.path.join(DATA, 'trigger.npy'))
+        self.trace = np.load(os.path.join(DATA, 'diode.npy'))
+
+    def test_find_edges(self):
+        self.assertEqual(analysis.find_edges(self.trigger), (2449, 4949))
+
+    def test_find_edges_threshold(self):
+        self.assertRaises(analysis.RangeError,
+                          analysis.find_edges, self.trigger, 10)
+
+    def test_flat_trigger_raises(self):
+        self.assertRaises(analysis.RangeError,
+                          analysis.find_edges, np.zeros(100))
+
+    def test_window_peaks_of_example_data(self):
+        first_peak, second_peak = analysis.window_peaks(
+            self.trigger, self.trace)
+        np.testing.assert_array_equal(first_peak, self.trace[3699:6199])
+        np.testing.assert_array_equal(second_peak, self.trace[1199:3699])
+
+    def test_windows_are_views(self):
+        first_peak, second_peak = analysis.window_peaks(
+            self.trigger, self.trace)
+        self.assertIs(first_peak.base, self.trace)
+        self.assertIs(second_peak.base, self.trace)
+
+    def test_window_wraps_within_single_period(self):
+        trigger = square_wave(1, 400, 50)
+        trace = np.arange(400.0)
+        first_peak, second_peak = analysis.window_peaks(trigger, trace)
+        expected = np.roll(trace, -50 - 100)[:200]
+        np.testing.assert_array_equal(first_peak, expected)
+        expected = np.roll(trace, -250 - 100)[:200]
+        np.testing.assert_array_equal(second_peak, expected)
+
+    def test_short_trace_raises(self):
+        trigger = square_wave(1, 400, 50)
+        self.assertRaises(analysis.RangeError,
+                          analysis.window_peaks, trigger, np.zeros(300))
+
+    def test_stack_peaks_of_example_data(self):
+        first_peaks, second_peaks = analysis.stack_peaks(
+            self.trigger, self.trace)
+        np.testing.assert_array_equal(first_peaks, [self.trace[3699:6199]])
+        np.testing.assert_array_equal(
+            second_peaks, [self.trace[1199:3699], self.trace[6199:8699]])
+
+    def test_stack_peaks_of_every_period(self):
+        trigger = square_wave(5, 400, 50)
+        trace = np.tile(np.sin(np.arange(400) / 30.0), 5)
+        first_peaks, second_peaks = analysis.stack_peaks(trigger, trace)
+        self.assertEqual(first_peaks.shape, (5, 200))
+        self.assertEqual(second_peaks.shape, (4, 200))
+        first_peak, second_peak = analysis.window_peaks(trigger, trace)
+        np.testing.assert_allclose(first_peaks, [first_peak] * 5)
+        np.testing.assert_allclose(second_peaks, [second_peak] * 4)
+
+    def test_average_peaks_reduces_noise(self):
+        trigger = square_wave(50, 400, 50)
+        clean = np.tile(np.sin(np.arange(400) / 30.0), 50)
+        trace = clean + np.random.RandomState(0).normal(0, 0.1, clean.shape)
+        means, stds = analysis.average_peaks(trigger, trace)
+        first_peak = analysis.window_peaks(trigger, clean)[0]
+        self.assertLess(np.abs(means[0] - first_peak).max(), 0.1)
+        np.testing.assert_allclose(stds[0], 0.1, rtol=0.5)
+
+
+class AreaHistoryTests(unittest.TestCase):
+
+    def test_history_is_oldest_first(self):
+        history = analysis.AreaHistory(4)
+        self.assertEqual(history.get().shape, (0, 4))
+        for t in range(3):
+            history.append(t, 2.0 * t, 4.0)
+        np.testing.assert_array_equal(
+            history.get(), [[0, 0, 4, 0], [1, 2, 4, 0.5], [2, 4, 4, 1]])
+
+    def test_history_overwrites_oldest(self):
+        history = analysis.AreaHistory(4)
+        for t in range(10):
+            history.append(t, t, 1.0)
+        np.testing.assert_array_equal(
+            history.get()[:, analysis.AreaHistory.TIME], [6, 7, 8, 9])
+        self.assertIs(history.get().base, history.data)
+
+    def test_zero_second_area_gives_nan_ratio(self):
+        history = analysis.AreaHistory(4)
+        history.append(0, 1.0, 0.0)
+        self.assertTrue(np.isnan(history.get()[0, analysis.AreaHistory.RATIO]))
@@ -0,0 +1,295 @@
+import unittest
+import os
+import StringIO
+import sys
+import threading
+import time
+
+import mock
+import numpy as np
+
+# Mock out cothread as it requires EPICS binaries at import
+sys.modules['cothread'] = mock.MagicMock()
+sys.modules['cothread.catools'] = mock.MagicMock()
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import analysis
+import analysis_service
+import replay
+from controls import Arrays, PvReferences
+
+
+DATA = os.path.join(os.path.dirname(__file__), '..', 'example_data')
+
+
+class AnalysisServiceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.trigger = np.load(os.path.join(DATA, 'trigger.npy'))
+        self.trace = np.load(os.path.join(DATA, 'diode.npy'))
+        self.pvm = mock.Mock()
+        self.pvm.get_waveforms.return_value = [self.trigger, self.trace]
+        patcher = mock.patch.object(analysis_service.PvMonitors,
+                                    'get_instance', return_value=self.pvm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.service = analysis_service.AnalysisService()
+        self.results = []
+        self.service.subscribe(self.results.append)
+
+    def test_acquisition_is_analysed_once(self):
+        self.pvm.register_trace_listener.assert_called_once_with(
+            self.service.update, batch=True)
+        self.service.update([(Arrays.WAVEFORMS, 0), (Arrays.WAVEFORMS, 1)])
+        self.assertEqual(len(self.results), 1)
+        result = self.results[0]
+        self.assertIs(self.service.latest, result)
+
+        peaks = analysis.window_peaks(self.trigger, self.trace)
+        for peak, expected in zip(result.peaks, peaks):
+            np.testing.assert_array_equal(peak, expected)
+        self.assertEqual(result.areas,
+                         tuple(analysis.peak_area(peak) for peak in peaks))
+        self.assertAlmostEqual(result.ratio,
+                               result.areas[0] / result.areas[1])
+
+    def test_other_pvs_are_ignored(self):
+        self.service.update([(Arrays.OFFSETS, 0)])
+        self.assertEqual(self.results, [])
+
+    def test_averaged_peaks(self):
+        self.service.average_periods = True
+        result = self.service.analyse(self.trigger, self.trace)
+        means, _ = analysis.average_peaks(self.trigger, self.trace)
+        np.testing.assert_array_equal(result.peaks[1], means[1])
+
+    def test_cut_off_trace_is_published_as_invalid(self):
+        result = self.service.analyse(np.zeros(100), np.zeros(100))
+        self.assertEqual(self.results, [result])
+        self.assertFalse(result.valid)
+        self.assertTrue(np.isnan(result.areas).all())
+        self.assertTrue(np.isnan(result.peaks[0]).all())
+
+    def test_failed_analysis_is_published_as_invalid(self):
+        with mock.patch.object(analysis_service, 'analyse_peaks',
+                               side_effect=ValueError), \
+                mock.patch('sys.stdout'):
+            self.service.update([(Arrays.WAVEFORMS, 0)])
+        self.assertEqual(len(self.results), 1)
+        self.assertFalse(self.results[0].valid)
+
+    def test_results_go_to_every_output(self):
+        output = mock.Mock()
+        self.service.add_output(output)
+        result = self.service.analyse(self.trigger, self.trace)
+        output.publish.assert_called_once_with(result)
+        self.assertEqual(self.results, [result])
+
+    def test_pv_output(self):
+        result = analysis_service.AnalysisResult(
+            0, [np.ones(3), np.zeros(3)], [4.0, 0.0])
+        self.assertTrue(np.isnan(result.ratio))
+        analysis_service.PvOutput().publish(result)
+        peaks, areas = self.pvm.backend.caput.call_args_list
+        self.assertEqual(areas[0][0],
+                         PvReferences.AREA_PVS + [PvReferences.RATIO_PV])
+        self.assertEqual(areas[0][1][:2], [4.0, 0.0])
+        self.assertEqual(peaks[0][0], PvReferences.PEAK_PVS)
+
+    def test_offloaded_results_are_published(self):
+        self.service.offload(process=False)
+        self.addCleanup(self.service.worker.close)
+        with mock.patch.object(analysis_service.cothread, 'Callback',
+                               side_effect=lambda f, *args: f(*args)):
+            self.service.update([(Arrays.WAVEFORMS, 0)])
+            self.service.worker.close()
+        self.assertEqual(len(self.results), 1)
+        self.assertEqual(self.results[0].areas, self.service.analyse(
+            self.trigger, self.trace).areas)
+
+    def test_offload_closes_the_previous_worker(self):
+        with mock.patch.object(analysis_service, 'AnalysisWorker',
+                               side_effect=lambda *args: mock.Mock()):
+            self.service.offload(process=False)
+            first = self.service.worker
+            self.service.offload(process=True, capacity=100)
+        first.close.assert_called_once_with()
+        self.assertFalse(self.service.worker.close.called)
+
+
+class AnalysisWorkerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.trigger = np.load(os.path.join(DATA, 'trigger.npy'))
+        self.trace = np.load(os.path.join(DATA, 'diode.npy'))
+        self.results = []
+        self.received = threading.Event()
+        patcher = mock.patch.object(analysis_service.cothread, 'Callback',
+                                    side_effect=lambda f, *args: f(*args))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def callback(self, result, seconds):
+        self.results.append(result)
+        self.received.set()
+
+    def analyse_in_worker(self, process):
+        worker = analysis_service.AnalysisWorker(self.callback, process)
+        self.addCleanup(worker.close)
+        worker.submit(self.trigger, self.trace, 0.5, False)
+        self.assertTrue(self.received.wait(10))
+        self.assertFalse(worker.busy)
+        peaks, areas = analysis_service.analyse_peaks(
+            self.trigger, self.trace, 0.5, False)
+        np.testing.assert_array_equal(self.results[0].peaks[0], peaks[0])
+        self.assertEqual(self.results[0].areas, tuple(areas))
+
+    def test_thread_worker(self):
+        self.analyse_in_worker(process=False)
+
+    def test_process_worker(self):
+        self.analyse_in_worker(process=True)
+
+    def test_stale_acquisitions_are_dropped(self):
+        worker = analysis_service.AnalysisWorker(self.callback)
+        with mock.patch.object(worker, '_send') as send:
+            for value in range(3):
+                worker.busy = send.called
+                worker.submit([value], [value], 0.5, False)
+            self.assertEqual(send.call_count, 1)
+            self.assertEqual(worker.dropped, 1)
+            worker._finish('result', None, 0.1)
+        self.assertEqual(send.call_args_list[1][0][:2], ([2], [2]))
+        self.assertIsNone(worker.pending)
+        self.assertEqual(self.results, ['result'])
+
+    def test_worker_survives_errors(self):
+        worker = analysis_service.AnalysisWorker(self.callback, False)
+        self.addCleanup(worker.close)
+        real_analyse = analysis_service.analyse_peaks
+        with mock.patch.object(analysis_service, 'analyse_peaks',
+                               side_effect=[ValueError, real_analyse(
+                                   self.trigger, self.trace, 0.5, False)]):
+            worker.submit(self.trigger, self.trace, 0.5, False)
+            worker.submit(self.trigger, self.trace, 0.5, False)
+            with mock.patch('sys.stdout'):
+                deadline = time.time() + 10
+                while len(self.results) < 2 and time.time() < deadline:
+                    time.sleep(0.01)
+        self.assertFalse(worker.busy)
+        self.assertEqual(len(self.results), 2)
+        self.assertFalse(self.results[0].valid)
+        self.assertTrue(self.results[1].valid)
+
+    def test_process_started_with_capacity(self):
+        worker = analysis_service.AnalysisWorker(self.callback, True, 100)
+        self.addCleanup(worker.close)
+        self.assertTrue(worker.worker.is_alive())
+        worker.submit(self.trigger, self.trace, 0.5, False)
+        self.assertFalse(worker.busy)
+        self.assertEqual(worker.capacity, 100)
+
+    def test_traces_too_long_for_a_process_are_passed_on_as_invalid(self):
+        worker = analysis_service.AnalysisWorker(self.callback, True)
+        worker.worker = mock.Mock()
+        worker.capacity = 10
+        with mock.patch('sys.stdout', new_callable=StringIO.StringIO) as out:
+            for _ in range(3):
+                worker.submit(np.zeros(20), np.zeros(20), 0.5, False)
+        self.assertEqual(out.getvalue().count('longer than'), 1)
+        self.assertEqual(len(self.results), 3)
+        self.assertFalse(any(result.valid for result in self.results))
+        self.assertFalse(worker.busy)
+
+    def test_cut_off_trace_is_passed_on_as_invalid(self):
+        worker = analysis_service.AnalysisWorker(self.callback, False)
+        self.addCleanup(worker.close)
+        worker.submit(np.zeros(100), np.zeros(100), 0.5, False)
+        worker.close()
+        self.assertEqual(len(self.results), 1)
+        self.assertFalse(self.results[0].valid)
+
+
+def published(value, timestamp):
+    """A published PV value with the attributes of a cothread value."""
+    value = replay.augment(value, 'PV')
+    value.timestamp = timestamp
+    return value
+
+
+class PvSubscriberTests(unittest.TestCase):
+
+    def setUp(self):
+        self.pvm = mock.Mock()
+        self.values = {
+            PvReferences.PEAK_PVS[0]: np.ones(3),
+            PvReferences.PEAK_PVS[1]: np.zeros(3),
+            PvReferences.AREA_PVS[0]: 2.0,
+            PvReferences.AREA_PVS[1]: 4.0,
+            PvReferences.RATIO_PV: 0.5}
+        patcher = mock.patch.object(analysis_service.PvMonitors,
+                                    'get_instance', return_value=self.pvm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def publish_all(self, subscriber):
+        """Pass every PV value to the subscriber's monitors."""
+        self.results = []
+        subscriber.subscribe(self.results.append)
+        self.monitors = dict((call[0][0], call[0][1]) for call in
+                             self.pvm.backend.camonitor.call_args_list)
+        for pv in analysis_service.PvSubscriber.PVS:
+            self.monitors[pv](published(self.values[pv], 100.0))
+
+    def test_results_come_from_the_pvs(self):
+        with mock.patch.dict(analysis_service.os.environ,
+                             {analysis_service.SOURCE_VARIABLE: 'pvs'}):
+            subscriber = analysis_service.results_source()
+        self.assertIsInstance(subscriber, analysis_service.PvSubscriber)
+        self.assertIsNone(subscriber.latest)
+        self.assertFalse(self.pvm.backend.caget.called)
+
+        self.publish_all(subscriber)
+        self.assertEqual(len(self.results), 1)
+        self.assertEqual(self.results[0].areas, (2.0, 4.0))
+        self.assertEqual(self.results[0].timestamp, 100.0)
+        self.assertTrue(self.results[0].valid)
+        self.monitors[PvReferences.AREA_PVS[1]](published(8.0, 1.0))
+        self.assertEqual(len(self.results), 1)
+        self.monitors[PvReferences.RATIO_PV](published(0.25, 1.0))
+        self.assertEqual(len(self.results), 2)
+        self.assertEqual(self.results[1].areas, (2.0, 8.0))
+        np.testing.assert_array_equal(self.results[1].peaks[0], np.ones(3))
+
+    def test_ratio_is_ignored_until_every_pv_has_arrived(self):
+        subscriber = analysis_service.PvSubscriber()
+        monitors = dict((call[0][0], call[0][1]) for call in
+                        self.pvm.backend.camonitor.call_args_list)
+        monitors[PvReferences.RATIO_PV](published(0.5, 1.0))
+        self.assertIsNone(subscriber.latest)
+
+    def test_result_is_marked_stale_when_the_service_stops(self):
+        subscriber = analysis_service.PvSubscriber()
+        self.publish_all(subscriber)
+        subscriber.check_stale()
+        self.assertEqual(len(self.results), 1)
+        with mock.patch.object(
+                analysis_service.time, 'time', return_value=time.time() +
+                analysis_service.SERVICE_STALE_TIME + 1):
+            subscriber.check_stale()
+            subscriber.check_stale()
+        self.assertEqual(len(self.results), 2)
+        self.assertTrue(self.results[1].stale)
+        self.assertEqual(self.results[1].areas, self.results[0].areas)
+
+    def test_local_service_by_default(self):
+        with mock.patch.dict(analysis_service.os.environ, clear=True), \
+                mock.patch.object(analysis_service.AnalysisService,
+                                  'get_instance') as get_instance:
+            self.assertIs(analysis_service.results_source(),
+                          get_instance.return_value)
+        self.assertFalse(self.pvm.backend.camonitor.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import os
+import sys
+
+import mock
+import numpy as np
+
+# Mock out cothread as it requires EPICS binaries at import, and PyQt4 as it
+# requires a display
+sys.modules['cothread'] = mock.MagicMock()
+sys.modules['cothread.catools'] = mock.MagicMock()
+sys.modules['PyQt4'] = mock.MagicMock()
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import common_ui
+import magnet_jogs
+import writers
+
+
+class Gui(common_ui.CommonGui):
+
+    """CommonGui with two jog buttons for one move."""
+
+    PV_GROUPS = ['waveforms', 'offsets']
+
+    def __init__(self):
+        self.ui = mock.Mock()
+        self.parent = mock.Mock()
+        self.pv_monitor = mock.Mock()
+        self.timings = mock.Mock()
+        self.ui.jog_scale_slider.maximum.return_value = 50
+        self.ui.jog_scale_slider.minimum.return_value = 1
+        self.plus, self.minus = mock.Mock(), mock.Mock()
+        self.jog_buttons = [(self.plus, 0, 1), (self.minus, 0, -1)]
+        self.queue = mock.Mock()
+        self.room = np.array([[-0.5, 2.0]])
+        self.connect_jogs()
+
+    def headroom(self):
+        return self.room
+
+
+class CommonGuiTests(unittest.TestCase):
+
+    def setUp(self):
+        self.gui = Gui()
+
+    def test_buttons_without_room_are_disabled(self):
+        self.gui.update_jog_buttons()
+        self.gui.plus.setEnabled.assert_called_once_with(True)
+        self.gui.minus.setEnabled.assert_called_once_with(False)
+        self.gui.minus.setToolTip.assert_called_once_with('Headroom: 0.5')
+        self.gui.ui.jog_scale_slider.setMaximum.assert_called_once_with(
+            2 * self.gui.JOG_SCALE_STEPS)
+
+    def test_buttons_are_disabled_until_connected(self):
+        self.gui.room = np.array([[np.nan, np.nan]])
+        self.gui.update_jog_buttons()
+        for button in (self.gui.plus, self.gui.minus):
+            button.setEnabled.assert_called_once_with(False)
+            button.setToolTip.assert_called_once_with('Connecting')
+
+    def test_jogs_are_scaled(self):
+        self.gui.ui.jog_scale_slider.value.return_value = 5
+        self.gui.set_jog_scaling()
+        self.assertEqual(self.gui.jog_scale, 0.5)
+        self.gui.minus.setEnabled.assert_called_once_with(True)
+        click = self.gui.minus.clicked.connect.call_args[0][0]
+        click()
+        self.gui.queue.write.assert_called_once_with(0, -0.5)
+
+    def test_status_shows_groups_still_connecting(self):
+        self.gui.pv_monitor.is_connected.side_effect = (
+            lambda key: key == 'waveforms')
+        self.gui.update_status()
+        self.gui.pv_monitor.is_connected.side_effect = None
+        self.gui.update_status()
+        status = self.gui.ui.statusBar.return_value
+        self.assertEqual(status.showMessage.call_args_list, [
+            mock.call('Connecting to PVs: offsets'),
+            mock.call(self.gui.timings.status.return_value)])
+
+    def test_jog_errors_are_shown(self):
+        with mock.patch.object(self.gui, 'show_message') as show_message, \
+                mock.patch.object(self.gui, 'over_current') as over_current:
+            error = magnet_jogs.OverCurrentException([1])
+            self.gui.jog_error(error)
+            over_current.assert_called_once_with(error)
+            error = writers.WriteError(['PV'])
+            with mock.patch('sys.stdout'):
+                self.gui.jog_error(error)
+            show_message.assert_called_once_with('Write Exception: %s' % error)
+
+
+if __name__ == '__main__':
+    unittest.main()
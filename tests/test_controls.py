@@ -0,0 +1,173 @@
+import unittest
+import os
+import sys
+
+import mock
+import numpy as np
+
+# Mock out cothread as it requires EPICS binaries at import
+sys.modules['cothread'] = mock.MagicMock()
+sys.modules['cothread.catools'] = mock.MagicMock()
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import controls
+from controls import Arrays
+from fakes import Task
+
+
+class PvMonitorsTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(controls, 'cothread')
+        self.cothread = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pvm = controls.PvMonitors.get_instance()
+        self.pvm.state = controls.MagnetState()
+        self.pvm.arrays = {}
+        self.pvm.connected = set([Arrays.OFFSETS, Arrays.SCALES])
+        self.pvm.listeners = {'straight': [], 'trace': []}
+        self.pvm.pending = {'straight': [], 'trace': []}
+        self.pvm.connections = {}
+        self.pvm.backend = mock.Mock()
+        self.pvm.backend.caget.side_effect = (
+            lambda pvs, **kwargs: range(len(pvs)))
+        self.pvm.set_coalesce_window(0.01)
+
+    def flush(self):
+        for call in self.cothread.Spawn.call_args_list:
+            call[0][0](*call[0][1:])
+        self.cothread.Spawn.reset_mock()
+
+    def test_synchronous_without_window(self):
+        listener = mock.Mock()
+        self.pvm.register_straight_listener(listener)
+        self.pvm.set_coalesce_window(None)
+        self.pvm.update_values(1.0, Arrays.OFFSETS, 2, 'straight')
+        listener.assert_called_once_with(Arrays.OFFSETS, 2)
+        self.assertFalse(self.cothread.Spawn.called)
+
+    def test_changes_are_coalesced(self):
+        listener = mock.Mock()
+        batch_listener = mock.Mock()
+        self.pvm.register_straight_listener(listener)
+        self.pvm.register_straight_listener(batch_listener, batch=True)
+        for val in range(3):
+            for idx in range(5):
+                self.pvm.update_values(val, Arrays.OFFSETS, idx, 'straight')
+        self.pvm.update_values(4.0, Arrays.SCALES, 0, 'straight')
+
+        self.assertEqual(self.cothread.Spawn.call_count, 1)
+        self.assertFalse(listener.called)
+        np.testing.assert_array_equal(self.pvm.get_offsets(), [2] * 5)
+
+        self.flush()
+        changes = [(Arrays.OFFSETS, idx) for idx in range(5)]
+        changes.append((Arrays.SCALES, 0))
+        self.assertEqual(listener.call_args_list,
+                         [mock.call(*change) for change in changes])
+        batch_listener.assert_called_once_with(changes)
+        self.cothread.Sleep.assert_called_once_with(0.01)
+
+    def test_new_window_after_flush(self):
+        self.pvm.update_values(1.0, Arrays.OFFSETS, 0, 'straight')
+        self.flush()
+        self.pvm.update_values(2.0, Arrays.OFFSETS, 0, 'straight')
+        self.assertEqual(self.cothread.Spawn.call_count, 1)
+
+    def run_spawned(self):
+        self.cothread.Spawn.side_effect = Task
+
+    def test_getter_connects_group_on_first_use(self):
+        self.run_spawned()
+        np.testing.assert_array_equal(self.pvm.get_max_currents(), range(5))
+        np.testing.assert_array_equal(self.pvm.get_max_currents(), range(5))
+        pvs, _, monitor_args = controls.PvMonitors.GROUPS[Arrays.IMAX]
+        self.pvm.backend.caget.assert_called_once_with(pvs, **monitor_args)
+        self.assertEqual(self.pvm.backend.camonitor.call_count, 5)
+        self.assertTrue(self.pvm.is_connected(Arrays.IMAX))
+        self.assertFalse(self.pvm.is_connected(Arrays.IMIN))
+
+    def test_groups_connect_in_parallel(self):
+        self.pvm.connect([Arrays.SETI, Arrays.ERRORS], wait=False)
+        self.pvm.connect([Arrays.SETI], wait=False)
+        self.assertEqual(self.cothread.Spawn.call_args_list, [
+            mock.call(self.pvm._connect_group, Arrays.SETI,
+                      raise_on_wait=True),
+            mock.call(self.pvm._connect_group, Arrays.ERRORS,
+                      raise_on_wait=True)])
+        self.assertFalse(self.cothread.Spawn.return_value.Wait.called)
+        self.pvm.connect([Arrays.SETI])
+        self.cothread.Spawn.return_value.Wait.assert_called_once_with()
+
+    def test_listeners_told_when_group_connects(self):
+        listener = mock.Mock()
+        self.pvm.register_straight_listener(listener, batch=True)
+        self.pvm.set_coalesce_window(None)
+        self.run_spawned()
+        self.pvm.connect([Arrays.ERRORS])
+        self.assertEqual(listener.call_args_list,
+                         [mock.call([(Arrays.ERRORS, i)]) for i in range(5)])
+        for call in self.pvm.backend.camonitor.call_args_list:
+            self.assertIn('format', call[1])
+
+    def test_failed_group_can_connect_again(self):
+        self.run_spawned()
+        self.pvm.backend.caget.side_effect = [IOError, range(5)]
+        with self.assertRaises(IOError):
+            self.pvm.connect([Arrays.SETI])
+        self.assertFalse(self.pvm.is_connected(Arrays.SETI))
+        np.testing.assert_array_equal(self.pvm.get_actual_offsets(),
+                                      range(5))
+
+    def test_waveforms_are_kept_as_returned(self):
+        self.run_spawned()
+        traces = [np.arange(3.0), np.arange(4.0)]
+        self.pvm.backend.caget.side_effect = lambda pvs, **kwargs: traces
+        self.assertIs(self.pvm.get_waveforms(), traces)
+
+    def test_monitored_severity_and_timestamp_are_stored(self):
+        value = mock.MagicMock(spec=float)
+        value.__float__.return_value = 1.5
+        value.timestamp = 100.0
+        value.severity = 2
+        self.pvm.update_values(value, Arrays.OFFSETS, 3, 'straight')
+        self.assertEqual(self.pvm.get_offsets()[3], 1.5)
+        self.assertEqual(self.pvm.get_timestamps(Arrays.OFFSETS)[3], 100.0)
+        self.assertEqual(self.pvm.get_severities(Arrays.OFFSETS)[3], 2)
+
+
+class MagnetStateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.state = controls.MagnetState()
+        for index in range(5):
+            self.state.set(Arrays.IMAX, index, 10.0, 0)
+            self.state.set(Arrays.IMIN, index, -10.0, 0)
+
+    def test_unset_values_are_nan(self):
+        self.assertTrue(np.isnan(self.state.get(Arrays.OFFSETS)).all())
+        self.assertTrue(np.isnan(
+            self.state.get(controls.MagnetState.HEADROOM)).all())
+
+    def test_derived_fields_follow_writes(self):
+        self.state.set(Arrays.OFFSETS, 1, 2.0, 0)
+        self.state.set(Arrays.SCALES, 1, -3.0, 0)
+        self.assertEqual(self.state.get(controls.MagnetState.HIGH)[1], -1.0)
+        self.assertEqual(self.state.get(controls.MagnetState.LOW)[1], 5.0)
+        self.assertEqual(self.state.get(controls.MagnetState.HEADROOM)[1],
+                         5.0)
+        self.state.set(Arrays.IMAX, 1, 6.0, 0)
+        self.assertEqual(self.state.get(controls.MagnetState.HEADROOM)[1],
+                         1.0)
+        self.assertTrue(np.isnan(self.state.get(controls.MagnetState.HIGH)[0]))
+
+    def test_reads_are_views(self):
+        offsets = self.state.get(Arrays.OFFSETS)
+        self.state.set(Arrays.OFFSETS, 4, 7.0, 0)
+        self.assertEqual(offsets[4], 7.0)
+
+    def test_errors_are_text(self):
+        self.state.set(Arrays.ERRORS, 0, 'Interlock', 12.0, 2)
+        self.assertEqual(self.state.get(Arrays.ERRORS)[0], 'Interlock')
+        self.assertEqual(self.state.severities[Arrays.ERRORS][0], 2)
+        self.assertEqual(self.state.timestamps[Arrays.ERRORS][0], 12.0)
@@ -0,0 +1,71 @@
+import unittest
+import json
+import os
+import StringIO
+import sys
+import tempfile
+import time
+
+import mock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import instrumentation
+
+
+class LatencyHistogramTests(unittest.TestCase):
+
+    def test_percentiles(self):
+        hist = instrumentation.LatencyHistogram()
+        for _ in range(99):
+            hist.add(1e-4)
+        hist.add(0.5)
+        self.assertEqual(hist.count, 100)
+        self.assertAlmostEqual(hist.max, 0.5)
+        self.assertTrue(1e-4 <= hist.percentile(50) < 1.3e-4)
+        self.assertTrue(0.5 <= hist.percentile(100) < 0.65)
+
+    def test_timings_record(self):
+        timings = instrumentation.Timings()
+        timings.record('draw', 0.01)
+        timings.record_since('draw', None)
+        self.assertEqual(timings.histograms['draw'].count, 1)
+        self.assertIn('draw p99', timings.status())
+        timings.enabled = False
+        timings.record('draw', 0.01)
+        self.assertEqual(timings.histograms['draw'].count, 1)
+
+
+class StartupReportTests(unittest.TestCase):
+
+    def test_process_started_in_the_past(self):
+        started = instrumentation.process_start_time()
+        self.assertTrue(time.time() - 3600 < started <= time.time())
+
+    def test_steps_are_timed_from_start(self):
+        report = instrumentation.StartupReport(start=time.time() - 2)
+        report.mark('imports')
+        self.assertEqual(report.steps[0][0], 'imports')
+        self.assertTrue(2 <= report.steps[0][1] < 3)
+        self.assertIn('imports', report.report())
+
+    def publish(self, report, filename):
+        """Publish the report to filename and return what it printed."""
+        out = StringIO.StringIO()
+        with mock.patch.dict(os.environ, {report.REPORT_VARIABLE: filename}):
+            with mock.patch('sys.stdout', out):
+                report.publish()
+        return out.getvalue()
+
+    def test_publish_only_when_asked(self):
+        report = instrumentation.StartupReport(start=0)
+        report.mark('window')
+        handle, filename = tempfile.mkstemp()
+        os.close(handle)
+        self.addCleanup(os.remove, filename)
+        self.assertEqual(self.publish(report, ''), '')
+        self.assertEqual(os.path.getsize(filename), 0)
+        self.assertEqual(self.publish(report, filename),
+                         'Startup times:\n' + report.report() + '\n')
+        with open(filename) as f:
+            steps = json.load(f)
+        self.assertEqual([step['step'] for step in steps], ['window'])
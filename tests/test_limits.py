@@ -0,0 +1,62 @@
+import unittest
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import limits
+
+
+class LimitsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.imaxs = np.ones(5) * 10
+        self.imins = np.ones(5) * -10
+
+    def test_current_range_uses_absolute_scales(self):
+        low, high = limits.current_range([1, 2, 3, 4, 5], [1, -1, 2, -2, 0])
+        np.testing.assert_array_equal(low, [0, 1, 1, 2, 5])
+        np.testing.assert_array_equal(high, [2, 3, 5, 6, 5])
+
+    def test_violations_finds_every_magnet(self):
+        mask = limits.violations([9, 0, -9, 0, 0], [2, 1, -2, 11, 1],
+                                 self.imaxs, self.imins)
+        np.testing.assert_array_equal(mask, [1, 0, 1, 1, 0])
+        self.assertEqual(limits.offending_magnets(mask), [0, 2, 3])
+
+    def test_violations_broadcast_over_candidates(self):
+        offsets = np.array([[0, 0, 0, 0, 0], [0, 0, 9.5, 0, 0]])
+        mask = limits.violations(offsets, np.ones(5), self.imaxs, self.imins)
+        self.assertEqual(mask.shape, (2, 5))
+        np.testing.assert_array_equal(mask.any(axis=1), [False, True])
+
+    def test_change_limits(self):
+        offset_range, scale_range = limits.change_limits(
+            [0, 5, 0, 0, 0], [1, -1, 2, 0, 0], self.imaxs, self.imins)
+        np.testing.assert_array_equal(offset_range[:, 1], [-14, 4])
+        np.testing.assert_array_equal(offset_range[:, 2], [-8, 8])
+        np.testing.assert_array_equal(scale_range[:, 1], [-4, 6])
+        np.testing.assert_array_equal(scale_range[:, 2], [-12, 8])
+
+    def test_factor_range(self):
+        change_range = np.array([[-1, -2, -3], [4, 5, 6]])
+        lowest, highest = limits.factor_range(
+            [[1, 0, 0], [1, -1, 0], [0, 0, 0]], change_range)
+        np.testing.assert_array_equal(lowest, [-1, -1, -np.inf])
+        np.testing.assert_array_equal(highest, [4, 2, np.inf])
+
+    def test_factor_range_when_over_limits(self):
+        lowest, highest = limits.factor_range(
+            [[1, 1]], np.array([[1, -1], [2, 1]]))
+        np.testing.assert_array_equal(lowest, [0])
+        np.testing.assert_array_equal(highest, [1])
+
+    def test_limits_are_inclusive(self):
+        mask = limits.violations(np.zeros(5), np.ones(5) * 10,
+                                 self.imaxs, self.imins)
+        self.assertFalse(mask.any())
+
+
+if __name__ == '__main__':
+    unittest.main()
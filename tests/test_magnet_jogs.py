@@ -0,0 +1,123 @@
+import unittest
+import os
+import sys
+
+import mock
+import numpy as np
+
+# Mock out cothread as it requires EPICS binaries at import
+sys.modules['cothread'] = mock.MagicMock()
+sys.modules['cothread.catools'] = mock.MagicMock()
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import magnet_jogs
+import straight
+
+
+class MagnetCoordinatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.pvm = mock.Mock()
+        self.pvm.get_offsets.return_value = np.zeros(5)
+        self.pvm.get_scales.return_value = np.ones(5)
+        self.pvm.get_max_currents.return_value = np.ones(5) * 2
+        self.pvm.get_min_currents.return_value = np.ones(5) * -2
+        patcher = mock.patch.object(magnet_jogs.PvMonitors, 'get_instance',
+                                    return_value=self.pvm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.knobs = magnet_jogs.MagnetCoordinator()
+        cwd = os.getcwd()
+        os.chdir(os.path.join(os.path.dirname(__file__), '..'))
+        self.addCleanup(os.chdir, cwd)
+
+    def test_violations_of_a_batch_of_jogs(self):
+        moves = [magnet_jogs.Moves.STEP_K3, magnet_jogs.Moves.SCALE,
+                 magnet_jogs.Moves.SCALE]
+        mask = self.knobs.violations(
+            np.zeros(5), np.ones(5), moves, [150, 150, -150])
+        np.testing.assert_array_equal(mask, [
+            [0, 0, 1, 0, 0],
+            [1, 1, 0, 1, 1],
+            [0, 0, 0, 0, 0]])
+
+    def test_jog_reports_all_offending_magnets(self):
+        with self.assertRaises(magnet_jogs.OverCurrentException) as context:
+            self.knobs.jog(np.ones(5), magnet_jogs.Moves.SCALE, 150)
+        self.assertEqual(context.exception.magnet_indices, [0, 1, 3, 4])
+        self.assertEqual(context.exception.magnet_index, 0)
+
+    def test_headroom_matches_violations(self):
+        for move, (lowest, highest) in enumerate(self.knobs.headroom):
+            for factor in [lowest, highest]:
+                self.assertFalse(self.knobs.violations(
+                    np.zeros(5), np.ones(5), [move], [factor]).any())
+                self.assertTrue(self.knobs.violations(
+                    np.zeros(5), np.ones(5), [move], [factor * 1.01]).any())
+
+    def test_headroom_of_scale(self):
+        np.testing.assert_allclose(
+            self.knobs.headroom[magnet_jogs.Moves.SCALE], [-300, 100])
+
+    def test_headroom_updates_changed_magnets(self):
+        self.pvm.register_straight_listener.assert_called_once_with(
+            self.knobs.update_headroom, batch=True)
+        self.pvm.get_offsets.return_value = np.array([0, 0, 0.5, 0, 0])
+        self.knobs.update_headroom([(magnet_jogs.Arrays.ERRORS, 2)])
+        np.testing.assert_allclose(
+            self.knobs.headroom[magnet_jogs.Moves.STEP_K3], [-100, 100])
+        self.knobs.update_headroom([(magnet_jogs.Arrays.OFFSETS, 2)])
+        np.testing.assert_allclose(
+            self.knobs.headroom[magnet_jogs.Moves.STEP_K3], [-150, 50])
+
+    def test_headroom_unknown_until_connected(self):
+        self.pvm.is_connected.return_value = False
+        knobs = magnet_jogs.MagnetCoordinator()
+        self.assertTrue(np.isnan(knobs.headroom).all())
+        knobs.update_headroom([(magnet_jogs.Arrays.IMAX, i) for i in range(5)])
+        np.testing.assert_allclose(knobs.headroom, self.knobs.headroom)
+
+    def test_calculate_headroom(self):
+        headroom = self.knobs.calculate_headroom(np.zeros(5), np.zeros(5))
+        np.testing.assert_allclose(
+            headroom[magnet_jogs.Moves.STEP_K3], [-200, 200])
+
+    def test_jog_within_limits(self):
+        values = self.knobs.jog(np.zeros(5), magnet_jogs.Moves.STEP_K3, 10)
+        np.testing.assert_allclose(values, [0, 0, 0.1, 0, 0])
+
+    def photon_beams(self, offsets):
+        e_beam, p_beam = self.knobs.straight.data.generate_beams(
+            2 * np.arcsin(offsets * straight.Straight.AMP_TO_SINE))
+        return e_beam[-1], p_beam
+
+    def test_solve_moves_photon_beam(self):
+        offsets = np.array([0.5, -0.5, 0.2, 0.1, -0.3])
+        new_offsets = self.knobs.solve(offsets, np.zeros(5), [1e-5, None])
+        exit_before, before = self.photon_beams(offsets)
+        exit_after, after = self.photon_beams(new_offsets)
+        self.assertAlmostEqual(after[0, 0] - before[0, 0], 1e-5, places=9)
+        np.testing.assert_allclose(exit_after, exit_before, atol=1e-12)
+
+    def test_solve_is_minimum_norm(self):
+        change = self.knobs.solve(np.zeros(5), np.zeros(5), [1e-5, None])
+        kick_per_amp = 2 * straight.Straight.AMP_TO_SINE
+        electron_response, photon_response = self.knobs.straight.response()
+        constraints = np.vstack((electron_response[-1],
+                                 photon_response[0, :1]))
+        expected = np.linalg.lstsq(constraints * kick_per_amp,
+                                   [0, 0, 1e-5], rcond=None)[0]
+        np.testing.assert_allclose(change, expected, atol=1e-9)
+
+    def test_solve_without_requests_keeps_offsets(self):
+        offsets = np.array([0.5, -0.5, 0.2, 0.1, -0.3])
+        np.testing.assert_array_equal(
+            self.knobs.solve(offsets, np.zeros(5)), offsets)
+
+    def test_solve_over_limits(self):
+        with self.assertRaises(magnet_jogs.OverCurrentException):
+            self.knobs.solve(np.zeros(5), np.ones(5), [1e-2, 1e-2])
+
+
+if __name__ == '__main__':
+    unittest.main()
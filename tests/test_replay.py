@@ -0,0 +1,56 @@
+import unittest
+import os
+import sys
+
+import mock
+import numpy as np
+
+# Mock out cothread as it requires EPICS binaries at import
+sys.modules['cothread'] = mock.MagicMock()
+sys.modules['cothread.catools'] = mock.MagicMock()
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import replay
+from controls import PvReferences
+
+
+class ReplayBackendTests(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = replay.ReplayBackend(
+            {'A': 1.0, 'B': 'ok', 'C': np.zeros(3)},
+            {'A': [(0.2, 3.0), (0.0, 2.0)], 'C': [(0.1, np.ones(3))]},
+            speed=None)
+
+    def test_caget(self):
+        self.assertEqual(self.backend.caget('A'), 1.0)
+        self.assertEqual(self.backend.caget(['A', 'B']), [1.0, 'ok'])
+        self.assertEqual(self.backend.caget('B').severity, 0)
+        self.assertEqual(self.backend.caget('C').name, 'C')
+
+    def test_caget_unknown_pv(self):
+        self.assertRaises(KeyError, self.backend.caget, 'D')
+        self.assertFalse(self.backend.caget('D', throw=False).ok)
+
+    def test_play_in_time_order(self):
+        updates = []
+        self.backend.camonitor('A', lambda x: updates.append(('A', x)))
+        self.backend.camonitor('C', lambda x: updates.append(('C', x.sum())))
+        self.backend.play()
+        self.assertEqual(updates, [('A', 2.0), ('C', 3.0), ('A', 3.0)])
+        self.assertEqual(self.backend.caget('A'), 3.0)
+
+    def test_caput_updates_monitors(self):
+        callback = mock.Mock()
+        self.backend.camonitor(['A', 'B'], callback)
+        self.backend.caput(['A', 'B'], [5.0, 'bad'])
+        self.assertEqual(callback.call_args_list,
+                         [mock.call(5.0), mock.call('bad')])
+        self.assertEqual(self.backend.caget('B'), 'bad')
+
+    def test_default_values_cover_recorded_traces(self):
+        values = replay.default_values()
+        self.assertEqual(len(values[PvReferences.TRACES[0]]), 10000)
+        timelines = replay.waveform_timelines(count=5, interval=0.5)
+        times = [t for t, _ in timelines[PvReferences.TRACES[1]]]
+        self.assertEqual(times, [0.0, 0.5, 1.0, 1.5, 2.0])
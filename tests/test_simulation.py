@@ -0,0 +1,60 @@
+import unittest
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import simulation
+
+
+CONFIG = os.path.join(os.path.dirname(__file__), '..', 'config.txt')
+
+
+def walk_beams(layout):
+    """Reference element-by-element walk through the straight."""
+    e_vector = np.array([0, 0])
+    e_beam = np.zeros((len(layout.path), 2))
+    p_beam = []
+    for idx, x in enumerate(layout.path):
+        if x.get_type() != 'detector':
+            e_vector = x.increment(e_vector)
+            e_beam[idx + 1] = e_vector
+        if x.get_type() == 'insertiondevice':
+            length = layout.detector[0].s - x.s
+            travelled = simulation.Drift(x.s, length).increment(e_vector)
+            p_beam.append(e_vector.tolist() + travelled.tolist())
+    return e_beam, np.array(p_beam)
+
+
+class LayoutTests(unittest.TestCase):
+
+    def setUp(self):
+        self.layout = simulation.Layout(CONFIG)
+
+    def test_drift_lengths(self):
+        for p, next_p in zip(self.layout.path, self.layout.path[1:]):
+            if p.get_type() == 'drift':
+                self.assertAlmostEqual(p.length, next_p.s - p.s)
+
+    def test_generate_beams_matches_element_walk(self):
+        for kicker, k in zip(self.layout.kickers,
+                             [1e-3, -2e-3, 5e-4, -1e-3, 2e-3]):
+            kicker.set_strength(k)
+        e_beam, p_beam = self.layout.generate_beams()
+        e_expected, p_expected = walk_beams(self.layout)
+        np.testing.assert_allclose(e_beam, e_expected)
+        np.testing.assert_allclose(p_beam, p_expected)
+
+    def test_zero_kicks_give_straight_beams(self):
+        e_beam, p_beam = self.layout.generate_beams(np.zeros(5))
+        self.assertFalse(e_beam.any())
+        self.assertFalse(p_beam.any())
+
+    def test_response_matches_propagate(self):
+        kicks = np.array([1e-4, -2e-4, 0.5e-4, 3e-4, -1e-4])
+        e_beam, p_beam = self.layout.propagate(kicks)
+        np.testing.assert_allclose(
+            np.dot(self.layout.electron_response, kicks), e_beam)
+        np.testing.assert_allclose(
+            np.dot(self.layout.photon_response, kicks), p_beam)
@@ -0,0 +1,130 @@
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+
+import mock
+import numpy as np
+
+# Mock out cothread as it requires EPICS binaries at import
+sys.modules['cothread'] = mock.MagicMock()
+sys.modules['cothread.catools'] = mock.MagicMock()
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import controls
+import straight
+
+
+OFFSETS = np.array([2.0, -1.5, 0.5, 1.0, -2.0])
+SCALES = np.array([3.0, 2.5, 0.0, 2.0, 3.5])
+
+
+class StraightTests(unittest.TestCase):
+
+    def setUp(self):
+        pvm = mock.Mock()
+        pvm.get_offsets.return_value = OFFSETS
+        pvm.get_scales.return_value = SCALES
+        patcher = mock.patch.object(controls.PvMonitors, 'get_instance',
+                                    return_value=pvm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cwd = os.getcwd()
+        os.chdir(os.path.join(os.path.dirname(__file__), '..'))
+        self.addCleanup(os.chdir, cwd)
+        self.straight = straight.Straight()
+
+    def test_step_many_matches_step(self):
+        times = np.arange(0, 200, 7)
+        e_beams, p_beams = self.straight.step_many(times)
+        self.assertEqual(e_beams.shape, (len(times), 16, 2))
+        self.assertEqual(p_beams.shape, (len(times), 2, 4))
+        for t, e_many, p_many in zip(times, e_beams, p_beams):
+            e_beam, p_beam = self.straight.step(t)
+            np.testing.assert_allclose(e_many, e_beam)
+            np.testing.assert_allclose(p_many, p_beam)
+
+    def test_cycle_is_cached_until_values_change(self):
+        cycle = self.straight.cycle()
+        self.assertIs(self.straight.cycle(), cycle)
+        self.straight.set_scales(list(SCALES))
+        self.straight.set_offsets(list(OFFSETS))
+        self.assertIs(self.straight.cycle(), cycle)
+        self.straight.set_offsets(OFFSETS + 1)
+        self.assertIsNot(self.straight.cycle(), cycle)
+
+    def test_cycle_repeats_with_period(self):
+        e_beams, p_beams = self.straight.step_many(
+            np.arange(self.straight.PERIOD, 2 * self.straight.PERIOD))
+        np.testing.assert_allclose(e_beams, self.straight.cycle()[0],
+                                   atol=1e-15)
+        np.testing.assert_allclose(p_beams, self.straight.cycle()[1],
+                                   atol=1e-15)
+
+    def test_amps_to_radians_accepts_many_current_sets(self):
+        currents = np.random.RandomState(0).uniform(-10, 10, (50, 5))
+        kicks = self.straight.amps_to_radians(currents)
+        self.assertEqual(kicks.shape, currents.shape)
+        for row, kick in zip(currents, kicks):
+            field = row * straight.Straight.AMP_TO_TESLA
+            np.testing.assert_allclose(kick, 2.0 * np.arcsin(
+                field / (2.0 * straight.Straight.BEAM_RIGIDITY)))
+
+    def test_p_beam_range_accepts_many_strengths(self):
+        strengths = np.array([[1, 1, 1, 0, 0], [0, 0, 1, 1, 1]])
+        p_beams = self.straight.p_beam_range(strengths)
+        for row, p_beam in zip(strengths, p_beams):
+            np.testing.assert_allclose(
+                self.straight.p_beam_range(row), p_beam)
+
+    def test_beams_match_propagate(self):
+        kicks = self.straight.calculate_strengths(np.arange(10))
+        for expected, actual in zip(self.straight.data.propagate(kicks),
+                                    self.straight.beams(kicks)):
+            np.testing.assert_allclose(actual, expected, atol=1e-15)
+
+    def test_response_is_cached_until_layout_reloads(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        filename = os.path.join(directory, 'config.txt')
+        shutil.copy(self.straight.layout_filename, filename)
+        self.straight.layout_filename = filename
+
+        response = self.straight.response()
+        cycle = self.straight.cycle()
+        self.assertIs(self.straight.response()[1], response[1])
+        self.assertIs(self.straight.cycle(), cycle)
+
+        with open(filename, 'a') as f:
+            f.write('drift 230.0\n')
+        mtime = os.path.getmtime(filename) + 1
+        os.utime(filename, (mtime, mtime))
+        self.assertIs(self.straight.cycle(), cycle)
+        self.assertTrue(self.straight.reload_layout())
+        self.assertFalse(self.straight.reload_layout())
+        self.assertIsNot(self.straight.cycle(), cycle)
+        self.assertEqual(len(self.straight.response()[0]), 17)
+
+    def test_sweep_envelope_matches_extreme_strengths(self):
+        edges = self.straight.p_beam_range(
+            np.array([[1, 1, 1, 0, 0], [0, 0, 1, 1, 1]]))[..., [0, 2]]
+        low, high = self.straight.sweep_envelope()
+        np.testing.assert_allclose(low, edges.min(axis=0))
+        np.testing.assert_allclose(high, edges.max(axis=0))
+
+    def test_sweep_envelope_does_not_change_kickers(self):
+        kicks = [kicker.k for kicker in self.straight.data.kickers]
+        self.straight.sweep_envelope()
+        self.assertEqual([kicker.k for kicker in self.straight.data.kickers],
+                         kicks)
+
+    def test_limit_envelope(self):
+        max_currents = np.array([10.0, 11.0, 12.0, 13.0, 14.0])
+        edges = self.straight.limit_envelope(max_currents)
+        self.assertEqual(edges.shape, (2, 2))
+        left = self.straight.p_beam_lim(
+            np.array([10.0, -11.0, 12.0, 0, 0]))[0, [0, 2]]
+        right = self.straight.p_beam_lim(
+            np.array([0, 0, 12.0, -13.0, 14.0]))[1, [0, 2]]
+        np.testing.assert_allclose(edges, [left, right])
@@ -0,0 +1,35 @@
+import unittest
+import os
+import sys
+
+import mock
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import versions
+
+
+class RequireVersionsTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(versions, '_selected', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('pkg_resources.require')
+        self.require = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_versions_are_selected_once(self):
+        with mock.patch.dict(os.environ, clear=True):
+            versions.require_versions('numpy==1.11.1', 'cothread==2.13')
+            versions.require_versions('numpy>=1.10.1')
+        self.assertEqual(self.require.call_args_list, [
+            mock.call('numpy==1.11.1'), mock.call('cothread==2.13')])
+
+    def test_environment_can_skip_selection(self):
+        with mock.patch.dict(os.environ, {versions.SKIP_VARIABLE: '1'}):
+            versions.require_versions('numpy==1.11.1')
+        self.assertFalse(self.require.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
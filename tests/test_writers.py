@@ -0,0 +1,130 @@
+import unittest
+import os
+import sys
+
+import mock
+import numpy as np
+
+# Mock out cothread as it requires EPICS binaries at import
+sys.modules['cothread'] = mock.MagicMock()
+sys.modules['cothread.catools'] = mock.MagicMock()
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import writers
+import magnet_jogs
+from fakes import Task
+
+
+class PvWriterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = mock.Mock()
+        self.backend.caget.side_effect = lambda pvs, **_: [
+            self.written[pv] for pv in pvs]
+        self.backend.caput.side_effect = self.caput
+        self.written = {}
+        self.pvm = mock.Mock(backend=self.backend)
+        self.pvm.get_offsets.return_value = np.zeros(5)
+        self.pvm.get_scales.return_value = np.ones(5)
+        self.pvm.get_set_scales.return_value = np.ones(5)
+        self.pvm.get_max_currents.return_value = np.ones(5) * 10
+        self.pvm.get_min_currents.return_value = np.ones(5) * -10
+        for patcher in [
+                mock.patch.object(writers.PvMonitors, 'get_instance',
+                                  return_value=self.pvm),
+                mock.patch.object(magnet_jogs.PvMonitors, 'get_instance',
+                                  return_value=self.pvm),
+                mock.patch.object(writers.cothread, 'Spawn', Task)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.writer = writers.PvWriter()
+
+    def caput(self, pv, value, **kwargs):
+        self.written[pv] = value
+        return mock.Mock(ok=True)
+
+    def test_scale_writes_both_scale_pvs(self):
+        self.writer.write(magnet_jogs.Moves.SCALE, 1)
+        self.assertEqual(
+            sorted(self.written),
+            sorted(self.writer.scale_pvs + self.writer.set_scale_pvs))
+        self.assertAlmostEqual(self.written[self.writer.scale_pvs[0]], 1.01)
+        self.assertEqual(len(self.writer.last_results), 10)
+        self.assertTrue(all(r.ok for r in self.writer.last_results))
+
+    def test_offset_write(self):
+        results = self.writer.write_to_pvs(self.writer.offset_pvs,
+                                           np.arange(5.0))
+        self.assertEqual([r.pv for r in results], self.writer.offset_pvs)
+        self.assertEqual(self.written[self.writer.offset_pvs[3]], 3.0)
+
+    def test_failed_put_raises(self):
+        def caput(pv, value, **kwargs):
+            self.written[pv] = 0.0
+            return mock.Mock(ok=pv != self.writer.offset_pvs[1])
+        self.backend.caput.side_effect = caput
+        with self.assertRaises(writers.WriteError) as context:
+            self.writer.write_to_pvs(self.writer.offset_pvs, np.zeros(5))
+        self.assertEqual([f.pv for f in context.exception.failures],
+                         [self.writer.offset_pvs[1]])
+
+    def test_readback_mismatch_raises(self):
+        self.backend.caget.side_effect = lambda pvs, **_: [0.0] * len(pvs)
+        with self.assertRaises(writers.WriteError) as context:
+            self.writer.write_to_pvs(self.writer.offset_pvs, np.arange(5.0))
+        self.assertEqual(len(context.exception.failures), 4)
+
+
+class JogQueueTests(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(writers.cothread, 'Spawn')
+        self.spawn = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.writer = mock.Mock()
+        self.on_error = mock.Mock()
+        self.on_written = mock.Mock()
+        self.queue = writers.JogQueue(self.writer, self.on_error,
+                                      self.on_written)
+
+    def test_jogs_are_coalesced_per_move(self):
+        for factor in [1, 1, 0.5]:
+            self.queue.write(magnet_jogs.Moves.BUMP_LEFT, factor)
+        self.queue.write(magnet_jogs.Moves.BPM1, -1)
+        self.queue.write(magnet_jogs.Moves.STEP_K3, 1)
+        self.queue.write(magnet_jogs.Moves.STEP_K3, -1)
+        self.spawn.assert_called_once_with(self.queue.drain)
+
+        self.queue.drain()
+        self.assertEqual(self.writer.write.call_args_list, [
+            mock.call(magnet_jogs.Moves.BUMP_LEFT, 2.5),
+            mock.call(magnet_jogs.Moves.BPM1, -1)])
+        self.assertEqual(self.on_written.call_count, 2)
+        self.assertFalse(self.queue.busy)
+
+    def test_errors_do_not_stop_other_jogs(self):
+        error = magnet_jogs.OverCurrentException(2)
+        self.writer.write.side_effect = [error, None]
+        self.queue.write(magnet_jogs.Moves.BUMP_LEFT, 1)
+        self.queue.write(magnet_jogs.Moves.BUMP_RIGHT, 1)
+        self.queue.drain()
+        self.on_error.assert_called_once_with(error)
+        self.assertEqual(self.writer.write.call_count, 2)
+        self.on_written.assert_called_once_with()
+
+    def test_jogs_over_limits_are_written_one_at_a_time(self):
+        def write(move, factor):
+            if self.written + factor > 2:
+                raise magnet_jogs.OverCurrentException(0)
+            self.written += factor
+        self.written = 0
+        self.writer.write.side_effect = write
+        for _ in range(3):
+            self.queue.write(magnet_jogs.Moves.BUMP_LEFT, 1)
+        self.queue.drain()
+        self.assertEqual(self.writer.write.call_args_list, [
+            mock.call(magnet_jogs.Moves.BUMP_LEFT, 3)] + [
+            mock.call(magnet_jogs.Moves.BUMP_LEFT, 1)] * 3)
+        self.assertEqual(self.written, 2)
+        self.assertEqual(self.on_written.call_count, 2)
+        self.assertEqual(self.on_error.call_count, 1)
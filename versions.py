@@ -0,0 +1,36 @@
+#!/usr/bin/env dls-python2.7
+"""Select the versions of the packages used by the I10 scripts.
+
+Each script asks for its versions before it imports the packages. Set
+I10_NO_REQUIRE to skip the slow version selection, when the environment
+already provides the right versions.
+"""
+
+
+import os
+
+
+# Environment variable that, set, skips the version selection.
+SKIP_VARIABLE = 'I10_NO_REQUIRE'
+
+_selected = False
+
+
+def require_versions(*requirements):
+    """
+    Select package versions, unless versions have already been selected.
+
+    Only the first script to ask in a process selects the versions, so that
+    a script that imports another one keeps the versions it chose.
+
+    Args:
+        requirements (str): requirements for pkg_resources.require, such as
+            'numpy==1.11.1'
+    """
+    global _selected
+    if _selected or os.environ.get(SKIP_VARIABLE):
+        return
+    _selected = True
+    from pkg_resources import require
+    for requirement in requirements:
+        require(requirement)
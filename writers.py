@@ -6,12 +6,45 @@ and apply them to their respective interfaces.
 """
 
 
-from cothread.catools import caput
+import collections
+import time
+
+import cothread
+import numpy as np
+
 from controls import PvReferences, PvMonitors, Arrays
+from instrumentation import Stages, Timings
 
 import magnet_jogs
 
 
+class WriteResult(object):
+
+    """Outcome of writing a value to one PV."""
+
+    def __init__(self, pv, value, ok, latency, error=None):
+        self.pv = pv
+        self.value = value
+        self.ok = ok
+        self.latency = latency
+        self.error = error
+
+    def __repr__(self):
+        if self.ok:
+            return '%s: %.1f ms' % (self.pv, self.latency * 1e3)
+        return '%s: %s' % (self.pv, self.error)
+
+
+class WriteError(Exception):
+
+    """Exception in the case of writes that failed or were not confirmed."""
+
+    def __init__(self, failures):
+        super(WriteError, self).__init__(
+            'Failed to write ' + ', '.join(repr(f) for f in failures))
+        self.failures = failures
+
+
 class AbstractWriter(object):
 
     """
@@ -33,10 +66,108 @@ class AbstractWriter(object):
         """
         raise NotImplementedError()
 
+    def steer(self, displacements=None, angles=None):
+        """
+        Move the photon beams with the offsets found by the solver.
+
+        Args:
+            displacements (list): change in the photon beam position at each
+                insertion device in metres, None to leave it free
+            angles (list): change in the photon beam angle at each insertion
+                device in radians, None to leave it free
+        """
+        raise NotImplementedError()
+
+
+class JogQueue(object):
+
+    """
+    Queue of jogs in front of a writer.
+
+    Jogs requested while a write is in progress are held, and jogs of the
+    same move are summed into one net move, so at most one write is in
+    progress at a time. If the net move would take a magnet over its
+    limits, the held jogs are written one at a time instead, so that those
+    that fit are still applied and only those that do not are reported.
+    """
+
+    def __init__(self, writer, on_error, on_written=None):
+        """
+        Initialise the queue.
+
+        Args:
+            writer (AbstractWriter): writer to apply the jogs with
+            on_error (function): called with any exception raised by a
+                write, from within the except block
+            on_written (function): called after each successful write
+        """
+        self.writer = writer
+        self.on_error = on_error
+        self.on_written = on_written
+        self.pending = collections.OrderedDict()
+        self.busy = False
+
+    def write(self, move, factor):
+        """
+        Queue a move, starting the writes if none are in progress.
+
+        Args:
+            move (magnet_jogs.Move): which move to perform.
+            factor (float): scale factor to apply to move.
+        """
+        self.pending.setdefault(move, []).append(factor)
+        if not self.busy:
+            self.busy = True
+            cothread.Spawn(self.drain)
+
+    def drain(self):
+        """Write net moves, oldest first, until none are pending."""
+        try:
+            while self.pending:
+                move, factors = self.pending.popitem(last=False)
+                net_factor = sum(factors)
+                if net_factor == 0:
+                    continue
+                try:
+                    self.writer.write(move, net_factor)
+                except magnet_jogs.OverCurrentException, e:
+                    if len(factors) == 1:
+                        self.on_error(e)
+                    else:
+                        for factor in factors:
+                            self._write(move, factor)
+                except Exception, e:
+                    self.on_error(e)
+                else:
+                    self._written()
+        finally:
+            self.busy = False
+
+    def _write(self, move, factor):
+        """Write a single move, reporting any error."""
+        try:
+            self.writer.write(move, factor)
+        except Exception, e:
+            self.on_error(e)
+        else:
+            self._written()
+
+    def _written(self):
+        if self.on_written is not None:
+            self.on_written()
+
 
 class PvWriter(AbstractWriter):
 
-    """Write coordinated magnets moves to PV's on the machine."""
+    """
+    Write coordinated magnets moves to PV's on the machine.
+
+    All the PVs of a move are written in parallel, waiting for each put to
+    complete, and then read back to confirm the values were applied.
+    """
+
+    TIMEOUT = 5  # Seconds to wait for a put to complete.
+    READBACK_TOLERANCE = 1e-6  # Amps between a written and read back value.
 
     def __init__(self):
 
@@ -44,22 +175,70 @@ class PvWriter(AbstractWriter):
         self.scale_pvs = [ctrl + ':WFSCA' for ctrl in PvReferences.CTRLS]
         self.set_scale_pvs = [name + ':SETWFSCA' for name in PvReferences.NAMES]
         self.offset_pvs = [ctrl + ':OFFSET' for ctrl in PvReferences.CTRLS]
+        self.last_results = []
 
     def write(self, move, factor):
-        if move == 'SCALE':
+        if move == magnet_jogs.Moves.SCALE:
             scale_jog_values = self.magnet_coordinator.jog(
                 PvMonitors.get_instance().get_scales(), move, factor)
             set_scale_jog_values = self.magnet_coordinator.jog(
                 PvMonitors.get_instance().get_set_scales(), move, factor)
-            self.write_to_pvs(self.scale_pvs, scale_jog_values)
-            self.write_to_pvs(self.set_scale_pvs, set_scale_jog_values)
+            self.write_to_pvs(
+                self.scale_pvs + self.set_scale_pvs,
+                np.concatenate((scale_jog_values, set_scale_jog_values)))
         else:
             offset_jog_values = self.magnet_coordinator.jog(
                 PvMonitors.get_instance().get_offsets(), move, factor)
             self.write_to_pvs(self.offset_pvs, offset_jog_values)
 
+    def steer(self, displacements=None, angles=None):
+        pvm = PvMonitors.get_instance()
+        offsets = self.magnet_coordinator.solve(
+            pvm.get_offsets(), pvm.get_scales(), displacements, angles)
+        self.write_to_pvs(self.offset_pvs, offsets)
+
     def write_to_pvs(self, pvs, jog_values):
-        caput(pvs, jog_values)
+        """
+        Write values to PVs in parallel and confirm them.
+
+        Args:
+            pvs (list): names of the PVs to write
+            jog_values (list): values to write, one per PV
+        Returns:
+            list: a WriteResult per PV, also kept as last_results
+        Raises:
+            WriteError: if any put failed or its readback differs
+        """
+        backend = PvMonitors.get_instance().backend
+        start = time.time()
+        tasks = [cothread.Spawn(self._put, backend, pv, value, start)
+                 for pv, value in zip(pvs, jog_values)]
+        results = [task.Wait() for task in tasks]
+
+        readbacks = backend.caget(pvs, timeout=self.TIMEOUT, throw=False)
+        for result, readback in zip(results, readbacks):
+            if result.ok and not (getattr(readback, 'ok', True) and abs(
+                    readback - result.value) <= self.READBACK_TOLERANCE):
+                result.ok = False
+                result.error = 'read back %s' % (readback,)
+
+        timings = Timings.get_instance()
+        for result in results:
+            timings.record(Stages.WRITE, result.latency)
+        self.last_results = results
+
+        failures = [result for result in results if not result.ok]
+        if failures:
+            raise WriteError(failures)
+        return results
+
+    def _put(self, backend, pv, value, start):
+        """Write one PV, waiting for completion, and time it."""
+        reply = backend.caput(pv, value, wait=True, timeout=self.TIMEOUT,
+                              throw=False)
+        ok = getattr(reply, 'ok', True)
+        return WriteResult(pv, value, ok, time.time() - start,
+                           None if ok else str(reply))
 
 
 class SimWriter(AbstractWriter):
@@ -85,9 +264,16 @@ class SimWriter(AbstractWriter):
         else:
             jog_values = self.magnet_coordinator.jog(
                 self.controller.offsets, move, factor)
-        self.check_bounds(move, jog_values)
+        self.magnet_coordinator.check_bounds(
+            self.controller.offsets, self.controller.scales, move, factor)
         self.update_sim_values(move, jog_values)
 
+    def steer(self, displacements=None, angles=None):
+        offsets = self.magnet_coordinator.solve(
+            self.controller.offsets, self.controller.scales,
+            displacements, angles)
+        self.controller.update_sim(Arrays.OFFSETS, offsets)
+
     def update_sim_values(self, key, jog_values):
         """Pass jog values to the controller."""
         if key == magnet_jogs.Moves.SCALE:
@@ -101,23 +287,3 @@ class SimWriter(AbstractWriter):
         self.controller.update_sim(Arrays.SCALES, simulated_scales)
         simulated_offsets = PvMonitors.get_instance().get_offsets()
         self.controller.update_sim(Arrays.OFFSETS, simulated_offsets)
-
-    def check_bounds(self, key, jog_values):
-        """Raise exception if new value exceeds magnet current limit."""
-        pvm = PvMonitors.get_instance()
-        scales = self.controller.scales
-        offsets = self.controller.offsets
-        imaxs = pvm.get_max_currents()
-        imins = pvm.get_min_currents()
-
-        # Check errors on limits.
-        for idx, (max_val, min_val, offset, scale, new_val) in enumerate(
-                zip(imaxs, imins, offsets, scales, jog_values)):
-            if key == magnet_jogs.Moves.SCALE:
-                high = offset + new_val
-                low = offset - new_val
-            else:
-                high = new_val + scale
-                low = new_val - scale
-            if high > max_val or low < min_val:
-                raise magnet_jogs.OverCurrentException(idx)